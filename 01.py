@@ -5,6 +5,34 @@ import calendar
 import json
 import os
 import csv
+import sys
+import mmap
+import array
+import struct
+import argparse
+import re
+import random
+import statistics
+import tempfile
+import time
+import io
+import bisect
+import heapq
+import collections
+import functools
+import operator
+import contextlib
+import cProfile
+import pstats
+import tracemalloc
+import gzip
+import shutil
+import queue
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import threading
+import smtplib
+from email.message import EmailMessage
+from tkinter import simpledialog
 
 # ================= 引入 Matplotlib 繪圖套件 =================
 # 注意：必須指定後端為 TkAgg，才能在 Tkinter 視窗中顯示圖表
@@ -12,6 +40,7 @@ import matplotlib
 matplotlib.use("TkAgg")
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import matplotlib.pyplot as plt
 
 # 設定 Matplotlib 字型以支援中文 (避免出現方塊亂碼)
@@ -20,6 +49,14 @@ plt.rcParams['axes.unicode_minus'] = False # 解決負號顯示問題
 
 # 資料儲存檔名
 DATA_FILE = "erp_v20_data.json"
+# 二進位快照檔名 (啟動較快；JSON 則保留作為交換格式)
+SNAPSHOT_FILE = "erp_v20_data.erpb"
+# 快照匯出的 JSON 交換檔名 (與 DATA_FILE 分開，匯出時不會蓋掉正在使用的資料檔)
+EXPORT_FILE = "erp_v20_data.export.json"
+# 儲存格式："json" (預設) 或 "binary" (使用上面的快照檔)
+STORAGE_FORMAT = "json"
+# 備份資料夾 (完整備份 + 差異備份，gzip 壓縮)
+BACKUP_DIR = "backups"
 
 # ================= 設定全域配色 (方便日後統一修改風格) =================
 COLORS = {
@@ -40,82 +77,2479 @@ FONT_MAIN = ("Microsoft JhengHei UI", 12)
 FONT_BOLD = ("Microsoft JhengHei UI", 13, "bold")
 FONT_TITLE = ("Microsoft JhengHei UI", 12, "bold")
 
+# ================= 資料結構版本與遷移 =================
+# 資料檔內以 schema_version 記錄目前結構版本。每個遷移只會執行一次，
+# 執行後立即存檔，之後啟動就不必再逐筆補欄位。
+# 新增遷移的方法：寫一個函式並加上 @schema_migration(新版本號, 說明)，
+# 函式可先處理頂層欄位，再回傳 {表名: 逐筆處理函式}；所有待執行的遷移
+# 會合併成「每張表只走一次」的逐筆處理，大型資料也只需讀寫各一次。
+# 需要看到逐筆處理結果的工作，可放在回傳值的 '__after__' (於所有逐筆處理完成後執行)。
+SCHEMA_VERSION = 5
+LEGACY_DATA_FILES = ["erp_v19_data.json"]  # 舊版檔名，找不到 DATA_FILE 時依序嘗試
+MIGRATIONS = []
+
+
+def schema_migration(version, description):
+    """ 註冊遷移的裝飾器 (版本號必須遞增且不可重複) """
+    def decorator(fn):
+        if any(m['version'] == version for m in MIGRATIONS):
+            raise ValueError(f"重複的遷移版本: {version}")
+        MIGRATIONS.append({'version': version, 'description': description, 'fn': fn})
+        MIGRATIONS.sort(key=lambda m: m['version'])
+        return fn
+    return decorator
+
+
+@schema_migration(1, "補齊 v19 以前缺少的欄位 (received_qty、email_status、sales_db...)")
+def _migrate_default_fields(data):
+    if 'sales_db' not in data: data['sales_db'] = []
+    today = datetime.datetime.now().strftime('%Y-%m-%d')
+
+    def po(p):
+        if 'received_qty' not in p: p['received_qty'] = 0
+        if 'delivery_date' not in p: p['delivery_date'] = today
+        if 'mfg_date' not in p: p['mfg_date'] = ''
+        if 'email_status' not in p: p['email_status'] = '未傳送'
+        if 'source' not in p: p['source'] = '直接輸入'
+
+    def ap(a):
+        if 'status' not in a: a['status'] = 'Unpaid'
+
+    def sales(s):
+        if 'price' not in s: s['price'] = 0
+        if 'total' not in s: s['total'] = 0
+
+    return {'po_db': po, 'ap_db': ap, 'sales_db': sales}
+
+
+@schema_migration(2, "新增廠商聯絡資料 vendor_contacts (供 Email 發送採購單)")
+def _migrate_vendor_contacts(data):
+    data.setdefault('vendor_contacts', {})
+
+
+@schema_migration(3, "應付帳款補上結構化的 item / qty 欄位 (由摘要「進貨 品項 x數量」解析)")
+def _migrate_ap_item_qty(data):
+    pattern = re.compile(r"^進貨 (.+?)(?: x(\d+))?$")
+
+    def ap(a):
+        m = pattern.match(a.get('desc', ''))
+        if not m: return
+        a.setdefault('item', m.group(1))
+        if m.group(2) is not None: a.setdefault('qty', int(m.group(2)))
+
+    return {'ap_db': ap}
+
+
+DEFAULT_LOCATION = "總倉"
+
+
+@schema_migration(4, "多倉庫：現有庫存移入預設倉庫，新增 locations / stock_loc_db / transfer_db")
+def _migrate_locations(data):
+    data.setdefault('locations', [DEFAULT_LOCATION])
+    data.setdefault('stock_loc_db', {DEFAULT_LOCATION: dict(data.get('stock_db', {}))})
+    data.setdefault('transfer_db', [])
+
+    def sales(s):
+        s.setdefault('location', DEFAULT_LOCATION)
+
+    def ap(a):
+        if 'item' in a: a.setdefault('location', DEFAULT_LOCATION)
+
+    return {'sales_db': sales, 'ap_db': ap}
+
+
+@schema_migration(5, "記錄期初庫存 (現有庫存中無法由進貨/銷貨/調撥紀錄解釋的部分)，供對帳使用")
+def _migrate_opening_stock(data):
+    # 依賴 v3/v4 的逐筆處理 (AP 的品項/數量、倉庫欄位)，所以在逐筆處理時累計，最後再算期初
+    if 'opening_stock' in data: return {}
+    net = {}
+
+    def move(loc, item, qty):
+        net[(loc, item)] = net.get((loc, item), 0) + qty
+
+    def ap(a):
+        if 'qty' in a: move(a.get('location', DEFAULT_LOCATION), a['item'], a['qty'])
+
+    def sales(s):
+        move(s.get('location', DEFAULT_LOCATION), s['item'], -s['qty'])
+
+    def transfer(t):
+        move(t['from'], t['item'], -t['qty'])
+        move(t['to'], t['item'], t['qty'])
+
+    def after():
+        opening = {}
+        for loc, items in data.get('stock_loc_db', {}).items():
+            for item, qty in items.items():
+                q = qty - net.pop((loc, item), 0)
+                if q: opening.setdefault(loc, {})[item] = q
+        for (loc, item), q in net.items():
+            if q: opening.setdefault(loc, {})[item] = -q
+        data['opening_stock'] = opening
+
+    return {'ap_db': ap, 'sales_db': sales, 'transfer_db': transfer, '__after__': after}
+
+
+def apply_migrations(data):
+    """ 執行所有尚未套用的遷移 (直接修改 data)，回傳執行了哪些版本 """
+    current = data.get('schema_version', 0)
+    if current > SCHEMA_VERSION:
+        print(f"警告: 資料結構版本 ({current}) 比程式 ({SCHEMA_VERSION}) 新")
+    pending = [m for m in MIGRATIONS if m['version'] > current]
+    if not pending: return []
+
+    handlers, after = {}, []
+    for m in pending:
+        for table, fn in (m['fn'](data) or {}).items():
+            if table == '__after__': after.append(fn)
+            else: handlers.setdefault(table, []).append(fn)
+    # 每張表只走訪一次，依版本順序套用各遷移的逐筆處理
+    for table, fns in handlers.items():
+        for record in data.get(table, []):
+            for fn in fns: fn(record)
+    for fn in after: fn()
+
+    data['schema_version'] = pending[-1]['version']
+    return [m['version'] for m in pending]
+
+
+def write_json_file(data, path):
+    """ 以串流方式寫出 JSON (json.dump 逐段寫入，不會先組出完整字串)，寫完再取代原檔 """
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4, default=_json_default)
+    os.replace(tmp, path)
+
+# ================= 資料列型別 (__slots__，取代每列一個 dict) =================
+class _Missing:
+    """ 紀錄裡沒有的欄位 (與 None 區分；轉回 dict 時省略，布林值為 False) """
+    __slots__ = ()
+    def __bool__(self): return False
+    def __repr__(self): return "MISSING"
+
+MISSING = _Missing()
+
+
+class Record:
+    """
+    以 __slots__ 存放欄位的資料列，每筆只佔固定大小，不再重複存放欄位名稱。
+    熱點迴圈直接讀屬性 (po.qty)；其餘程式仍可用 po['qty']、get、in、setdefault，
+    FIELDS 以外的欄位放在 _extra，轉回 JSON 時原樣保留。
+    """
+    __slots__ = ('_extra',)
+    FIELDS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._FIELD_SET = frozenset(cls.FIELDS)
+        cls._values = operator.attrgetter(*cls.FIELDS)  # 一次取出所有欄位值 (tuple)
+
+    def __init__(self, **fields):
+        for f in self.FIELDS: setattr(self, f, fields.pop(f, MISSING))
+        self._extra = fields or None
+
+    @classmethod
+    def from_dict(cls, d):
+        r = cls.__new__(cls)
+        get = d.get
+        for f in cls.FIELDS: setattr(r, f, get(f, MISSING))
+        r._extra = None if d.keys() <= cls._FIELD_SET else {k: v for k, v in d.items() if k not in cls._FIELD_SET}
+        return r
+
+    @classmethod
+    def coerce(cls, row):
+        return row if isinstance(row, Record) else cls.from_dict(row)
+
+    def to_dict(self):
+        vals = self._values(self)
+        out = dict(zip(self.FIELDS, vals))
+        if MISSING in vals: out = {f: v for f, v in out.items() if v is not MISSING}
+        if self._extra: out.update(self._extra)
+        return out
+
+    # --- 與 dict 相容的存取方式 ---
+    def __getitem__(self, key):
+        if key in self._FIELD_SET: v = getattr(self, key)
+        else: v = self._extra.get(key, MISSING) if self._extra else MISSING
+        if v is MISSING: raise KeyError(key)
+        return v
+
+    def __setitem__(self, key, value):
+        if key in self._FIELD_SET: setattr(self, key, value)
+        else:
+            if self._extra is None: self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key not in self: raise KeyError(key)
+        if key in self._FIELD_SET: setattr(self, key, MISSING)
+        else: del self._extra[key]
+
+    def __contains__(self, key):
+        if key in self._FIELD_SET: return getattr(self, key) is not MISSING
+        return bool(self._extra) and key in self._extra
+
+    def get(self, key, default=None):
+        if key in self._FIELD_SET:
+            v = getattr(self, key)
+            return default if v is MISSING else v
+        return self._extra.get(key, default) if self._extra else default
+
+    def setdefault(self, key, default=None):
+        if key not in self: self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key not in self:
+            if default: return default[0]
+            raise KeyError(key)
+        v = self[key]
+        del self[key]
+        return v
+
+    def keys(self): return self.to_dict().keys()
+    def items(self): return self.to_dict().items()
+    def values(self): return self.to_dict().values()
+    def __iter__(self): return iter(self.to_dict())
+    def __len__(self): return len(self.to_dict())
+    def copy(self): return type(self).from_dict(self.to_dict())
+
+    def __eq__(self, other):
+        if isinstance(other, Record): other = other.to_dict()
+        return isinstance(other, dict) and self.to_dict() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class PO(Record):
+    FIELDS = ('id', 'source', 'vendor', 'item', 'mfg_date', 'qty', 'price', 'delivery_date', 'received_qty',
+              'status', 'email_status')
+    __slots__ = FIELDS
+
+class SalesLine(Record):
+    FIELDS = ('date', 'item', 'qty', 'price', 'total', 'location')
+    __slots__ = FIELDS
+
+class APEntry(Record):
+    FIELDS = ('id', 'po_ref', 'date', 'vendor', 'desc', 'item', 'qty', 'location', 'amt', 'status', 'pay_date')
+    __slots__ = FIELDS
+
+RECORD_TABLES = {'po_db': PO, 'sales_db': SalesLine, 'ap_db': APEntry}
+
+
+def records_from_data(data):
+    """ 把 data 中各表的 dict 列轉成 Record (已是 Record 的不動，原 list 就地替換) """
+    for table, cls in RECORD_TABLES.items():
+        rows = data.get(table)
+        if rows and not all(isinstance(r, cls) for r in rows):
+            rows[:] = [cls.coerce(r) for r in rows]
+
+def _json_default(obj):
+    if isinstance(obj, Record): return obj.to_dict()
+    raise TypeError(f"無法轉成 JSON: {type(obj).__name__}")
+
+# ================= 二進位快照格式 (.erpb) =================
+# 檔案結構 (全部為本機位元組序，並記錄於標頭中):
+#   MAGIC(4) | 格式版本 u16 | 標頭長度 u32 | 標頭 JSON | 補齊到 8 bytes | 資料區
+# 資料區由多個「欄」組成，每一欄是一個連續陣列 (array 模組格式)，
+# 所有字串集中放在一個字串表，欄位內只存索引，所以重複的廠商/品項/日期只存一次。
+# 讀取時用 mmap 對應檔案，直接以 memoryview 轉型成陣列，不需逐筆解析文字。
+SNAPSHOT_MAGIC = b"ERPB"
+SNAPSHOT_VERSION = 1
+_SNAP_NONE = 0xFFFFFFFF  # 字串索引欄位的「此列沒有這個欄位」標記
+_SNAP_MISSING = object()
+
+
+def _snapshot_column(values):
+    """ 判斷一欄資料的儲存型別，回傳 (kind, array) """
+    if all(type(v) is int for v in values):
+        return 'q', array.array('q', values)
+    if all(type(v) is float for v in values):
+        return 'd', array.array('d', values)
+    if all(type(v) in (int, float) for v in values):
+        # 整數與浮點混合 (例如單價 30 與 300.0)：存成 double，另記哪些原本是整數
+        return 'n', (array.array('d', values), array.array('B', [type(v) is int for v in values]))
+    return None, None
+
+
+def write_snapshot(data, path):
+    """ 將資料寫成二進位快照 (先寫暫存檔再取代，避免寫到一半損毀) """
+    strings, string_idx = [], {}
+
+    def intern(s):
+        i = string_idx.get(s)
+        if i is None:
+            i = string_idx[s] = len(strings)
+            strings.append(s)
+        return i
+
+    blocks, offset = [], 0
+
+    def add_block(arr):
+        nonlocal offset
+        raw = arr.tobytes()
+        blocks.append(raw)
+        start = offset
+        pad = (-len(raw)) % 8
+        if pad: blocks.append(b"\0" * pad)
+        offset += len(raw) + pad
+        return [start, len(raw)]
+
+    def encode_columns(rows, names):
+        cols = []
+        for name in names:
+            values = [r.get(name, _SNAP_MISSING) for r in rows]
+            kind, arr = (None, None) if _SNAP_MISSING in values else _snapshot_column(values)
+            if kind == 'n':
+                cols.append([name, kind, add_block(arr[0]), add_block(arr[1])])
+            elif kind:
+                cols.append([name, kind, add_block(arr)])
+            elif all(type(v) is str or v is _SNAP_MISSING for v in values):
+                idx = array.array('I', [_SNAP_NONE if v is _SNAP_MISSING else intern(v) for v in values])
+                cols.append([name, 's', add_block(idx)])
+            else:
+                # 其他型別 (巢狀結構、布林、None...) 退回以 JSON 字串存放
+                idx = array.array('I', [_SNAP_NONE if v is _SNAP_MISSING else intern(json.dumps(v, ensure_ascii=False))
+                                        for v in values])
+                cols.append([name, 'j', add_block(idx)])
+        return cols
+
+    header = {"byteorder": sys.byteorder, "entries": {}}
+    for key, value in data.items():
+        if isinstance(value, list) and value and all(isinstance(r, (dict, Record)) for r in value):
+            value = [r.to_dict() if isinstance(r, Record) else r for r in value]
+            names = list(dict.fromkeys(k for r in value for k in r))
+            header["entries"][key] = {"type": "table", "rows": len(value), "columns": encode_columns(value, names)}
+        elif isinstance(value, dict) and all(type(v) in (int, float) for v in value.values()):
+            rows = [{"k": k, "v": v} for k, v in value.items()]
+            header["entries"][key] = {"type": "map", "rows": len(rows), "columns": encode_columns(rows, ["k", "v"])}
+        else:
+            header["entries"][key] = {"type": "json", "value": value}
+
+    # 字串表：一整塊 UTF-8 + 位移陣列
+    encoded = [s.encode("utf-8") for s in strings]
+    bounds = array.array('Q', [0])
+    for b in encoded: bounds.append(bounds[-1] + len(b))
+    header["strings"] = {"count": len(strings), "bounds": add_block(bounds), "blob": add_block(array.array('B', b"".join(encoded)))}
+
+    head = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    prefix_len = len(SNAPSHOT_MAGIC) + struct.calcsize("<HI")
+    head += b" " * ((-(prefix_len + len(head))) % 8)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack("<HI", SNAPSHOT_VERSION, len(head)))
+        f.write(head)
+        for b in blocks: f.write(b)
+    os.replace(tmp, path)
+
+
+def read_snapshot(path):
+    """ 以 mmap 讀取二進位快照，回傳與 JSON 相同結構的 dict """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0: raise ValueError("快照檔為空")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                if bytes(view[:4]) != SNAPSHOT_MAGIC: raise ValueError("不是 ERPB 快照檔")
+                version, head_len = struct.unpack_from("<HI", view, 4)
+                if version != SNAPSHOT_VERSION: raise ValueError(f"不支援的快照版本: {version}")
+                base = 4 + struct.calcsize("<HI")
+                header = json.loads(bytes(view[base:base + head_len]).decode("utf-8"))
+                base += head_len
+                swap = header["byteorder"] != sys.byteorder
+
+                def column(block, code):
+                    start, length = block
+                    if not swap:
+                        mv = view[base + start:base + start + length].cast(code)
+                        try: return mv.tolist()
+                        finally: mv.release()
+                    arr = array.array(code)
+                    arr.frombytes(view[base + start:base + start + length])
+                    arr.byteswap()
+                    return arr.tolist()
+
+                bounds = column(header["strings"]["bounds"], 'Q')
+                s_start = base + header["strings"]["blob"][0]
+                strings = [str(view[s_start + a:s_start + b], "utf-8") for a, b in zip(bounds, bounds[1:])]
+
+                def decode_columns(spec):
+                    names, cols, sparse = [], [], []
+                    for col in spec["columns"]:
+                        name, kind = col[0], col[1]
+                        if kind == 'n':
+                            vals = [int(v) if is_int else v for v, is_int in zip(column(col[2], 'd'), column(col[3], 'B'))]
+                        elif kind in ('q', 'd'):
+                            vals = column(col[2], kind)
+                        else:
+                            idx = column(col[2], 'I')
+                            if kind == 's':
+                                vals = [strings[i] if i != _SNAP_NONE else _SNAP_MISSING for i in idx]
+                            else:
+                                vals = [json.loads(strings[i]) if i != _SNAP_NONE else _SNAP_MISSING for i in idx]
+                            if _SNAP_NONE in idx: sparse.append(name)
+                        names.append(name)
+                        cols.append(vals)
+                    rows = [dict(zip(names, vals)) for vals in zip(*cols)] if cols else [{} for _ in range(spec["rows"])]
+                    for name in sparse:
+                        for r in rows:
+                            if r[name] is _SNAP_MISSING: del r[name]
+                    return rows
+
+                data = {}
+                for key, spec in header["entries"].items():
+                    if spec["type"] == "table":
+                        data[key] = decode_columns(spec)
+                    elif spec["type"] == "map":
+                        data[key] = {r["k"]: r["v"] for r in decode_columns(spec)}
+                    else:
+                        data[key] = spec["value"]
+                return data
+            finally:
+                view.release()
+
+# ================= 效能量測 (選用，預設關閉) =================
+# 設定環境變數 ERP_PROFILE=1 可在啟動時開啟；也可在隱藏的「診斷」分頁 (Ctrl+Shift+D) 切換。
+# 關閉時每個被量測的函式只多一次布林判斷。
+class Instrumentation:
+    """ 收集計時區段 (含直方圖)、計數器，並可對接下來 N 個使用者動作做 cProfile """
+    BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf'))
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.profile_remaining = 0   # 尚需擷取 cProfile 的動作數
+        self.profiler = None
+        self.profile_stats = None    # 擷取中累積的 pstats
+        self.profile_dir = "."
+        self.last_profile = ""       # 最近一次 cProfile 的文字摘要
+        self.last_profile_file = None
+        self.reset()
+
+    def reset(self):
+        self.spans = {}     # 名稱 -> {'count', 'total', 'max', 'hist'}
+        self.counters = {}  # 名稱 -> 累計值
+
+    def record(self, name, seconds):
+        st = self.spans.get(name)
+        if st is None:
+            st = self.spans[name] = {'count': 0, 'total': 0.0, 'max': 0.0, 'hist': [0] * len(self.BUCKETS_MS)}
+        ms = seconds * 1000
+        st['count'] += 1
+        st['total'] += ms
+        if ms > st['max']: st['max'] = ms
+        st['hist'][bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+
+    def count(self, name, n=1):
+        if self.enabled: self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextlib.contextmanager
+    def span(self, name):
+        if not self.enabled:
+            yield
+            return
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0)
+
+    def wrap_action(self, name, fn):
+        """ 包裝按鈕等使用者動作：計時，並在需要時擷取 cProfile """
+        @functools.wraps(fn)
+        def handler(*args, **kwargs):
+            if not self.enabled and not self.profile_remaining: return fn(*args, **kwargs)
+            profiling = self.profile_remaining > 0 and self.profiler is None
+            if profiling:
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+            try:
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            finally:
+                if profiling: self._finish_profile(name)
+        return handler
+
+    def start_profile(self, n_actions, out_dir="."):
+        """ 對接下來 n_actions 個使用者動作擷取 cProfile (結果合併成一份) """
+        self.profile_remaining = n_actions
+        self.profile_dir = out_dir
+        self.profile_stats = None
+
+    def _finish_profile(self, name):
+        self.profiler.disable()
+        if self.profile_stats is None: self.profile_stats = pstats.Stats(self.profiler)
+        else: self.profile_stats.add(self.profiler)
+        self.profiler = None
+        self.profile_remaining -= 1
+        if self.profile_remaining > 0: return
+        stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.last_profile_file = os.path.join(self.profile_dir, f"erp_profile_{stamp}.prof")
+        self.profile_stats.dump_stats(self.last_profile_file)
+        buf = io.StringIO()
+        self.profile_stats.stream = buf
+        self.profile_stats.sort_stats("cumulative").print_stats(30)
+        self.last_profile = buf.getvalue()
+        self.profile_stats = None
+
+    def percentile(self, name, q):
+        """ 由直方圖估計百分位數 (回傳該區間的上界，單位 ms) """
+        st = self.spans[name]
+        target, seen = q * st['count'], 0
+        for bound, n in zip(self.BUCKETS_MS, st['hist']):
+            seen += n
+            if seen >= target: return min(bound, st['max'])
+        return st['max']
+
+    def summary(self):
+        rows = []
+        for name, st in sorted(self.spans.items(), key=lambda kv: -kv[1]['total']):
+            rows.append({'name': name, 'count': st['count'], 'total_ms': st['total'], 'avg_ms': st['total'] / st['count'],
+                         'max_ms': st['max'], 'p50_ms': self.percentile(name, 0.5), 'p95_ms': self.percentile(name, 0.95),
+                         'hist': dict(zip([str(b) for b in self.BUCKETS_MS], st['hist']))})
+        return {'spans': rows, 'counters': dict(sorted(self.counters.items()))}
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dict(self.summary(), timestamp=datetime.datetime.now().isoformat(timespec='seconds')),
+                      f, ensure_ascii=False, indent=2)
+
+
+INSTRUMENT = Instrumentation(enabled=os.environ.get("ERP_PROFILE") == "1")
+
+
+def instrumented(name=None):
+    """ 方法裝飾器：量測開啟時記錄此函式的耗時 """
+    def decorator(fn):
+        label = name or fn.__name__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not INSTRUMENT.enabled: return fn(*args, **kwargs)
+            with INSTRUMENT.span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# ================= 郵件發送佇列 (背景執行緒) =================
+# SMTP 設定可由環境變數提供；未設定主機時改用 OutboxTransport，
+# 將信件寫成 .eml 檔放到 outbox 資料夾 (也方便測試與稽核)。
+SMTP_CONFIG = {
+    "host": os.environ.get("ERP_SMTP_HOST", ""),
+    "port": int(os.environ.get("ERP_SMTP_PORT", "587")),
+    "user": os.environ.get("ERP_SMTP_USER", ""),
+    "password": os.environ.get("ERP_SMTP_PASSWORD", ""),
+    "use_tls": os.environ.get("ERP_SMTP_TLS", "1") == "1",
+    "sender": os.environ.get("ERP_SMTP_SENDER", "purchasing@example.com"),
+}
+OUTBOX_DIR = "outbox"
+EMAIL_DRAIN_TIMEOUT = 30   # 關閉視窗時最多等正在寄的那封信幾秒
+
+
+def render_po_email(po, to_addr, sender):
+    """ 產生採購單通知信 """
+    msg = EmailMessage()
+    msg["Subject"] = f"採購單 {po['id']} - {po['item']} x{po['qty']}"
+    msg["From"] = sender
+    msg["To"] = to_addr
+    msg.set_content(
+        f"{po['vendor']} 您好：\n\n"
+        f"敬請依下列採購單出貨：\n"
+        f"  單號：{po['id']}\n"
+        f"  品項：{po['item']}\n"
+        f"  數量：{po['qty']}\n"
+        f"  單價：{po['price']}\n"
+        f"  總金額：{po['qty'] * po['price']:,.0f}\n"
+        f"  預計交期：{po['delivery_date']}\n\n"
+        f"如有問題請直接回覆此信，謝謝。\n"
+    )
+    return msg
+
+
+class SMTPTransport:
+    """ 透過 SMTP 寄信；同一批次重複使用同一條連線，斷線時自動重連 """
+    def __init__(self, host, port=587, user="", password="", use_tls=True, timeout=30):
+        self.host, self.port = host, port
+        self.user, self.password = user, password
+        self.use_tls, self.timeout = use_tls, timeout
+        self.conn = None
+
+    def send(self, msg):
+        if self.conn is None:
+            self.conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.use_tls:
+                self.conn.starttls()
+            if self.user:
+                self.conn.login(self.user, self.password)
+        self.conn.send_message(msg)
+
+    def reset(self):
+        """ 發生錯誤後丟棄連線，下次 send 會重新連線 """
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            try: conn.close()
+            except Exception: pass
+
+    def close(self):
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            try: conn.quit()
+            except Exception: pass
+
+
+class OutboxTransport:
+    """ 不實際寄出，將信件存成 .eml 檔 (未設定 SMTP 時的替代方案) """
+    def __init__(self, folder=OUTBOX_DIR):
+        self.folder = folder
+
+    def send(self, msg):
+        os.makedirs(self.folder, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        with open(os.path.join(self.folder, f"{stamp}.eml"), "wb") as f:
+            f.write(bytes(msg))
+
+    def reset(self): pass
+    def close(self): pass
+
+
+def default_transport():
+    if SMTP_CONFIG["host"]:
+        return SMTPTransport(SMTP_CONFIG["host"], SMTP_CONFIG["port"], SMTP_CONFIG["user"],
+                             SMTP_CONFIG["password"], SMTP_CONFIG["use_tls"])
+    return OutboxTransport()
+
+
+class EmailDispatcher:
+    """
+    背景寄信佇列：submit() 立即返回，由單一工作執行緒依序寄出。
+    暫時性錯誤會以指數退避重試；收件者被拒等永久錯誤則直接回報失敗。
+    結果放在 results 佇列，由 Tk 主執行緒以 poll_results() 取回後再更新資料 (Tk 元件不可跨執行緒操作)。
+    """
+    PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPAuthenticationError)
+
+    def __init__(self, transport_factory=default_transport, sender=None, max_retries=4, backoff=1.0, idle_close=5.0):
+        self.transport_factory = transport_factory
+        self.sender = sender or SMTP_CONFIG["sender"]
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.idle_close = idle_close  # 佇列閒置幾秒後關閉連線
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.pending = 0
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, po, to_addr):
+        """ 排入一封採購單通知信 (po 會先複製，背景執行緒不會碰到主程式的資料) """
+        with self.lock:
+            self.pending += 1
+            self.jobs.put((dict(po), to_addr))
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._worker, name="EmailDispatcher", daemon=True)
+                self.thread.start()
+
+    def cancel_pending(self):
+        """ 取消還在佇列中、尚未開始寄的信，回傳它們的採購單號 (正在寄的那封不受影響) """
+        cancelled = []
+        with self.lock:
+            while True:
+                try: po, _ = self.jobs.get_nowait()
+                except queue.Empty: break
+                cancelled.append(po['id'])
+                self.pending -= 1
+        return cancelled
+
+    def wait_idle(self, timeout):
+        """ 等正在寄的信完成 (最多 timeout 秒)，回傳是否已全部完成 """
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline: time.sleep(0.05)
+        return not self.pending
+
+    def poll_results(self):
+        """ 取回目前已完成的結果: [(po_id, ok, error_message)] """
+        done = []
+        while True:
+            try: done.append(self.results.get_nowait())
+            except queue.Empty: return done
+
+    def _worker(self):
+        transport = self.transport_factory()
+        try:
+            while True:
+                try:
+                    po, to_addr = self.jobs.get(timeout=self.idle_close)
+                except queue.Empty:
+                    transport.close()  # 閒置時釋放連線，下一批再重新建立
+                    with self.lock:
+                        if self.jobs.empty():
+                            self.thread = None
+                            return
+                    continue
+                ok, error = self._send_with_retry(transport, render_po_email(po, to_addr, self.sender))
+                # 先放結果再扣 pending：主執行緒看到 pending 為 0 時，結果一定已經可以取回
+                self.results.put((po['id'], ok, error))
+                with self.lock: self.pending -= 1
+        finally:
+            transport.close()
+
+    def _send_with_retry(self, transport, msg):
+        for attempt in range(self.max_retries + 1):
+            try:
+                transport.send(msg)
+                return True, ""
+            except self.PERMANENT_ERRORS as e:
+                transport.reset()
+                return False, str(e)
+            except (smtplib.SMTPException, OSError) as e:
+                transport.reset()
+                if attempt == self.max_retries: return False, str(e)
+                time.sleep(self.backoff * (2 ** attempt))
+
 # ================= 類別：輕量級月曆選擇器 =================
 class SimpleCalendar(tk.Toplevel):
     """
-    這是一個彈出式視窗，繼承自 Toplevel。
-    用來讓使用者點選日期，並將選到的日期回傳給主視窗。
+    這是一個彈出式視窗，繼承自 Toplevel。
+    用來讓使用者點選日期，並將選到的日期回傳給主視窗。
+    """
+    def __init__(self, parent, callback):
+        super().__init__(parent)
+        self.callback = callback  # 這是當使用者選好日期後，要執行的函式
+        self.title("選擇日期")
+        self.geometry("415x350")
+        self.configure(bg=COLORS["bg_white"])
+        self.current_date = datetime.date.today()
+        self.setup_ui()
+        self.show_month()
+
+    def setup_ui(self):
+        # 元件只建立一次，換月份時由 show_month 更新文字與顯示狀態
+        
+        # --- 頂部導航列 (上個月 / 顯示月份 / 下個月) ---
+        header = tk.Frame(self, bg=COLORS["primary"], pady=5)
+        header.pack(fill='x')
+        
+        btn_prev = tk.Button(header, text="<", command=lambda: self.change_month(-1),
+                             bg=COLORS["primary"], fg="white", bd=0, font=FONT_BOLD, activebackground=COLORS["secondary"])
+        btn_prev.pack(side='left', padx=15)
+        
+        self.title_var = tk.StringVar()
+        tk.Label(header, textvariable=self.title_var, 
+                 font=("Microsoft JhengHei UI", 14, "bold"), bg=COLORS["primary"], fg="white").pack(side='left', expand=True)
+        
+        btn_next = tk.Button(header, text=">", command=lambda: self.change_month(1),
+                             bg=COLORS["primary"], fg="white", bd=0, font=FONT_BOLD, activebackground=COLORS["secondary"])
+        btn_next.pack(side='right', padx=15)
+
+        # --- 星期標題 ---
+        days_frame = tk.Frame(self, bg=COLORS["bg_light"], pady=5)
+        days_frame.pack(fill='x')
+        days = ["一", "二", "三", "四", "五", "六", "日"]
+        for d in days: 
+            tk.Label(days_frame, text=d, width=5, bg=COLORS["bg_light"], font=FONT_BOLD).pack(side='left', expand=True)
+
+        # --- 日期按鈕區 (固定 6 週 x 7 天) ---
+        cal_frame = tk.Frame(self, bg=COLORS["bg_white"], padx=10, pady=10)
+        cal_frame.pack(expand=True, fill='both')
+        
+        self.day_buttons = []
+        for r in range(6):
+            for c in range(7):
+                btn = tk.Button(cal_frame, width=4, bg="white", relief="flat", font=FONT_MAIN)
+                # 加入滑鼠移入移出的變色效果
+                btn.bind("<Enter>", lambda e, b=btn: b.config(bg=COLORS["bg_light"]))
+                btn.bind("<Leave>", lambda e, b=btn: b.config(bg="white"))
+                btn.grid(row=r, column=c, padx=3, pady=3, ipady=3)
+                self.day_buttons.append(btn)
+
+    def show_month(self):
+        """ 依 current_date 更新標題與日期按鈕 """
+        self.title_var.set(self.current_date.strftime("%Y年 %m月"))
+        # 使用 calendar 模組取得當月的週曆矩陣
+        cal = calendar.monthcalendar(self.current_date.year, self.current_date.month)
+        for i, btn in enumerate(self.day_buttons):
+            r, c = divmod(i, 7)
+            day = cal[r][c] if r < len(cal) else 0
+            if day != 0: # 0 代表該格不屬於這個月份
+                btn.config(text=str(day), command=lambda d=day: self.select_date(d))
+                btn.grid()
+            else:
+                btn.grid_remove()
+
+    def change_month(self, delta):
+        """ 切換月份邏輯 """
+        month = self.current_date.month + delta
+        year = self.current_date.year
+        if month > 12: month = 1; year += 1
+        elif month < 1: month = 12; year -= 1
+        self.current_date = self.current_date.replace(year=year, month=month, day=1)
+        self.show_month()
+
+    def select_date(self, day):
+        """ 選擇日期後，格式化字串並呼叫 callback """
+        selected_date = self.current_date.replace(day=day).strftime("%Y-%m-%d")
+        self.callback(selected_date)
+        self.destroy()
+
+# ================= 類別：自動完成下拉選單 =================
+class AutocompleteCombobox(ttk.Combobox):
+    """
+    輸入時只把最相符的前幾名 (PrefixIndex.complete) 放進下拉選單，不再塞入整份清單。
+    連續按鍵會合併成一次查詢；accept 可再過濾候選 (例如只列出有庫存的品項)。
+    """
+    IGNORED_KEYS = ("Up", "Down", "Return", "KP_Enter", "Escape", "Tab")
+
+    def __init__(self, master, index, limit=15, accept=None, delay=60, **kwargs):
+        super().__init__(master, postcommand=self.update_matches, **kwargs)
+        self.index, self.limit, self.accept, self.delay = index, limit, accept, delay
+        self._pending = None
+        self.bind("<KeyRelease>", self._on_key, add="+")
+
+    def _on_key(self, event):
+        if event.keysym in self.IGNORED_KEYS: return
+        if self._pending: self.after_cancel(self._pending)
+        self._pending = self.after(self.delay, self.update_matches)
+
+    def update_matches(self):
+        self._pending = None
+        self['values'] = self.index.complete(self.get().strip(), self.limit, self.accept)
+
+# ================= 類別：採購交期行事曆 =================
+class DeliveryCalendar(tk.Toplevel):
+    """
+    月/週檢視的交期行事曆。每格顯示當天未交總量與筆數，逾期的日子標紅。
+    資料來自 ERPCore.delivery_index (只查詢畫面範圍內的日期)，
+    6x7 的格子元件只建立一次，翻頁時只改文字與顏色。
+    """
+    def __init__(self, parent, core):
+        super().__init__(parent)
+        self.core = core
+        self.title("採購交期行事曆")
+        self.geometry("980x760")
+        self.configure(bg=COLORS["bg_white"])
+        self.mode = 'month'
+        self.current_date = datetime.date.today()
+        self.selected = None
+        self.cell_dates = [None] * 42
+        self.setup_ui()
+        self.refresh()
+        # 視窗開著時，採購單異動會自動反映在行事曆上
+        token = core.bus.subscribe(('po',), lambda ch: self.refresh())
+        self.bind("<Destroy>", lambda e: e.widget is self and core.bus.unsubscribe(token))
+
+    def setup_ui(self):
+        header = tk.Frame(self, bg=COLORS["primary"], pady=5)
+        header.pack(fill='x')
+        tk.Button(header, text="<", command=lambda: self.move(-1), bg=COLORS["primary"], fg="white", bd=0,
+                  font=FONT_BOLD, activebackground=COLORS["secondary"]).pack(side='left', padx=15)
+        self.title_var = tk.StringVar()
+        tk.Label(header, textvariable=self.title_var, font=("Microsoft JhengHei UI", 14, "bold"),
+                 bg=COLORS["primary"], fg="white").pack(side='left', expand=True)
+        tk.Button(header, text=">", command=lambda: self.move(1), bg=COLORS["primary"], fg="white", bd=0,
+                  font=FONT_BOLD, activebackground=COLORS["secondary"]).pack(side='right', padx=15)
+        self.mode_btn = tk.Button(header, text="週檢視", command=self.toggle_mode, bg="white", fg=COLORS["primary"],
+                                  relief="flat", font=FONT_MAIN)
+        self.mode_btn.pack(side='right', padx=5)
+        tk.Button(header, text="今天", command=self.go_today, bg="white", fg=COLORS["primary"],
+                  relief="flat", font=FONT_MAIN).pack(side='right', padx=5)
+
+        self.summary_var = tk.StringVar()
+        tk.Label(self, textvariable=self.summary_var, font=FONT_BOLD, bg=COLORS["bg_white"],
+                 fg=COLORS["danger"]).pack(fill='x', pady=5)
+
+        days_frame = tk.Frame(self, bg=COLORS["bg_light"], pady=5)
+        days_frame.pack(fill='x', padx=10)
+        for c, d in enumerate(["一", "二", "三", "四", "五", "六", "日"]):
+            days_frame.columnconfigure(c, weight=1, uniform="day")
+            tk.Label(days_frame, text=d, bg=COLORS["bg_light"], font=FONT_BOLD).grid(row=0, column=c)
+
+        grid = tk.Frame(self, bg=COLORS["bg_light"])
+        grid.pack(fill='both', expand=True, padx=10)
+        self.cells = []
+        for i in range(42):
+            r, c = divmod(i, 7)
+            grid.columnconfigure(c, weight=1, uniform="day")
+            grid.rowconfigure(r, weight=1, uniform="week")
+            cell = tk.Frame(grid, bg="white", highlightthickness=2, highlightbackground="white", cursor="hand2")
+            cell.grid(row=r, column=c, sticky='nsew', padx=1, pady=1)
+            lbl_day = tk.Label(cell, anchor='nw', bg="white", font=FONT_BOLD)
+            lbl_day.pack(fill='x', padx=4)
+            lbl_load = tk.Label(cell, anchor='w', bg="white", font=("Microsoft JhengHei UI", 10))
+            lbl_load.pack(fill='x', padx=4)
+            for w in (cell, lbl_day, lbl_load):
+                w.bind("<Button-1>", lambda e, i=i: self.select_cell(i))
+            self.cells.append((cell, lbl_day, lbl_load))
+
+        cols = ("交期", "單號", "廠商", "品項", "未交數量")
+        self.tree = ttk.Treeview(self, columns=cols, show='headings', height=7)
+        for c in cols:
+            self.tree.heading(c, text=c)
+            self.tree.column(c, anchor='center', width=150)
+        self.tree.tag_configure('even', background=COLORS["table_row_even"])
+        self.tree.tag_configure('overdue', foreground=COLORS["danger"])
+        self.tree.pack(fill='both', padx=10, pady=10)
+
+    def visible_weeks(self):
+        if self.mode == 'week':
+            monday = self.current_date - datetime.timedelta(days=self.current_date.weekday())
+            return [[monday + datetime.timedelta(days=i) for i in range(7)]]
+        return calendar.Calendar().monthdatescalendar(self.current_date.year, self.current_date.month)
+
+    def refresh(self):
+        weeks = self.visible_weeks()
+        first, last = weeks[0][0], weeks[-1][-1]
+        today = datetime.date.today()
+        if self.mode == 'week':
+            self.title_var.set(f"{first.strftime('%Y/%m/%d')} ~ {last.strftime('%m/%d')}")
+        else:
+            self.title_var.set(self.current_date.strftime("%Y年 %m月"))
+
+        index = self.core.delivery_index
+        summary = index.range_summary(first.isoformat(), last.isoformat())
+        overdue = index.overdue_count(today.isoformat())
+        self.summary_var.set(f"逾期未交: {overdue:,} 筆" if overdue else "目前沒有逾期未交的採購單")
+
+        for i, (cell, lbl_day, lbl_load) in enumerate(self.cells):
+            r = i // 7
+            if r >= len(weeks):
+                self.cell_dates[i] = None
+                cell.grid_remove()
+                continue
+            d = weeks[r][i % 7]
+            self.cell_dates[i] = d
+            qty, n = summary.get(d.isoformat(), (0, 0))
+            if n and d < today: bg = "#fab1a0"        # 逾期未交
+            elif n: bg = "#ffeaa7"                     # 有待交貨
+            else: bg = "white"
+            fg = COLORS["text"] if (self.mode == 'week' or d.month == self.current_date.month) else "#bdc3c7"
+            border = COLORS["primary"] if d == self.selected else (COLORS["secondary"] if d == today else bg)
+            cell.config(bg=bg, highlightbackground=border)
+            lbl_day.config(text=str(d.day), bg=bg, fg=fg)
+            lbl_load.config(text=f"{qty:,} ({n}筆)" if n else "", bg=bg, fg=fg)
+            cell.grid()
+
+        if self.mode == 'week': self.show_details(first, last)
+        elif self.selected: self.show_details(self.selected, self.selected)
+        else: self.show_details(None, None)
+
+    def show_details(self, start, end):
+        """ 下方列表：顯示 [start, end] 的未交採購單 """
+        for row in self.tree.get_children(): self.tree.delete(row)
+        if start is None: return
+        index, today, idx = self.core.delivery_index, datetime.date.today().isoformat(), 0
+        for date in index.range_summary(start.isoformat(), end.isoformat()):
+            for po_id, remain in index.day(date).items():
+                p = self.core.po_by_id[po_id]
+                tags = ('even' if idx % 2 == 0 else 'odd',) + (('overdue',) if date < today else ())
+                self.tree.insert("", "end", values=(date, po_id, p['vendor'], p['item'], remain), tags=tags)
+                idx += 1
+
+    def select_cell(self, i):
+        d = self.cell_dates[i]
+        if d is None: return
+        self.selected = d
+        self.refresh()
+
+    def move(self, delta):
+        if self.mode == 'week':
+            self.current_date += datetime.timedelta(days=7 * delta)
+        else:
+            month = self.current_date.month + delta
+            year = self.current_date.year
+            if month > 12: month = 1; year += 1
+            elif month < 1: month = 12; year -= 1
+            self.current_date = self.current_date.replace(year=year, month=month, day=1)
+        self.refresh()
+
+    def toggle_mode(self):
+        self.mode = 'week' if self.mode == 'month' else 'month'
+        self.mode_btn.config(text="月檢視" if self.mode == 'week' else "週檢視")
+        if self.mode == 'week' and self.selected: self.current_date = self.selected
+        self.refresh()
+
+    def go_today(self):
+        self.current_date = datetime.date.today()
+        self.refresh()
+
+# ================= 類別：對帳檢查視窗 =================
+class ReconcileWindow(tk.Toplevel):
+    """ 列出 ERPCore.recon 的差異清單；點選一筆可在下方看到構成差異的交易明細 """
+    def __init__(self, parent, core):
+        super().__init__(parent)
+        self.core = core
+        self.title("對帳檢查")
+        self.geometry("900x640")
+        self.configure(bg=COLORS["bg_white"])
+        self.setup_ui()
+        self.refresh()
+        token = core.bus.subscribe(('po', 'stock', 'sales', 'ap', 'transfer'), lambda ch: self.refresh())
+        self.bind("<Destroy>", lambda e: e.widget is self and core.bus.unsubscribe(token))
+
+    def setup_ui(self):
+        header = tk.Frame(self, bg=COLORS["primary"], pady=8)
+        header.pack(fill='x')
+        self.summary_var = tk.StringVar()
+        tk.Label(header, textvariable=self.summary_var, font=FONT_BOLD, bg=COLORS["primary"], fg="white").pack(side='left', padx=15)
+        tk.Button(header, text="重新全面檢查", command=self.full_check, bg="white", fg=COLORS["primary"],
+                  relief="flat", font=FONT_MAIN).pack(side='right', padx=10)
+
+        cols = ("類型", "對象", "預期", "實際", "說明")
+        self.tree = ttk.Treeview(self, columns=cols, show='headings', height=12)
+        for c in cols:
+            self.tree.heading(c, text=c); self.tree.column(c, anchor='center')
+        self.tree.tag_configure('even', background=COLORS["table_row_even"])
+        self.tree.pack(fill='both', expand=True, padx=10, pady=(10, 5))
+        self.tree.bind("<<TreeviewSelect>>", self.show_detail)
+
+        tk.Label(self, text="交易明細", font=FONT_BOLD, bg=COLORS["bg_white"]).pack(anchor='w', padx=10)
+        cols = ("日期", "類型", "單號", "數量", "金額/說明")
+        self.detail = ttk.Treeview(self, columns=cols, show='headings', height=8)
+        for c in cols:
+            self.detail.heading(c, text=c); self.detail.column(c, anchor='center')
+        self.detail.pack(fill='both', expand=True, padx=10, pady=(0, 10))
+
+    def full_check(self):
+        t0 = time.perf_counter()
+        self.core.recon.rebuild(self.core.data, self.core.po_by_id, self.core.stock)
+        self.refresh(f"(全面檢查 {time.perf_counter() - t0:.2f} 秒)")
+
+    def refresh(self, extra=""):
+        self.rows = self.core.recon.rows()
+        for row in self.tree.get_children(): self.tree.delete(row)
+        for row in self.detail.get_children(): self.detail.delete(row)
+        for idx, r in enumerate(self.rows):
+            self.tree.insert("", "end", iid=str(idx), values=(r['kind'], r['target'], r['expected'], r['actual'], r['note']),
+                             tags=('even' if idx % 2 == 0 else 'odd',))
+        counts = self.core.recon.summary()
+        text = "   ".join(f"{k}: {n}" for k, n in counts.items()) if counts else "帳目一致，沒有差異"
+        self.summary_var.set(f"{text} {extra}")
+
+    def show_detail(self, event=None):
+        sel = self.tree.selection()
+        if not sel: return
+        for row in self.detail.get_children(): self.detail.delete(row)
+        for idx, r in enumerate(self.core.recon.drill_down(self.rows[int(sel[0])])):
+            self.detail.insert("", "end", values=r, tags=('even' if idx % 2 == 0 else 'odd',))
+
+# ================= 索引結構 (隨資料異動增量維護) =================
+class DeliveryIndex:
+    """
+    交期 -> 未結案採購單 的索引，供交期行事曆使用。
+    只在採購單新增/修改/刪除/收貨時更新該筆，不需每次重新排序整個 po_db。
+    """
+    def __init__(self):
+        self.by_date = {}      # 'YYYY-MM-DD' -> {po_id: 未交數量}
+        self.po_date = {}      # po_id -> 目前登記的交期
+        self.dates = []        # 有未交採購單的日期 (排序)
+
+    def rebuild(self, po_db):
+        self.by_date, self.po_date, self.dates = {}, {}, []
+        for p in po_db: self.update(p)
+
+    def update(self, po):
+        """ 採購單新增或異動後呼叫：已結案或已交齊的會從索引移除 """
+        self.remove(po.id)
+        remain = po.qty - po.received_qty
+        if po.status != 'Open' or remain <= 0: return
+        date = po.delivery_date
+        day = self.by_date.get(date)
+        if day is None:
+            day = self.by_date[date] = {}
+            bisect.insort(self.dates, date)
+        day[po.id] = remain
+        self.po_date[po.id] = date
+
+    def remove(self, po_id):
+        date = self.po_date.pop(po_id, None)
+        if date is None: return
+        day = self.by_date[date]
+        day.pop(po_id, None)
+        if not day:
+            del self.by_date[date]
+            del self.dates[bisect.bisect_left(self.dates, date)]
+
+    def day(self, date):
+        """ 某日的未交採購單 {po_id: 未交數量} """
+        return self.by_date.get(date, {})
+
+    def range_summary(self, start, end):
+        """ [start, end] 之間每天的 (未交總量, 筆數)，只走訪有資料的日期 """
+        lo = bisect.bisect_left(self.dates, start)
+        hi = bisect.bisect_right(self.dates, end)
+        return {d: (sum(self.by_date[d].values()), len(self.by_date[d])) for d in self.dates[lo:hi]}
+
+    def overdue_count(self, today):
+        """ 交期已過仍未交齊的筆數 """
+        return sum(len(self.by_date[d]) for d in self.dates[:bisect.bisect_left(self.dates, today)])
+
+class VendorScorecard:
+    """
+    廠商績效的累計值：準時率、平均延遲、交貨達成率、各品項單價走勢、採購金額佔比。
+    載入時由歷史資料建立一次，之後每次下單/收貨只更新該廠商的數字。
+    """
+    def __init__(self):
+        self.vendors = {}   # 廠商 -> 累計數字 (見 _vendor)
+        self.prices = {}    # (廠商, 品項) -> {'n', 'sum', 'first', 'last', 'first_date', 'last_date', 'min', 'max'}
+        self.total_spend = 0.0
+
+    def _vendor(self, vendor):
+        v = self.vendors.get(vendor)
+        if v is None:
+            v = self.vendors[vendor] = {'po_count': 0, 'ordered': 0, 'received': 0, 'receipts': 0,
+                                        'on_time': 0, 'late_days': 0, 'untimed': 0, 'spend': 0.0}
+        return v
+
+    def rebuild(self, po_db, ap_db, po_by_id):
+        self.vendors, self.prices, self.total_spend = {}, {}, 0.0
+        for p in po_db: self.on_po_added(p)
+        for a in ap_db:
+            po = po_by_id.get(a.po_ref)
+            # 與收貨當下相同的規則：有對應採購單的 AP 都算一次收貨 (數量 0 也算，只是不換算單價)
+            if po is not None:
+                self.on_receipt(po, a, a.qty or 0, count_received=False)
+            else:
+                self.on_spend(a.vendor, a.amt)
+        # 收貨數量以採購單上的 received_qty 為準 (舊資料的 AP 可能沒有數量)
+        for p in po_db: self._vendor(p.vendor)['received'] += p.received_qty
+
+    def on_po_added(self, po):
+        v = self._vendor(po.vendor)
+        v['po_count'] += 1
+        v['ordered'] += po.qty
+
+    def on_po_removed(self, po):
+        v = self._vendor(po['vendor'])
+        v['po_count'] -= 1
+        v['ordered'] -= po['qty']
+        v['received'] -= po['received_qty']
+
+    def on_po_replaced(self, old, new):
+        self.on_po_removed(old)
+        self.on_po_added(new)
+        self._vendor(new['vendor'])['received'] += new['received_qty']
+
+    def on_spend(self, vendor, amt):
+        self._vendor(vendor)['spend'] += amt
+        self.total_spend += amt
+
+    def on_receipt(self, po, ap, qty, count_received=True):
+        """ 一筆收貨 (AP 紀錄) 對廠商績效的影響 """
+        v = self._vendor(po.vendor)
+        if count_received: v['received'] += qty
+        v['receipts'] += 1
+        date = ap.date
+        try:
+            late = (datetime.date.fromisoformat(date) - datetime.date.fromisoformat(po.delivery_date)).days
+        except (TypeError, ValueError):
+            late = None  # 舊資料或手打的日期格式不對：不列入準時率
+        if late is None: v['untimed'] += 1
+        elif late <= 0: v['on_time'] += 1
+        else: v['late_days'] += late
+        self.on_spend(po.vendor, ap.amt)
+
+        if not qty: return  # 數量 0 的收貨無法換算單價
+        unit = ap.amt / qty
+        key = (po.vendor, po.item)
+        pr = self.prices.get(key)
+        if pr is None:
+            self.prices[key] = {'n': 1, 'sum': unit, 'first': unit, 'last': unit, 'first_date': date,
+                                'last_date': date, 'min': unit, 'max': unit}
+        else:
+            pr['n'] += 1
+            pr['sum'] += unit
+            if date >= pr['last_date']: pr['last'], pr['last_date'] = unit, date
+            if date < pr['first_date']: pr['first'], pr['first_date'] = unit, date
+            pr['min'] = min(pr['min'], unit)
+            pr['max'] = max(pr['max'], unit)
+
+    def rows(self):
+        """ 每個廠商一列，依採購金額由大到小 """
+        out = []
+        for name, v in self.vendors.items():
+            if not v['po_count'] and not v['spend']: continue
+            timed = v['receipts'] - v['untimed']
+            out.append({
+                'vendor': name, 'po_count': v['po_count'], 'receipts': v['receipts'],
+                'on_time_rate': v['on_time'] / timed if timed else None,
+                'avg_late_days': v['late_days'] / timed if timed else None,
+                'fill_rate': v['received'] / v['ordered'] if v['ordered'] else None,
+                'spend': v['spend'],
+                'spend_share': v['spend'] / self.total_spend if self.total_spend else 0.0,
+            })
+        out.sort(key=lambda r: -r['spend'])
+        return out
+
+    def price_rows(self, vendor):
+        """ 某廠商各品項的單價走勢 """
+        out = []
+        for (v, item), pr in self.prices.items():
+            if v != vendor: continue
+            change = (pr['last'] - pr['first']) / pr['first'] if pr['first'] else 0.0
+            out.append({'item': item, 'n': pr['n'], 'first': pr['first'], 'last': pr['last'],
+                        'avg': pr['sum'] / pr['n'], 'min': pr['min'], 'max': pr['max'], 'change': change})
+        out.sort(key=lambda r: r['item'])
+        return out
+
+# 應付帳款付款條件 (發票日起算天數)，用於計算到期日
+AP_TERMS_DAYS = 30
+# 帳齡區間 (天數，含上下界)
+AGING_BUCKETS = [("0-30天", 0, 30), ("31-60天", 31, 60), ("61-90天", 61, 90), ("90天以上", 91, None)]
+
+
+class UnpaidAPIndex:
+    """
+    未付款應付帳款索引：廠商 -> 發票日 -> {AP 單號: 金額}，另有每日合計。
+    帳齡與到期日都能換算成「發票日區間」，所以篩選與帳齡彙總只需用 bisect
+    找出日期範圍，不必走訪每一筆帳款。
+    """
+    def __init__(self):
+        self.lines = {}      # AP 單號 -> AP 紀錄
+        self.by_vendor = {}  # 廠商 -> {'dates': [排序後日期], 'days': {日期: {AP 單號: 金額}}}
+        self.totals = {}     # 日期 -> [金額, 筆數] (所有廠商)
+        self.dates = []      # totals 的排序日期
+        self.vendor_totals = {}  # 廠商 -> {日期: [金額, 筆數]}
+
+    def rebuild(self, ap_db):
+        self.__init__()
+        for a in ap_db:
+            if a.status == 'Unpaid': self.add(a)
+
+    def add(self, ap):
+        ap_id, vendor = ap.id, ap.vendor
+        if ap_id in self.lines: self.remove(ap_id)
+        self.lines[ap_id] = ap
+        date, amt = ap.date, ap.amt
+        v = self.by_vendor.get(vendor)
+        if v is None: v = self.by_vendor[vendor] = {'dates': [], 'days': {}}
+        day = v['days'].get(date)
+        if day is None:
+            day = v['days'][date] = {}
+            bisect.insort(v['dates'], date)
+        day[ap_id] = amt
+        for totals, dates in ((self.totals, self.dates), (self.vendor_totals.setdefault(vendor, {}), None)):
+            t = totals.get(date)
+            if t is None:
+                t = totals[date] = [0.0, 0]
+                if dates is not None: bisect.insort(dates, date)
+            t[0] += amt
+            t[1] += 1
+
+    def remove(self, ap_id):
+        ap = self.lines.pop(ap_id, None)
+        if ap is None: return None
+        date, vendor = ap.date, ap.vendor
+        v = self.by_vendor[vendor]
+        amt = v['days'][date].pop(ap_id)
+        if not v['days'][date]:
+            del v['days'][date]
+            del v['dates'][bisect.bisect_left(v['dates'], date)]
+            if not v['dates']: del self.by_vendor[vendor]
+        for totals, dates in ((self.totals, self.dates), (self.vendor_totals[vendor], None)):
+            t = totals[date]
+            t[0] -= amt
+            t[1] -= 1
+            if t[1] == 0:
+                del totals[date]
+                if dates is not None: del dates[bisect.bisect_left(dates, date)]
+        if not self.vendor_totals[vendor]: del self.vendor_totals[vendor]
+        return ap
+
+    @staticmethod
+    def bucket_range(today, lo_days, hi_days):
+        """ 帳齡 [lo_days, hi_days] 對應的發票日區間 (字串，含頭尾；None 表示不限) """
+        start = None if hi_days is None else (today - datetime.timedelta(days=hi_days)).isoformat()
+        end = (today - datetime.timedelta(days=lo_days)).isoformat() if lo_days > 0 else None
+        return start, end
+
+    def aging(self, today, vendor=None):
+        """ 各帳齡區間的 [金額, 筆數] """
+        if vendor is None:
+            totals, dates = self.totals, self.dates
+        else:
+            totals = self.vendor_totals.get(vendor, {})
+            dates = self.by_vendor[vendor]['dates'] if vendor in self.by_vendor else []
+        out = {}
+        for name, lo, hi in AGING_BUCKETS:
+            start, end = self.bucket_range(today, lo, hi)
+            i = 0 if start is None else bisect.bisect_left(dates, start)
+            j = len(dates) if end is None else bisect.bisect_right(dates, end)
+            amt, n = 0.0, 0
+            for d in dates[i:j]:
+                amt += totals[d][0]
+                n += totals[d][1]
+            out[name] = [amt, n]
+        return out
+
+    def select(self, today, vendor=None, due_by=None, buckets=None):
+        """
+        依條件挑出未付帳款，回傳 AP 紀錄列表。
+        vendor: 指定廠商 (None 為全部)；due_by: 到期日不晚於此日 (date)；buckets: 帳齡區間名稱列表
+        """
+        ranges = []
+        for name, lo, hi in AGING_BUCKETS:
+            if buckets is None or name in buckets: ranges.append(self.bucket_range(today, lo, hi))
+        cutoff = None if due_by is None else (due_by - datetime.timedelta(days=AP_TERMS_DAYS)).isoformat()
+        vendors = [vendor] if vendor is not None else list(self.by_vendor)
+        out = []
+        for vname in vendors:
+            v = self.by_vendor.get(vname)
+            if v is None: continue
+            dates = v['dates']
+            for start, end in ranges:
+                if cutoff is not None and (end is None or cutoff < end): end = cutoff
+                i = 0 if start is None else bisect.bisect_left(dates, start)
+                j = len(dates) if end is None else bisect.bisect_right(dates, end)
+                for d in dates[i:j]:
+                    out.extend(self.lines[ap_id] for ap_id in v['days'][d])
+        return out
+
+class PrefixIndex:
+    """
+    自動完成用的名稱索引：排序好的 (小寫, 名稱) 串列以 bisect 找出前綴範圍，
+    新名稱先放進 pending (O(1))，累積 k = max(MERGE_AT, √n) 筆才併入排序串列：
+    併入一次是 O(n + k log k)，攤到每筆新增約 O(√n)；complete() 另外線性掃過最多 k 筆 pending。
+    排名依使用次數，其次是最近使用；members 集合提供 O(1) 的「是否已存在」。
+    """
+    MERGE_AT = 256
+
+    def __init__(self):
+        self.sorted, self.pending, self.members = [], [], set()
+        self.freq, self.last, self.tick = collections.Counter(), {}, 0
+
+    def rebuild(self, names, usage=()):
+        """ names: 所有名稱；usage: 依時間先後的使用紀錄 (例如每張採購單的品項) """
+        usage = list(usage)
+        self.members = {n for n in names if n} | {n for n in usage if n}
+        self.sorted = sorted((n.casefold(), n) for n in self.members)
+        self.pending = []
+        self.freq = collections.Counter(usage)
+        self.last = dict(zip(usage, range(1, len(usage) + 1)))  # 同名以最後一次為準
+        self.tick = len(usage)
+
+    def add(self, name):
+        if not name or name in self.members: return False
+        self.members.add(name)
+        self.pending.append((name.casefold(), name))
+        if len(self.pending) >= max(self.MERGE_AT, int(len(self.sorted) ** 0.5)):
+            # pending 先自行排序，串接後恰好是兩段遞增序列，Timsort 只做一次線性合併
+            self.pending.sort()
+            self.sorted.extend(self.pending)
+            self.sorted.sort()
+            self.pending = []
+        return True
+
+    def touch(self, name):
+        """ 記錄一次使用 (不存在則新增) """
+        if not name: return
+        self.add(name)
+        self.freq[name] += 1
+        self.tick += 1
+        self.last[name] = self.tick
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def __len__(self):
+        return len(self.members)
+
+    def complete(self, prefix, limit=10, accept=None):
+        """ 以 prefix 開頭 (不分大小寫) 的名稱中，取常用 / 最近使用的前 limit 個 """
+        p = prefix.casefold()
+        lo = bisect.bisect_left(self.sorted, (p,))
+        hi = bisect.bisect_left(self.sorted, (p + "\U0010ffff",))
+        matches = [n for _, n in self.sorted[lo:hi]]
+        matches += [n for f, n in self.pending if f.startswith(p)]
+        if accept is not None: matches = [n for n in matches if accept(n)]
+        freq, last = self.freq, self.last
+        return heapq.nlargest(limit, matches, key=lambda n: (freq[n], last.get(n, 0)))
+
+class ScanSession:
+    """
+    條碼 / 鍵盤楔形掃描的暫存批次。每筆掃描只做 O(1) 的解析與累加，不動到資料；
+    commit() 時才一次收貨 (依交期先後分配到未結案採購單) 或出庫。
+    掃描內容：
+      品項代碼         數量 1 (或前一個數量碼指定的數量)
+      品項代碼*N       數量 N
+      *N 或 xN         下一個品項的數量
+      採購單號         (收貨) 之後的品項都收到這張採購單，直到再掃另一張
+    """
+    QTY_RE = re.compile(r'^[*xX](\d+)$')
+    ITEM_QTY_RE = re.compile(r'^(.+?)\*(\d+)$')
+
+    def __init__(self, core, mode='receive', location=DEFAULT_LOCATION):
+        if mode not in ('receive', 'issue'): raise ValueError(f"未知的掃描模式: {mode}")
+        self.core, self.mode, self.location = core, mode, location
+        self.clear()
+
+    def clear(self):
+        self.lines = {}       # (品項, 指定採購單號或 None) -> 數量
+        self.by_item = {}     # 品項 -> 已掃數量 (檢查未交量 / 庫存用)
+        self.history = []     # [(line key, 數量)]，供復原
+        self.next_qty = 1
+        self.po_context = None
+
+    @property
+    def units(self):
+        return sum(self.lines.values())
+
+    def scan(self, code):
+        """ 處理一筆掃描，回傳 (狀態, 訊息, line key)；狀態為 'ok' / 'info' / 'error' """
+        code = code.strip()
+        if not code: return 'info', "", None
+        m = self.QTY_RE.match(code)
+        if m:
+            self.next_qty = int(m.group(1))
+            return 'info', f"下一筆數量 x{self.next_qty}", None
+
+        po = self.core.po_by_id.get(code)
+        if po is not None:
+            if self.mode != 'receive': return 'error', "出庫模式不需掃採購單", None
+            if code not in self.core.open_pos.get(po.item, ()): return 'error', f"{code} 已結案", None
+            self.po_context = code
+            return 'info', f"收貨到 {code} ({po.item})", None
+
+        item, qty = code, self.next_qty
+        m = self.ITEM_QTY_RE.match(code)
+        if m: item, qty = m.group(1), int(m.group(2))
+        if qty <= 0: return 'error', "數量必須大於 0", None
+        already = self.by_item.get(item, 0)
+
+        if self.mode == 'receive':
+            if self.po_context is not None:
+                # 掃了單號之後，該單可能已被其他人收完結案或刪除
+                po = self.core.po_by_id.get(self.po_context)
+                if po is None or self.po_context not in self.core.open_pos.get(po.item, {}):
+                    closed, self.po_context = self.po_context, None
+                    return 'error', f"{closed} 已結案", None
+                if po.item != item: return 'error', f"{item} 不是 {self.po_context} 的品項 ({po.item})", None
+                open_qty = po.qty - po.received_qty - self.lines.get((item, self.po_context), 0)
+                # 同品項另有未指定單號的掃描，也要算進總未交量
+                total_open = sum(p.qty - p.received_qty for p in self.core.open_pos.get(item, {}).values()) - already
+                open_qty = min(open_qty, total_open)
+            else:
+                open_pos = self.core.open_pos.get(item)
+                if not open_pos: return 'error', f"{item} 沒有未交的採購單", None
+                open_qty = sum(p.qty - p.received_qty for p in open_pos.values()) - already
+            if qty > open_qty: return 'error', f"{item} 超過未交數量 (尚可收 {max(open_qty, 0)})", None
+        else:
+            if item not in self.core.data['stock_db']: return 'error', f"未知的品項: {item}", None
+            if not self.core.last_sale_price.get(item):
+                return 'error', f"{item} 沒有銷售單價紀錄，請改用「銷貨/領料出庫」輸入單價", None
+            available = self.core.stock.qty(self.location, item) - already
+            if qty > available: return 'error', f"{self.location} 的 {item} 庫存不足 (尚有 {max(available, 0)})", None
+
+        key = (item, self.po_context)
+        self.lines[key] = self.lines.get(key, 0) + qty
+        self.by_item[item] = already + qty
+        self.history.append((key, qty))
+        self.next_qty = 1
+        return 'ok', f"{item} +{qty} (小計 {self.lines[key]})", key
+
+    def undo(self):
+        """ 取消最後一筆品項掃描，回傳受影響的 line key (沒有可復原的回傳 None) """
+        if not self.history: return None
+        key, qty = self.history.pop()
+        self.lines[key] -= qty
+        if not self.lines[key]: del self.lines[key]
+        self.by_item[key[0]] -= qty
+        return key
+
+    def _plan_receipts(self):
+        """ 收貨數量分配到採購單：指定單號的先收；其餘依交期先後 (先到期先收) """
+        left = {}    # 採購單號 -> 分配後剩餘未交量
+        plan = []
+        for (item, po_id), qty in sorted(self.lines.items(), key=lambda kv: kv[0][1] is None):
+            if po_id is not None and po_id not in self.core.open_pos.get(item, {}):
+                raise ValueError(f"{po_id} 已結案")
+            pos = [self.core.po_by_id[po_id]] if po_id is not None else \
+                sorted(self.core.open_pos.get(item, {}).values(), key=lambda p: (p.delivery_date, p.id))
+            for po in pos:
+                take = min(qty, left.setdefault(po.id, po.qty - po.received_qty))
+                if take > 0:
+                    plan.append((po, take))
+                    left[po.id] -= take
+                    qty -= take
+                if not qty: break
+            if qty: raise ValueError(f"{item} 超過未交數量 {qty}")
+        return plan
+
+    def commit(self, date=None):
+        """ 整批寫入，回傳新產生的 AP / 銷售紀錄；有任何一行不成立時全部不寫入 """
+        if not self.lines: return []
+        if self.mode == 'receive':
+            plan = self._plan_receipts()
+            created = [self.core.receive_po(po, q, q * po.price, self.location) for po, q in plan]
+        else:
+            for item, qty in self.by_item.items():
+                if qty > self.core.stock.qty(self.location, item):
+                    raise ValueError(f"{self.location} 的 {item} 庫存不足")
+                if not self.core.last_sale_price.get(item): raise ValueError(f"{item} 沒有銷售單價紀錄")
+            date = date or datetime.datetime.now().strftime("%Y-%m-%d")
+            created = [self.core.record_sale(item, qty, self.core.last_sale_price[item], date, self.location)
+                       for (item, _), qty in self.lines.items()]
+        self.clear()
+        return created
+
+class StockLedger:
+    """
+    多倉庫庫存：data['stock_loc_db'] 為 倉庫 -> {品項: 數量} (存檔的正本)，
+    另維護 品項 -> {倉庫: 數量} 的反向索引，並同步更新 data['stock_db'] 的各品項總量 (相容舊版)。
+    所有增減都是 O(1)，列表只需走訪要顯示的那一個倉庫或品項。
+    """
+    def __init__(self):
+        self.by_loc, self.totals, self.by_item = {}, {}, {}
+
+    def rebuild(self, stock_loc_db, stock_db):
+        self.by_loc = stock_loc_db
+        self.totals = stock_db
+        self.by_item = {}
+        stock_db.clear()
+        for loc, items in stock_loc_db.items():
+            for item, qty in items.items():
+                self.by_item.setdefault(item, {})[loc] = qty
+                stock_db[item] = stock_db.get(item, 0) + qty
+
+    def add(self, loc, item, qty):
+        """ 增減庫存 (qty 可為負)，回傳該倉庫的新數量 """
+        items = self.by_loc.setdefault(loc, {})
+        new = items.get(item, 0) + qty
+        items[item] = new
+        self.by_item.setdefault(item, {})[loc] = new
+        self.totals[item] = self.totals.get(item, 0) + qty
+        return new
+
+    def qty(self, loc, item):
+        return self.by_loc.get(loc, {}).get(item, 0)
+
+    def total(self, item):
+        return self.totals.get(item, 0)
+
+    def items_at(self, loc):
+        """ 某倉庫的 {品項: 數量} (loc 為 None 表示全部倉庫合計) """
+        return self.totals if loc is None else self.by_loc.get(loc, {})
+
+    def locations_of(self, item):
+        return self.by_item.get(item, {})
+
+RECON_AMT_TOLERANCE = 0.005  # AP 金額與 數量×單價 的容許誤差 (比例，且至少 1 元)
+
+class Reconciler:
+    """
+    對帳檢查。載入時把 期初庫存 + 進貨 - 銷貨 ± 調撥 與 每張採購單的 AP 數量 各走訪一次彙總，
+    之後每筆交易只重算受影響的 (倉庫, 品項) 與採購單，issues 隨時是最新的差異清單。
+    檢查項目：庫存不符、收貨量與 AP 數量不符、超收、AP 金額與 數量×單價 不符、找不到採購單的 AP。
+    """
+    def __init__(self):
+        self.expected, self.ap_by_po, self.issues = {}, {}, {}
+        self.data, self.po_by_id, self.stock = None, {}, None
+
+    def rebuild(self, data, po_by_id, stock):
+        """ 全面檢查：每張表各走訪一次，只有出問題的項目才建立差異紀錄 """
+        self.data, self.po_by_id, self.stock = data, po_by_id, stock
+        expected, ap_by_po, ap_qty, issues = {}, {}, {}, {}
+        for loc, items in data.get('opening_stock', {}).items():
+            for item, qty in items.items():
+                expected[(loc, item)] = qty
+        for a in data['ap_db']:
+            po_id = a.po_ref or None
+            ap_by_po.setdefault(po_id, []).append(a)
+            po = po_by_id.get(po_id)
+            if po is None:
+                issues[('找不到採購單', a.id)] = dict(kind='找不到採購單', key=a.id, target=a.id, expected=po_id or "(無)",
+                                                  actual="-", note="AP 參照的採購單不存在")
+            qty = a.qty
+            if qty is MISSING:
+                ap_qty[po_id] = None  # 舊版 AP 沒有數量，這張採購單無法比對收貨量
+                continue
+            key = (a.location or DEFAULT_LOCATION, a.item)
+            expected[key] = expected.get(key, 0) + qty
+            if po_id in ap_qty:
+                if ap_qty[po_id] is not None: ap_qty[po_id] += qty
+            else: ap_qty[po_id] = qty
+            if po is not None:
+                exp_amt = qty * po.price
+                if abs(a.amt - exp_amt) > max(1, abs(exp_amt) * RECON_AMT_TOLERANCE):
+                    issues[('金額不符', a.id)] = dict(kind='金額不符', key=a.id, target=a.id, expected=round(exp_amt, 2),
+                                                   actual=a.amt, note=f"{po_id} 單價 {po.price}")
+        for sale in data['sales_db']:
+            key = (sale.location or DEFAULT_LOCATION, sale.item)
+            expected[key] = expected.get(key, 0) - sale.qty
+        for t in data['transfer_db']:
+            expected[(t['from'], t['item'])] = expected.get((t['from'], t['item']), 0) - t['qty']
+            expected[(t['to'], t['item'])] = expected.get((t['to'], t['item']), 0) + t['qty']
+        for po in data['po_db']:
+            po_id, received = po.id, po.received_qty
+            n = ap_qty.get(po_id, 0)
+            if n is not None and n != received:
+                issues[('收貨量不符', po_id)] = dict(kind='收貨量不符', key=po_id, target=po_id, expected=n, actual=received,
+                                                  note="已收數量 ≠ AP 數量合計")
+            if received > po.qty:
+                issues[('超收', po_id)] = dict(kind='超收', key=po_id, target=po_id, expected=po.qty, actual=received,
+                                             note="已收數量超過訂購數量")
+        self.expected, self.ap_by_po, self.issues = expected, ap_by_po, issues
+
+        keys = set(expected)
+        for loc, items in stock.by_loc.items():
+            keys.update((loc, item) for item in items)
+        for key in keys:
+            if expected.get(key, 0) != stock.qty(*key): self.check_stock(key)
+
+    def _set(self, kind, key, problem, **fields):
+        if problem: self.issues[(kind, key)] = dict(kind=kind, key=key, **fields)
+        else: self.issues.pop((kind, key), None)
+
+    def check_stock(self, key):
+        exp, act = self.expected.get(key, 0), self.stock.qty(*key)
+        self._set('庫存不符', key, exp != act, target=f"{key[0]} / {key[1]}", expected=exp, actual=act,
+                  note="帳面庫存 ≠ 期初 + 進貨 - 銷貨 ± 調撥")
+
+    def check_po(self, po_id):
+        po, aps = self.po_by_id.get(po_id), self.ap_by_po.get(po_id, [])
+        for a in aps:
+            if po is None:
+                self._set('找不到採購單', a['id'], True, target=a['id'], expected=po_id or "(無)", actual="-", note="AP 參照的採購單不存在")
+                self._set('金額不符', a['id'], False)
+                continue
+            self._set('找不到採購單', a['id'], False)
+            if 'qty' not in a: continue
+            exp_amt = a['qty'] * po['price']
+            self._set('金額不符', a['id'], abs(a['amt'] - exp_amt) > max(1, abs(exp_amt) * RECON_AMT_TOLERANCE),
+                      target=a['id'], expected=round(exp_amt, 2), actual=a['amt'], note=f"{po_id} 單價 {po['price']}")
+        if po is None:
+            self._set('收貨量不符', po_id, False)
+            self._set('超收', po_id, False)
+            return
+        # 舊版 AP 若沒有數量就無法比對收貨量
+        if all('qty' in a for a in aps):
+            ap_qty = sum(a['qty'] for a in aps)
+            self._set('收貨量不符', po_id, ap_qty != po['received_qty'], target=po_id, expected=ap_qty,
+                      actual=po['received_qty'], note="已收數量 ≠ AP 數量合計")
+        self._set('超收', po_id, po['received_qty'] > po['qty'], target=po_id, expected=po['qty'],
+                  actual=po['received_qty'], note="已收數量超過訂購數量")
+
+    def _move(self, loc, item, qty):
+        key = (loc, item)
+        self.expected[key] = self.expected.get(key, 0) + qty
+        self.check_stock(key)
+
+    # --- 交易發生時呼叫 (只重算受影響的項目) ---
+    def on_receipt(self, po, ap):
+        self.ap_by_po.setdefault(po['id'], []).append(ap)
+        self._move(ap['location'], ap['item'], ap['qty'])
+        self.check_po(po['id'])
+
+    def on_sale(self, sale):
+        self._move(sale['location'], sale['item'], -sale['qty'])
+
+    def on_transfer(self, rec):
+        self._move(rec['from'], rec['item'], -rec['qty'])
+        self._move(rec['to'], rec['item'], rec['qty'])
+
+    def on_po_changed(self, *po_ids):
+        for po_id in po_ids: self.check_po(po_id)
+
+    # --- 查詢 ---
+    def summary(self):
+        counts = {}
+        for kind, _ in self.issues: counts[kind] = counts.get(kind, 0) + 1
+        return counts
+
+    def rows(self):
+        return sorted(self.issues.values(), key=lambda r: (r['kind'], str(r['key'])))
+
+    def drill_down(self, issue):
+        """ 列出構成此差異的交易：(日期, 類型, 單號, 數量, 金額/說明) """
+        kind, key = issue['kind'], issue['key']
+        rows = []
+        if kind == '庫存不符':
+            loc, item = key
+            opening = self.data.get('opening_stock', {}).get(loc, {}).get(item)
+            if opening: rows.append(("-", "期初", "-", opening, ""))
+            for a in self.data['ap_db']:
+                if a.get('item') == item and a.get('location', DEFAULT_LOCATION) == loc and 'qty' in a:
+                    rows.append((a['date'], "進貨", a.get('po_ref', a['id']), a['qty'], a['amt']))
+            for sale in self.data['sales_db']:
+                if sale['item'] == item and sale.get('location', DEFAULT_LOCATION) == loc:
+                    rows.append((sale['date'], "銷貨", "-", -sale['qty'], sale.get('total', '')))
+            for t in self.data['transfer_db']:
+                if t['item'] == item and loc in (t['from'], t['to']):
+                    rows.append((t['date'], "調撥", t['id'], t['qty'] if t['to'] == loc else -t['qty'], f"{t['from']} → {t['to']}"))
+            rows.sort(key=lambda r: r[0])
+            return rows
+        if kind in ('收貨量不符', '超收'):
+            po_id = key
+        else:
+            ap = next((a for a in self.data['ap_db'] if a['id'] == key), None)
+            if ap is None: return rows
+            po_id = ap.get('po_ref')
+            if po_id not in self.po_by_id:
+                return [(ap['date'], "應付帳款", ap['id'], ap.get('qty', '?'), ap['amt'])]
+        po = self.po_by_id[po_id]
+        rows.append((po['delivery_date'], "採購單", po['id'], po['qty'], f"單價 {po['price']}，已收 {po['received_qty']}"))
+        for a in self.ap_by_po.get(po_id, []):
+            rows.append((a['date'], "應付帳款", a['id'], a.get('qty', '?'), a['amt']))
+        return rows
+
+# ================= 異動通知 (發佈 / 訂閱) =================
+# 事件種類與 ids 的內容：
+#   'po'       採購單號           'stock'    (倉庫, 品項)
+#   'sales'    sales_db 的索引    'ap'       AP 單號
+#   'price'    最新單價有變的品項  'location' 倉庫名稱
+#   'transfer' 調撥單號
+CHANGE_KINDS = ('po', 'stock', 'sales', 'ap', 'price', 'location', 'transfer')
+
+
+class ChangeBus:
+    """
+    資料異動的發佈/訂閱。publish 只累積 {種類: ids}，同一輪事件迴圈內的多次異動
+    由 scheduler (視窗版為 root.after_idle) 合併成一次 flush，每個訂閱者最多被呼叫一次，
+    收到的是它有訂閱的那些種類。沒有 scheduler 時 (命令列、測試) 立即通知。
+    """
+    def __init__(self, scheduler=None):
+        self.scheduler = scheduler
+        self.subscribers = {}   # token -> (種類集合, callback)
+        self.pending = {}
+        self.scheduled = False
+        self._next_token = 0
+
+    def subscribe(self, kinds, callback):
+        """ 訂閱事件，callback(changes) 的 changes 為 {種類: ids 集合}；回傳取消訂閱用的 token """
+        unknown = set(kinds) - set(CHANGE_KINDS)
+        if unknown: raise ValueError(f"未知的事件種類: {unknown}")
+        self._next_token += 1
+        self.subscribers[self._next_token] = (frozenset(kinds), callback)
+        return self._next_token
+
+    def unsubscribe(self, token):
+        self.subscribers.pop(token, None)
+
+    def publish(self, kind, ids=()):
+        self.pending.setdefault(kind, set()).update(ids)
+        if self.scheduler is None:
+            self.flush()
+        elif not self.scheduled:
+            self.scheduled = True
+            self.scheduler(self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        changes, self.pending = self.pending, {}
+        if not changes: return
+        for kinds, callback in list(self.subscribers.values()):
+            relevant = {k: ids for k, ids in changes.items() if k in kinds}
+            if not relevant: continue
+            try:
+                callback(relevant)
+            except Exception as e:
+                print(f"異動通知處理錯誤: {e}")
+
+# ================= 備份 (差異 + 定期完整備份，可還原到任一時間點) =================
+BACKUP_INTERVAL_MIN = 60   # 視窗版每隔幾分鐘備份一次
+BACKUP_FULL_EVERY = 24     # 每幾份差異備份之後改做一次完整備份
+BACKUP_KEEP_DAYS = 30      # 保留天數 (確保這段期間內的每個時間點都能還原)
+BACKUP_KEYED_TABLES = {'po_db': 'po', 'ap_db': 'ap', 'transfer_db': 'transfer'}  # 以 id 識別的資料表 -> 事件種類
+_BACKUP_TRACKED = set(BACKUP_KEYED_TABLES) | {'sales_db', 'stock_loc_db', 'stock_db'}
+_BACKUP_NAME_RE = re.compile(r'^(\d{8}-\d{6}-\d{6})\.(full|delta)\.(json|erpb)\.gz$')
+_BACKUP_STAMP = "%Y%m%d-%H%M%S-%f"
+
+
+def _row_dict(r):
+    return r.to_dict() if isinstance(r, Record) else dict(r)
+
+
+def backup_points(folder=BACKUP_DIR):
+    """ 列出資料夾內的備份點 [(時間, 'full'/'delta', 格式, 路徑)]，依時間排序 (寫入中的暫存檔不列入) """
+    if not os.path.isdir(folder): return []
+    points = []
+    for name in os.listdir(folder):
+        m = _BACKUP_NAME_RE.match(name)
+        if m: points.append((datetime.datetime.strptime(m.group(1), _BACKUP_STAMP), m.group(2), m.group(3), os.path.join(folder, name)))
+    points.sort()
+    return points
+
+
+def _read_backup_base(path, fmt):
+    with gzip.open(path, "rb") as f:
+        if fmt == "json": return json.load(f)
+        # 快照需以 mmap 讀取，先解壓到暫存檔
+        fd, tmp = tempfile.mkstemp(suffix=".erpb")
+        try:
+            with os.fdopen(fd, "wb") as out: shutil.copyfileobj(f, out)
+            return read_snapshot(tmp)
+        finally:
+            os.remove(tmp)
+
+
+def apply_backup_delta(data, delta):
+    """ 將一份差異備份套用到 data (直接修改) """
+    for table, ch in delta['keyed'].items():
+        rows = data.setdefault(table, [])
+        pos = {r['id']: i for i, r in enumerate(rows)}
+        for r in ch['upsert']:
+            if r['id'] in pos: rows[pos[r['id']]] = r
+            else: rows.append(r)
+        if 'order' in ch:
+            # 有刪除或改單號時才記錄順序 (採購單的順序決定「最新單價」)
+            by_id = {r['id']: r for r in rows}
+            rows[:] = [by_id[i] for i in ch['order']]
+    sales = data.setdefault('sales_db', [])
+    del sales[delta['sales']['len']:]
+    for i, r in delta['sales']['rows']:
+        if i < len(sales): sales[i] = r
+        else: sales.append(r)
+    stock_loc = data.setdefault('stock_loc_db', {})
+    for loc, item, qty in delta['stock']:
+        if qty is None: stock_loc.get(loc, {}).pop(item, None)
+        else: stock_loc.setdefault(loc, {})[item] = qty
+    # 新增但還沒有庫存的倉庫不會出現在 stock 裡，要另外補上
+    for loc in delta.get('locations', ()): stock_loc.setdefault(loc, {})
+    totals = data.setdefault('stock_db', {})
+    totals.clear()
+    for items in stock_loc.values():
+        for item, qty in items.items(): totals[item] = totals.get(item, 0) + qty
+    data.update(delta['meta'])
+
+
+def restore_backup(folder=BACKUP_DIR, at=None):
+    """ 還原到 at (datetime，預設最新) 當時的資料：最近一份完整備份 + 之後的差異；回傳 (data, 備份點時間, 套用的差異數) """
+    points = [p for p in backup_points(folder) if at is None or p[0] <= at]
+    base = next((i for i in range(len(points) - 1, -1, -1) if points[i][1] == 'full'), None)
+    if base is None: raise ValueError(f"{folder} 中找不到{'' if at is None else f' {at} 之前的'}完整備份")
+    stamp, _, fmt, path = points[base]
+    data = _read_backup_base(path, fmt)
+    deltas = points[base + 1:]
+    for stamp, _, _, path in deltas:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            apply_backup_delta(data, json.load(f))
+    return data, stamp, len(deltas)
+
+
+def prune_backups(folder=BACKUP_DIR, keep_days=BACKUP_KEEP_DAYS, now=None):
+    """ 刪除過期備份，但保留 保留期限起點 所依賴的那份完整備份；回傳刪除的檔案數 """
+    cutoff = (now or datetime.datetime.now()) - datetime.timedelta(days=keep_days)
+    points = backup_points(folder)
+    old_fulls = [p[0] for p in points if p[1] == 'full' and p[0] <= cutoff]
+    if not old_fulls: return 0
+    removed = 0
+    for stamp, _, _, path in points:
+        if stamp >= old_fulls[-1]: break
+        os.remove(path)
+        removed += 1
+    return removed
+
+
+class BackupManager:
+    """
+    從 ChangeBus 事件記下哪些資料列被改過，backup() 時只取出這些列寫成差異備份；
+    每 full_every 份 (或程式剛啟動、前一份寫入失敗時) 改做完整備份 —— 先存檔，再壓縮剛寫好的資料檔。
+    取資料與轉成 JSON 在呼叫端 (主執行緒) 進行，成本與異動筆數成正比；壓縮與寫檔、清理過期備份由背景執行緒負責。
     """
-    def __init__(self, parent, callback):
-        super().__init__(parent)
-        self.callback = callback  # 這是當使用者選好日期後，要執行的函式
-        self.title("選擇日期")
-        self.geometry("415x350")
-        self.configure(bg=COLORS["bg_white"])
-        self.current_date = datetime.date.today()
-        self.setup_ui()
+    def __init__(self, core, folder=BACKUP_DIR, full_every=BACKUP_FULL_EVERY, keep_days=BACKUP_KEEP_DAYS):
+        self.core, self.folder = core, folder
+        self.full_every, self.keep_days = full_every, keep_days
+        self.dirty = {t: set() for t in BACKUP_KEYED_TABLES}
+        self.dirty_sales, self.dirty_stock = set(), set()
+        self.meta_json = None      # 上次備份時小型資料表的內容，沒變就不重複寫
+        self.need_full = True      # 啟動前的異動無從得知，第一份一定是完整備份
+        self.since_full = 0
+        self.last_error = ""
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self._broken = False       # 寫入失敗後，下一份完整備份之前的差異都不能用
+        self._start_meta = self._meta_json()  # 建立時的小型資料表；第一份備份前都沒變，磁碟上的資料檔就是目前內容
+        kinds = {v: k for k, v in BACKUP_KEYED_TABLES.items()}
+        def on_change(changes):
+            for kind, ids in changes.items():
+                if kind in kinds: self.dirty[kinds[kind]].update(ids)
+                elif kind == 'sales': self.dirty_sales.update(ids)
+                elif kind == 'stock': self.dirty_stock.update(ids)
+        self.token = core.bus.subscribe(tuple(kinds) + ('sales', 'stock'), on_change)
 
-    def setup_ui(self):
-        # 每次換月份時，先清空舊的按鈕
-        for widget in self.winfo_children(): widget.destroy()
+    def mark_all_dirty(self, previous):
+        """ 與先前還原出的資料逐筆比較，找出異動 (命令列等沒有事件紀錄時使用) """
+        data = self.core.data
+        for table in BACKUP_KEYED_TABLES:
+            old = {r['id']: r for r in previous.get(table, [])}
+            self.dirty[table] = {r['id'] for r in data[table] if _row_dict(r) != old.get(r['id'])} | \
+                (set(old) - {r['id'] for r in data[table]})
+        old_sales = previous.get('sales_db', [])
+        self.dirty_sales = {i for i, r in enumerate(data['sales_db']) if i >= len(old_sales) or _row_dict(r) != old_sales[i]}
+        old_stock, stock = previous.get('stock_loc_db', {}), data['stock_loc_db']
+        self.dirty_stock = {(loc, item) for loc in set(old_stock) | set(stock)
+                            for item in set(old_stock.get(loc, {})) | set(stock.get(loc, {}))
+                            if old_stock.get(loc, {}).get(item) != stock.get(loc, {}).get(item)}
+        self.meta_json = self._meta_json(previous)
+        self.need_full = False
+        self._start_meta = None
+
+    def _meta(self, data=None):
+        """ 其餘的小型資料表 (倉庫清單、選單記憶、廠商聯絡方式…)，有變動時整份帶上 """
+        return {k: v for k, v in (data or self.core.data).items() if k not in _BACKUP_TRACKED}
+
+    def _meta_json(self, data=None):
+        return json.dumps(self._meta(data), ensure_ascii=False, sort_keys=True, default=_json_default)
+
+    def _capture_delta(self):
+        data = self.core.data
+        keyed = {}
+        for table, ids in self.dirty.items():
+            if not ids: continue
+            rows = data[table]
+            # 由後往前找 (新增的都在最後面)，全部找到就停；保持原本的先後順序
+            found, want = [], set(ids)
+            for r in reversed(rows):
+                if r['id'] in want:
+                    found.append(r)
+                    want.discard(r['id'])
+                    if not want: break
+            ch = {'upsert': [_row_dict(r) for r in reversed(found)]}
+            if want: ch['order'] = [r['id'] for r in rows]  # 有列被刪除或改單號
+            keyed[table] = ch
+        sales = data['sales_db']
+        sales_rows = [[i, _row_dict(sales[i])] for i in sorted(self.dirty_sales) if i < len(sales)]
+        stock = [[loc, item, data['stock_loc_db'].get(loc, {}).get(item)] for loc, item in self.dirty_stock]
+        meta = self._meta()
+        meta_json = json.dumps(meta, ensure_ascii=False, sort_keys=True, default=_json_default)
+        meta_changed = meta_json != self.meta_json
+        if not (keyed or sales_rows or stock or meta_changed): return None
+        self.meta_json = meta_json
+        return {'keyed': keyed, 'sales': {'len': len(sales), 'rows': sales_rows}, 'stock': stock,
+                'locations': list(data['stock_loc_db']), 'meta': meta if meta_changed else {}}
+
+    def _has_changes(self):
+        return any(self.dirty.values()) or bool(self.dirty_sales or self.dirty_stock) or self._meta_json() != self.meta_json
+
+    def _clear_dirty(self):
+        for ids in self.dirty.values(): ids.clear()
+        self.dirty_sales.clear()
+        self.dirty_stock.clear()
+
+    def backup(self, full=False):
+        """ 取出目前的異動排入背景寫入，回傳備份檔名；沒有異動時回傳 None """
+        if self.core.load_error is not None:
+            self.last_error = f"資料檔讀取失敗，不做備份 ({self.core.load_error})"
+            return None
+        self.core.bus.flush()
+        stamp = datetime.datetime.now()
+        forced = full or self.need_full or self._broken
+        if not forced and not self._has_changes(): return None
+        if forced or self.since_full >= self.full_every:
+            fmt = "erpb" if self.core.storage_format == "binary" else "json"
+            path = self.core.snapshot_file if fmt == "erpb" else self.core.data_file
+            # 剛啟動且還沒有任何異動時，磁碟上的資料檔就是剛載入的內容，直接拿來當完整備份，不重新存檔
+            untouched = self._start_meta is not None and not (any(self.dirty.values()) or self.dirty_sales or self.dirty_stock) \
+                and self._meta_json() == self._start_meta and os.path.exists(path)
+            self._start_meta = None
+            if not untouched and not self.core.save_data():
+                self.last_error = "存檔失敗，未做完整備份"
+                return None
+            # 先固定住剛存好的這一版 (硬連結幾乎不花時間，不同磁碟時才複製)，之後的存檔不影響背景壓縮
+            os.makedirs(self.folder, exist_ok=True)
+            body = os.path.join(self.folder, f"{stamp.strftime(_BACKUP_STAMP)}.staging")
+            try:
+                try: os.link(path, body)
+                except OSError: shutil.copyfile(path, body)
+            except OSError as e:
+                self.last_error = str(e)
+                return None
+            kind = 'full'
+            self.since_full = 0
+            self.meta_json = self._meta_json()
+        else:
+            delta = self._capture_delta()
+            if delta is None: return None
+            # 在主執行緒就轉成 JSON：差異裡的小型資料表與巢狀欄位仍與 core.data 共用，不能交給背景執行緒再讀
+            body = json.dumps(delta, ensure_ascii=False, default=_json_default).encode("utf-8")
+            kind, fmt = 'delta', 'json'
+            self.since_full += 1
+        self._clear_dirty()
+        self.need_full = False
+        name = f"{stamp.strftime(_BACKUP_STAMP)}.{kind}.{fmt}.gz"
+        with self.lock:
+            self.jobs.put((name, kind, body))
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._worker, name="BackupWriter", daemon=True)
+                self.thread.start()
+        return name
+
+
+    def wait(self):
+        """ 等背景執行緒寫完目前排入的備份 """
+        self.jobs.join()
+
+    def close(self):
+        self.wait()
+        self.core.bus.unsubscribe(self.token)
+
+    def _worker(self):
+        while True:
+            try:
+                name, kind, body = self.jobs.get(timeout=5)
+            except queue.Empty:
+                with self.lock:
+                    if self.jobs.empty():
+                        self.thread = None
+                        return
+                continue
+            try:
+                self._write(name, kind, body)
+            except Exception as e:
+                self.last_error = f"{name}: {e}"
+                print(f"備份錯誤: {self.last_error}")
+            finally:
+                self.jobs.task_done()
+
+    def _write(self, name, kind, body):
+        if kind == 'delta' and self._broken: return  # 前面有一份沒寫成功，等下一份完整備份
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, name)
+        tmp = path + ".tmp"
+        try:
+            with gzip.open(tmp, "wb", compresslevel=6) as f:
+                if kind == 'full':
+                    with open(body, "rb") as src: shutil.copyfileobj(src, f, 1 << 20)
+                else:
+                    f.write(body)
+            os.replace(tmp, path)
+            self._broken = False
+        except Exception:
+            self._broken = True
+            self.need_full = True
+            if os.path.exists(tmp): os.remove(tmp)
+            raise
+        finally:
+            if kind == 'full': os.remove(body)
+        prune_backups(self.folder, self.keep_days)
+
+# ================= 類別：核心資料邏輯 (不依賴視窗) =================
+class ERPCore:
+    """
+    資料與商業邏輯層，不建立任何 Tk 元件。
+    主視窗 AdvancedERPSystem 繼承自這個類別；命令列工具與效能測試則可直接使用它。
+    """
+    def __init__(self, data_file=None, snapshot_file=None, storage_format=None, autoload=True):
+        self.data_file = data_file or DATA_FILE
+        self.snapshot_file = snapshot_file or SNAPSHOT_FILE
+        self.storage_format = storage_format or STORAGE_FORMAT
+
+        # --- 初始化資料結構 ---
+        self.data = {
+            "po_db": [],      # 採購單資料庫
+            "stock_db": {'CPU-i9': 5, 'RAM-16G': 50}, # 現有庫存 (各倉庫合計，由 stock_loc_db 推算)
+            "stock_loc_db": {DEFAULT_LOCATION: {'CPU-i9': 5, 'RAM-16G': 50}}, # 倉庫 -> {品項: 數量}
+            "locations": [DEFAULT_LOCATION], # 倉庫清單
+            "transfer_db": [], # 調撥紀錄
+            "opening_stock": {DEFAULT_LOCATION: {'CPU-i9': 5, 'RAM-16G': 50}}, # 期初庫存 (對帳基準)
+            "sales_db": [],   # 銷售紀錄
+            "ap_db": [],      # 應付帳款 (Accounts Payable)
+            "memory_items": ['CPU-i9', 'RAM-16G', 'SSD-1TB', 'Office軟體'], # 選單記憶
+            "memory_vendors": ['光華科技', '原價屋', '微軟經銷商'],
+            "source_types": ['直接輸入', '採購計畫拋轉', '訂貨單拋轉', '詢價單轉入'],
+            "vendor_contacts": {}, # 廠商 -> Email
+            "schema_version": SCHEMA_VERSION
+        }
+        # --- 記憶體內索引 (不存檔，載入後重建，之後隨異動增量更新) ---
+        self.po_by_id = {}
+        self.delivery_index = DeliveryIndex()
+        self.vendor_stats = VendorScorecard()
+        self.ap_index = UnpaidAPIndex()
+        self.stock = StockLedger()
+        self.recon = Reconciler()
+        self.item_names = PrefixIndex()    # 品項自動完成
+        self.vendor_names = PrefixIndex()  # 廠商自動完成
+        self.memory_sets = {}              # 'memory_items' / 'memory_vendors' 的集合，檢查是否已記憶用
+        self.bus = ChangeBus()             # 資料異動通知 (視窗版會改成閒置時合併刷新)
+        self.po_by_item = {}  # 品項 -> 依 po_db 順序的採購單 (最後一筆即最新單價)
+        self.open_pos = {}        # 品項 -> {採購單號: 未交齊的採購單}，掃描收貨用
+        self.last_sale_price = {} # 品項 -> 最近一次銷售單價，掃描出庫用
+        self._issued_ids = set()  # 本次執行已發出的單號 (同一秒內重複要號用)
+        self.recorder = None      # WorkloadRecorder：記錄操作流供 loadtest 重播 (預設不記錄)
+        self.load_error = None    # 讀檔失敗的原因；不為 None 時拒絕存檔與備份，避免以預設資料覆蓋原檔
+        if autoload: self.load_data() # 讀取 JSON
+        else: self.rebuild_indexes()
+
+    # ================= 檔案存取邏輯 (JSON / 二進位快照) =================
+    @instrumented()
+    def save_data(self):
+        if self.load_error is not None:
+            # 讀檔失敗時記憶體裡是預設資料，存檔會蓋掉原本 (可能還救得回來) 的資料檔
+            print(f"略過存檔：資料檔讀取失敗 ({self.load_error})")
+            return False
+        try:
+            if self.storage_format == "binary":
+                write_snapshot(self.data, self.snapshot_file)
+            else:
+                write_json_file(self.data, self.data_file)
+            if INSTRUMENT.enabled:
+                path = self.snapshot_file if self.storage_format == "binary" else self.data_file
+                INSTRUMENT.count("bytes_written.save_data", os.path.getsize(path))
+            return True
+        except Exception as e:
+            print(f"存檔錯誤: {e}")
+            return False
+
+    @instrumented()
+    def load_data(self):
+        try:
+            # 快照在寫入時已完成遷移，可直接載入；若 JSON 較新 (例如外部匯入)，則以 JSON 為準
+            use_snapshot = self.storage_format == "binary" and os.path.exists(self.snapshot_file) and not (
+                os.path.exists(self.data_file) and os.path.getmtime(self.data_file) > os.path.getmtime(self.snapshot_file))
+            if use_snapshot:
+                loaded = read_snapshot(self.snapshot_file)
+            else:
+                candidates = [self.data_file] + (LEGACY_DATA_FILES if self.data_file == DATA_FILE else [])
+                src = next((p for p in candidates if os.path.exists(p)), None)
+                if src is None: return
+                with open(src, "r", encoding="utf-8") as f:
+                    loaded = json.load(f)
+            migrated = apply_migrations(loaded)
+            self.data.update(loaded)
+            self.rebuild_indexes()
+            self.load_error = None
+            # 上次結束前沒寄出的信 (當機或強制關閉) 不會有結果回來，「排程中」改回「未傳送」才能重新寄
+            for p in self.data['po_db']:
+                if p['email_status'] == '排程中': p['email_status'] = '未傳送'
+            # 遷移只做一次：結果立即寫回 (binary 模式則轉存成快照)
+            if migrated or (self.storage_format == "binary" and not use_snapshot):
+                if migrated: print(f"資料結構已升級至第 {loaded['schema_version']} 版")
+                self.save_data()
+        except Exception as e:
+            self.load_error = str(e)
+            print(f"讀取錯誤: {e}")
+
+    def rebuild_indexes(self):
+        """ 依目前資料重建所有記憶體內索引 (載入或整批替換資料後呼叫) """
+        records_from_data(self.data)
+        self.po_by_id = {p.id: p for p in self.data['po_db']}
+        self.po_by_item = {}
+        for p in self.data['po_db']: self.po_by_item.setdefault(p.item, []).append(p)
+        self.stock.rebuild(self.data['stock_loc_db'], self.data['stock_db'])
+        self.delivery_index.rebuild(self.data['po_db'])
+        self.vendor_stats.rebuild(self.data['po_db'], self.data['ap_db'], self.po_by_id)
+        self.ap_index.rebuild(self.data['ap_db'])
+        self.recon.rebuild(self.data, self.po_by_id, self.stock)
+        po_db = self.data['po_db']
+        self.item_names.rebuild(self.data['memory_items'] + list(self.data['stock_db']), [p.item for p in po_db])
+        self.vendor_names.rebuild(self.data['memory_vendors'], [p.vendor for p in po_db])
+        self.memory_sets = {k: set(self.data[k]) for k in ('memory_items', 'memory_vendors')}
+        self.open_pos = {}
+        for p in po_db: self._track_open(p)
+        self.last_sale_price = {s.item: s.price for s in self.data['sales_db']}
+
+    # ================= 資料異動 (所有修改都經過這裡，索引才能保持一致) =================
+    def _track_open(self, po):
+        """ 維護 open_pos：未結案且未交齊的採購單才列入 """
+        bucket = self.open_pos.get(po.item)
+        if po.status == 'Open' and po.received_qty < po.qty:
+            if bucket is None: bucket = self.open_pos[po.item] = {}
+            bucket[po.id] = po
+        elif bucket is not None and bucket.get(po.id) is po:
+            del bucket[po.id]
+            if not bucket: del self.open_pos[po.item]
+
+    def _untrack_open(self, po):
+        bucket = self.open_pos.get(po.item)
+        if bucket is not None and bucket.get(po.id) is po:
+            del bucket[po.id]
+            if not bucket: del self.open_pos[po.item]
+
+    def _publish_price(self, items, before):
+        """ 品項的最新單價若因採購單異動而改變，發出 'price' 事件 """
+        changed = [it for it, old in zip(items, before) if self.get_latest_price(it) != old]
+        if changed: self.bus.publish('price', changed)
+
+    def add_po(self, po):
+        po = PO.coerce(po)
+        before = self.get_latest_price(po.item)
+        self.data['po_db'].append(po)
+        self.po_by_id[po['id']] = po
+        self.po_by_item.setdefault(po['item'], []).append(po)
+        self.delivery_index.update(po)
+        self.vendor_stats.on_po_added(po)
+        self.recon.on_po_changed(po['id'])
+        self._track_open(po)
+        if self.recorder is not None: self.recorder.log('po_create', po=po)
+        self.bus.publish('po', [po.id])
+        self._publish_price([po.item], [before])
+
+    def replace_po(self, idx, po):
+        po = PO.coerce(po)
+        old = self.data['po_db'][idx]
+        items = list(dict.fromkeys((old.item, po.item)))
+        before = [self.get_latest_price(it) for it in items]
+        self.data['po_db'][idx] = po
+        self.po_by_id.pop(old['id'], None)
+        if old['item'] == po['item']:
+            lst = self.po_by_item[old['item']]
+            lst[next(i for i, x in enumerate(lst) if x is old)] = po
+        else:
+            # 品項被修改 (少見)：兩個品項依 po_db 順序重建
+            for item in (old['item'], po['item']):
+                self.po_by_item[item] = [x for x in self.data['po_db'] if x['item'] == item]
+        self.delivery_index.remove(old['id'])
+        self.po_by_id[po['id']] = po
+        self.delivery_index.update(po)
+        self.vendor_stats.on_po_replaced(old, po)
+        self.recon.on_po_changed(old['id'], po['id'])
+        self._untrack_open(old)
+        self._track_open(po)
+        if self.recorder is not None: self.recorder.log('po_edit', id=old.id, po=po)
+        self.bus.publish('po', {old.id, po.id})
+        self._publish_price(items, before)
+
+    def remove_po(self, idx):
+        before = self.get_latest_price(self.data['po_db'][idx].item)
+        po = self.data['po_db'].pop(idx)
+        self.po_by_id.pop(po['id'], None)
+        lst = self.po_by_item[po['item']]
+        del lst[next(i for i, x in enumerate(lst) if x is po)]
+        self.delivery_index.remove(po['id'])
+        self.vendor_stats.on_po_removed(po)
+        self.recon.on_po_changed(po['id'])
+        self._untrack_open(po)
+        if self.recorder is not None: self.recorder.log('po_delete', id=po.id)
+        self.bus.publish('po', [po.id])
+        self._publish_price([po.item], [before])
+        return po
+
+    def receive_po(self, po, qty_in, amt_in, location=DEFAULT_LOCATION):
+        """ 收貨：更新採購單、增加指定倉庫的庫存、產生應付帳款，回傳新的 AP 紀錄 """
+        # 1. 更新採購單狀態
+        po['received_qty'] += qty_in
+        if po['received_qty'] >= po['qty']:
+            po['status'] = 'Closed'
+        self.delivery_index.update(po)
+        self._track_open(po)
+
+        # 2. 增加庫存
+        item = po['item']
+        self.stock.add(location, item, qty_in)
+
+        # 3. 產生應付帳款 (AP)
+        ap = APEntry(
+            id=self.get_id("AP"),
+            po_ref=po['id'],
+            date=datetime.datetime.now().strftime("%Y-%m-%d"),
+            vendor=po['vendor'],
+            desc=f"進貨 {item} x{qty_in}",
+            item=item,
+            qty=qty_in,
+            location=location,
+            amt=amt_in,
+            status='Unpaid'
+        )
+        self.data['ap_db'].append(ap)
+        self.vendor_stats.on_receipt(po, ap, qty_in)
+        self.ap_index.add(ap)
+        self.recon.on_receipt(po, ap)
+        if self.recorder is not None: self.recorder.log_receive(ap, po_id=po.id, qty=qty_in, amt=amt_in, location=location)
+        self.bus.publish('po', [po.id])
+        self.bus.publish('stock', [(location, item)])
+        self.bus.publish('ap', [ap.id])
+        return ap
+
+    def record_sale(self, item, qty, price, date, location=DEFAULT_LOCATION):
+        """ 銷貨/出庫：扣指定倉庫的庫存並新增銷售紀錄 (庫存是否足夠由呼叫端檢查) """
+        self.stock.add(location, item, -qty)
+        sale = SalesLine(
+            date=date,
+            item=item,
+            qty=qty,
+            price=price,
+            total=qty * price,
+            location=location
+        )
+        self.data['sales_db'].append(sale)
+        self.recon.on_sale(sale)
+        self.item_names.touch(item)
+        self.last_sale_price[item] = price
+        if self.recorder is not None: self.recorder.log('sale', item=item, qty=qty, price=price, date=date, location=location)
+        self.bus.publish('sales', [len(self.data['sales_db']) - 1])
+        self.bus.publish('stock', [(location, item)])
+        return sale
+
+    def transfer_stock(self, item, qty, src, dst, date=None):
+        """ 倉庫間調撥 """
+        if src == dst: raise ValueError("來源與目的倉庫相同")
+        if qty > self.stock.qty(src, item): raise ValueError(f"{src} 的 {item} 庫存不足")
+        self.stock.add(src, item, -qty)
+        self.stock.add(dst, item, qty)
+        rec = {'id': self.get_id("TR"), 'date': date or datetime.datetime.now().strftime("%Y-%m-%d"),
+               'item': item, 'qty': qty, 'from': src, 'to': dst}
+        self.data['transfer_db'].append(rec)
+        self.recon.on_transfer(rec)
+        if self.recorder is not None: self.recorder.log('transfer', item=item, qty=qty, src=src, dst=dst)
+        self.bus.publish('transfer', [rec['id']])
+        self.bus.publish('stock', [(src, item), (dst, item)])
+        return rec
+
+    def add_location(self, name):
+        if name in self.data['locations']: return False
+        self.data['locations'].append(name)
+        self.data['stock_loc_db'].setdefault(name, {})
+        self.bus.publish('location', [name])
+        return True
+
+    def pay_ap(self, ap_ids, pay_date=None):
+        """ 將多筆未付帳款一次標記為已付款，回傳 (筆數, 總金額) """
+        pay_date = pay_date or datetime.datetime.now().strftime("%Y-%m-%d")
+        n, total, paid = 0, 0.0, []
+        for ap_id in ap_ids:
+            a = self.ap_index.remove(ap_id)
+            if a is None: continue
+            a['status'] = 'Paid'
+            a['pay_date'] = pay_date
+            n += 1
+            total += a['amt']
+            paid.append(ap_id)
+        if paid:
+            if self.recorder is not None: self.recorder.log_pay(paid)
+            self.bus.publish('ap', paid)
+        return n, total
+
+    def remember(self, memory_key, name):
+        """ 記住輸入過的品項 / 廠商 (memory_items 或 memory_vendors)，並計入自動完成的使用次數 """
+        seen = self.memory_sets.setdefault(memory_key, set(self.data[memory_key]))
+        if name not in seen:
+            seen.add(name)
+            self.data[memory_key].append(name)
+        (self.item_names if memory_key == 'memory_items' else self.vendor_names).touch(name)
+
+    def get_id(self, prefix):
+        """ 產生唯一的單號 (格式: 前綴-月日時分秒；同一秒內再要號時加上 -2、-3...) """
+        base = f"{prefix}-{datetime.datetime.now().strftime('%m%H%M%S')}"
+        new_id, n = base, 1
+        while new_id in self._issued_ids or new_id in self.po_by_id:
+            n += 1
+            new_id = f"{base}-{n}"
+        self._issued_ids.add(new_id)
+        return new_id
+
+    def get_latest_price(self, item_name):
+        """ 取得該品項最近一次的採購單價 (用於計算庫存成本) """
+        related_pos = self.po_by_item.get(item_name)
+        if not related_pos:
+            return 0 
+        return related_pos[-1]['price']
+
+    # ================= 圖表資料 (不需視窗即可產生 Figure) =================
+    def figure_overview_pie(self, month, sales=None):
+        """ 每月各品項銷售佔比圓餅圖；該月無銷售回傳 None (sales 可傳入已篩選好的該月銷售) """
+        sales_stats = {}
+        for s in (self.data['sales_db'] if sales is None else sales):
+            if s.date.startswith(month):
+                sales_stats[s.item] = sales_stats.get(s.item, 0) + s.qty
+        if not sales_stats:
+            return None
+
+        labels = list(sales_stats.keys())
+        sizes = list(sales_stats.values())
         
-        # --- 頂部導航列 (上個月 / 顯示月份 / 下個月) ---
-        header = tk.Frame(self, bg=COLORS["primary"], pady=5)
-        header.pack(fill='x')
+        fig = Figure(figsize=(7, 5), dpi=100)
+        ax = fig.add_subplot(111)
+
+        wedges, texts, autotexts = ax.pie(
+                sizes,
+                autopct='%1.1f%%',
+                startangle=140,
+                pctdistance=0.75,
+                colors=plt.cm.Set3.colors,
+                textprops=dict(color="black")
+        )
+
+        plt.setp(autotexts, size=10, weight="bold")
+        ax.set_title(f"【{month}】各品項銷售佔比", fontsize=14)
+        ax.legend(wedges, labels, title="品項列表", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
+        return fig
+
+    def figure_financial_bar(self, month, ap=None, sales=None):
+        """ 每月收入 / 成本 / 毛利長條圖 """
+        total_cost = 0
+        for a in (self.data['ap_db'] if ap is None else ap):
+            if a.date.startswith(month): total_cost += a.amt
         
-        btn_prev = tk.Button(header, text="<", command=lambda: self.change_month(-1),
-                             bg=COLORS["primary"], fg="white", bd=0, font=FONT_BOLD, activebackground=COLORS["secondary"])
-        btn_prev.pack(side='left', padx=15)
+        total_rev = 0
+        for s in (self.data['sales_db'] if sales is None else sales):
+            if s.date.startswith(month):
+                rev = s.get('total', s.get('qty', 0) * s.get('price', 0))
+                total_rev += rev
         
-        tk.Label(header, text=self.current_date.strftime("%Y年 %m月"), 
-                 font=("Microsoft JhengHei UI", 14, "bold"), bg=COLORS["primary"], fg="white").pack(side='left', expand=True)
+        gross_profit = total_rev - total_cost
+
+        fig = Figure(figsize=(6, 5), dpi=100)
+        ax = fig.add_subplot(111)
+        cats = ['總收入', '總成本', '毛利']
+        vals = [total_rev, total_cost, gross_profit]
+        colors = [COLORS['success'], COLORS['danger'], COLORS['warning']]
         
-        btn_next = tk.Button(header, text=">", command=lambda: self.change_month(1),
-                             bg=COLORS["primary"], fg="white", bd=0, font=FONT_BOLD, activebackground=COLORS["secondary"])
-        btn_next.pack(side='right', padx=15)
+        bars = ax.bar(cats, vals, color=colors)
+        ax.set_title(f"{month} 財務概況", fontsize=14)
+        ax.set_ylabel("金額 ($)")
+        
+        for bar in bars:
+            height = bar.get_height()
+            ax.text(bar.get_x() + bar.get_width()/2., height,
+                    f'${height:,.0f}',
+                    ha='center', va='bottom')
+        return fig
 
-        # --- 星期標題 ---
-        days_frame = tk.Frame(self, bg=COLORS["bg_light"], pady=5)
-        days_frame.pack(fill='x')
-        days = ["一", "二", "三", "四", "五", "六", "日"]
-        for d in days: 
-            tk.Label(days_frame, text=d, width=5, bg=COLORS["bg_light"], font=FONT_BOLD).pack(side='left', expand=True)
+    def figure_item_sales(self, item, sales_history, color_idx=0, title=None):
+        """ 單品銷售長條圖 (sales_history 為該品項的銷售紀錄) """
+        sales_history = sorted(sales_history, key=lambda x: x.date)
+        dates = [s.date for s in sales_history]
+        qtys = [s.qty for s in sales_history]
 
-        # --- 日期按鈕區 ---
-        cal_frame = tk.Frame(self, bg=COLORS["bg_white"], padx=10, pady=10)
-        cal_frame.pack(expand=True, fill='both')
+        color_palette = plt.cm.Set3.colors 
+        specific_color = color_palette[color_idx % len(color_palette)]
+
+        fig = Figure(figsize=(6, 4), dpi=100)
+        ax = fig.add_subplot(111)
         
-        # 使用 calendar 模組取得當月的週曆矩陣
-        cal = calendar.monthcalendar(self.current_date.year, self.current_date.month)
-        for r, week in enumerate(cal):
-            for c, day in enumerate(week):
-                if day != 0: # 0 代表該格不屬於這個月份
-                    btn = tk.Button(cal_frame, text=str(day), width=4, 
-                                    command=lambda d=day: self.select_date(d),
-                                    bg="white", relief="flat", font=FONT_MAIN)
-                    # 加入滑鼠移入移出的變色效果
-                    btn.bind("<Enter>", lambda e, b=btn: b.config(bg=COLORS["bg_light"]))
-                    btn.bind("<Leave>", lambda e, b=btn: b.config(bg="white"))
-                    btn.grid(row=r, column=c, padx=3, pady=3, ipady=3)
+        ax.bar(dates, qtys, color=specific_color, alpha=0.9, edgecolor='grey')
+        ax.set_title(title or f"【{item}】 銷售紀錄", fontsize=14)
+        ax.set_ylabel("銷售數量")
+        fig.autofmt_xdate()
+        return fig
 
-    def change_month(self, delta):
-        """ 切換月份邏輯 """
-        month = self.current_date.month + delta
-        year = self.current_date.year
-        if month > 12: month = 1; year += 1
-        elif month < 1: month = 12; year -= 1
-        self.current_date = self.current_date.replace(year=year, month=month, day=1)
-        self.setup_ui()
+    def figure_trend_line(self, end_month=None):
+        """ 近半年進銷貨趨勢折線圖 (end_month 為 YYYY-MM，預設本月) """
+        month_keys = []
+        curr = datetime.date.fromisoformat(end_month + "-01") if end_month else datetime.date.today()
+        # 產生過去 6 個月的標籤
+        curr = curr.replace(day=1)
+        for i in range(6):
+            month_keys.append(curr.strftime("%Y-%m"))
+            curr = (curr - datetime.timedelta(days=1)).replace(day=1)
+        month_keys.reverse()
 
-    def select_date(self, day):
-        """ 選擇日期後，格式化字串並呼叫 callback """
-        selected_date = self.current_date.replace(day=day).strftime("%Y-%m-%d")
-        self.callback(selected_date)
-        self.destroy()
+        in_data = []
+        out_data = []
+
+        for m in month_keys:
+            # 計算每月進貨量與銷貨量
+            in_qty = sum([p.received_qty for p in self.data['po_db'] if p.delivery_date.startswith(m)])
+            in_data.append(in_qty)
+            out_qty = sum([s.qty for s in self.data['sales_db'] if s.date.startswith(m)])
+            out_data.append(out_qty)
+
+        fig = Figure(figsize=(6, 5), dpi=100)
+        ax = fig.add_subplot(111)
+        
+        ax.plot(month_keys, in_data, marker='o', label='進貨總量', color=COLORS['primary'])
+        ax.plot(month_keys, out_data, marker='s', label='銷貨總量', color=COLORS['success'])
+        
+        ax.set_title("近半年進銷貨趨勢", fontsize=14)
+        ax.set_xlabel("月份")
+        ax.set_ylabel("數量")
+        ax.legend()
+        ax.grid(True, linestyle='--', alpha=0.6)
+        return fig
 
 # ================= 類別：主系統邏輯 =================
-class AdvancedERPSystem:
-    def __init__(self, root):
+class AdvancedERPSystem(ERPCore):
+    def __init__(self, root, **core_options):
         self.root = root
         self.root.title("python238-倉庫庫存管理系統")
         self.root.geometry("1400x900")
@@ -127,18 +2561,18 @@ class AdvancedERPSystem:
 
         self.setup_styles() # 設定 Treeview 與 Tab 樣式
 
-        # --- 初始化資料結構 ---
-        self.data = {
-            "po_db": [],      # 採購單資料庫
-            "stock_db": {'CPU-i9': 5, 'RAM-16G': 50}, # 現有庫存
-            "sales_db": [],   # 銷售紀錄
-            "ap_db": [],      # 應付帳款 (Accounts Payable)
-            "memory_items": ['CPU-i9', 'RAM-16G', 'SSD-1TB', 'Office軟體'], # 選單記憶
-            "memory_vendors": ['光華科技', '原價屋', '微軟經銷商'],
-            "source_types": ['直接輸入', '採購計畫拋轉', '訂貨單拋轉', '詢價單轉入']
-        }
-        self.load_data() # 讀取 JSON
+        super().__init__(**core_options) # 初始化資料結構並讀取 JSON
+        self.bus.scheduler = self.root.after_idle # 同一輪的異動合併成一次刷新
+        self.mailer = EmailDispatcher() # 背景寄信佇列
+        self._email_polling = False # 是否已排定 poll_email_results
+        self.backups = BackupManager(self) # 背景差異備份
+        if RECORD_OPS_FILE: self.recorder = WorkloadRecorder(RECORD_OPS_FILE) # 記錄操作流 (loadtest 重播用)
         self.create_main_layout() # 建立畫面
+        self.subscribe_views()
+        if self.load_error is not None:
+            messagebox.showerror("讀取錯誤", f"資料檔無法讀取，本次不會存檔也不會備份，以免覆蓋原檔：\n{self.load_error}\n\n"
+                                 f"請先修復資料檔，或用「python {os.path.basename(__file__)} restore」從備份還原。")
+        self.root.after_idle(self.run_scheduled_backup) # 啟動時先做一份完整備份，之後定時做差異備份
         
     # --- 輸入驗證工具 ---
     def validate_int(self, P):
@@ -210,22 +2644,42 @@ class AdvancedERPSystem:
         self.notebook.add(self.tab_warehouse, text=' 2. 進銷存管理 ')
         self.notebook.add(self.tab_finance, text=' 3. 應付帳款中心 ')
         self.notebook.add(self.tab_dashboard, text=' 4. 經營分析圖表 ')
+
+        # 隱藏的診斷分頁 (Ctrl+Shift+D 切換顯示)
+        self.tab_diag = ttk.Frame(self.notebook)
+        self.notebook.add(self.tab_diag, text=' 診斷 ')
+        self.notebook.hide(self.tab_diag)
+        self.root.bind_all("<Control-Shift-D>", self.toggle_diagnostics_tab)
         
         # 初始化各分頁內容
         self.setup_procure_tab()
         self.setup_warehouse_tab()
         self.setup_finance_tab()
         self.setup_dashboard_tab()
+        self.setup_diagnostics_tab()
         
         # 綁定事件：切換分頁時刷新圖表
         self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_change)
         # 綁定事件：關閉視窗時存檔
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
+    def subscribe_views(self):
+        """ 各畫面只訂閱自己顯示的資料；異動後在閒置時合併刷新一次 """
+        self.bus.subscribe(('po',), lambda ch: self.refresh_po_list())
+        self.bus.subscribe(('po',), lambda ch: self.refresh_inbound_list())
+        self.bus.subscribe(('stock', 'price', 'location'), lambda ch: self.refresh_stock_list())
+        self.bus.subscribe(('location',), lambda ch: self.cb_stock_loc.configure(values=["全部倉庫"] + self.data['locations']))
+        self.bus.subscribe(('location',), lambda ch: self.cb_scan_loc.configure(values=self.data['locations']))
+        self.bus.subscribe(('ap',), lambda ch: self.refresh_finance_list())
+        # 圖表只在畫面上時重畫；不在畫面上的，切換分頁時 on_tab_change 會重新整理
+        self.bus.subscribe(('po', 'stock', 'sales', 'ap', 'price'),
+                           lambda ch: self.notebook.select() == str(self.tab_dashboard) and self.refresh_dashboard())
+
     def create_flat_button(self, parent, text, cmd, bg_color, fg_color="white", icon=""):
         """ 快速建立扁平化設計按鈕的輔助函式 """
+        # 每個按鈕動作都經過量測包裝 (量測關閉時直接呼叫原函式)
         btn = tk.Button(parent, text=f"{icon} {text}" if icon else text, 
-                        command=cmd, bg=bg_color, fg=fg_color, 
+                        command=INSTRUMENT.wrap_action(f"button:{text}", cmd), bg=bg_color, fg=fg_color, 
                         font=FONT_BOLD, relief="flat", padx=15, pady=5, cursor="hand2")
         return btn
 
@@ -233,45 +2687,31 @@ class AdvancedERPSystem:
         # 如果切換到圖表頁，自動刷新數據
         if self.notebook.select() == str(self.tab_dashboard):
             self.refresh_dashboard()
-
-    # ================= 檔案存取邏輯 (JSON) =================
-    def save_data(self):
-        try:
-            with open(DATA_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=4)
-        except Exception as e:
-            print(f"存檔錯誤: {e}")
-
-    def load_data(self):
-        if os.path.exists(DATA_FILE):
-            try:
-                with open(DATA_FILE, "r", encoding="utf-8") as f:
-                    loaded = json.load(f)
-                    # 資料庫遷移與預設值補丁 (防止舊版資料缺欄位報錯)
-                    if 'sales_db' not in loaded: loaded['sales_db'] = []
-                    for p in loaded.get('po_db', []):
-                        if 'received_qty' not in p: p['received_qty'] = 0
-                        if 'delivery_date' not in p: p['delivery_date'] = datetime.datetime.now().strftime('%Y-%m-%d')
-                        if 'mfg_date' not in p: p['mfg_date'] = ''
-                        if 'email_status' not in p: p['email_status'] = '未傳送'
-                        if 'source' not in p: p['source'] = '直接輸入'
-                    for a in loaded.get('ap_db', []):
-                        if 'status' not in a: a['status'] = 'Unpaid'
-                    for s in loaded.get('sales_db', []):
-                        if 'price' not in s: s['price'] = 0
-                        if 'total' not in s: s['total'] = 0
-                    self.data.update(loaded)
-            except Exception as e:
-                print(f"讀取錯誤: {e}")
+        elif self.notebook.select() == str(self.tab_diag):
+            self.refresh_diagnostics()
 
     def on_close(self):
+        if self.mailer.pending and not messagebox.askyesno("離開", f"還有 {self.mailer.pending} 封採購單郵件尚未寄出，仍要離開？"):
+            return
         if messagebox.askokcancel("離開", "確定離開？(資料將自動儲存)"):
+            # 先停下寄信佇列再改狀態：沒開始寄的改回「未傳送」下次再寄，正在寄的等它寄完再取結果，避免重複寄出
+            cancelled = self.mailer.cancel_pending()
+            self.mailer.wait_idle(EMAIL_DRAIN_TIMEOUT)
+            self.apply_email_results()
+            for po_id in cancelled:
+                p = self.po_by_id.get(po_id)
+                if p is not None and p['email_status'] == '排程中':
+                    p['email_status'] = '未傳送'
+                    self.bus.publish('po', [p.id])
             self.save_data()
+            self.backups.backup() # 啟動時的完整備份若失敗，這裡會改做完整備份
+            self.backups.wait()
             self.root.destroy()
 
-    def get_id(self, prefix):
-        """ 產生唯一的單號 (格式: 前綴-月日時分秒) """
-        return f"{prefix}-{datetime.datetime.now().strftime('%m%H%M%S')}"
+    def run_scheduled_backup(self):
+        name = self.backups.backup()
+        if name is None and self.backups.last_error: print(f"備份錯誤: {self.backups.last_error}")
+        self.root.after(BACKUP_INTERVAL_MIN * 60000, self.run_scheduled_backup)
 
     # ================= Tab 1: 採購管理 =================
     def setup_procure_tab(self):
@@ -284,7 +2724,8 @@ class AdvancedERPSystem:
 
         self.create_flat_button(frame_top, "修改", lambda: self.open_po_window(is_edit=True), COLORS["bg_light"], fg_color=COLORS["text"], icon="✏️").pack(side='right', padx=5)
         self.create_flat_button(frame_top, "刪除", self.delete_po, COLORS["danger"], icon="🗑️").pack(side='right', padx=5)
-        self.create_flat_button(frame_top, "Email傳送", self.send_email_simulation, COLORS["warning"], icon="📧").pack(side='right', padx=5)
+        self.create_flat_button(frame_top, "廠商Email", self.open_vendor_contacts, COLORS["bg_light"], fg_color=COLORS["text"], icon="📇").pack(side='left', padx=5)
+        self.create_flat_button(frame_top, "Email傳送", self.send_po_emails, COLORS["warning"], icon="📧").pack(side='right', padx=5)
         self.create_flat_button(frame_top, "新增採購單", self.open_po_window, COLORS["primary"], icon="➕").pack(side='right', padx=5)
 
         # 建立 Treeview (採購列表)
@@ -304,29 +2745,31 @@ class AdvancedERPSystem:
         self.tree_po.pack(fill='both', expand=True, padx=10, pady=(0,10))
         self.refresh_po_list()
 
+    @instrumented()
     def refresh_po_list(self):
         """ 刷新採購列表數據 """
         for row in self.tree_po.get_children(): self.tree_po.delete(row)
         for idx, p in enumerate(self.data['po_db']):
-            total = p['qty'] * p['price']
-            status_show = p['status']
+            total = p.qty * p.price
+            status_show = p.status
             tag = 'odd' if idx % 2 != 0 else 'even'
             
             # 判斷狀態顯示文字
-            if p['status'] == 'Open' and p['received_qty'] > 0:
-                status_show = f"部分 ({p['received_qty']}/{p['qty']})"
+            if p.status == 'Open' and p.received_qty > 0:
+                status_show = f"部分 ({p.received_qty}/{p.qty})"
                 tag_special = 'partial'
-            elif p['status'] == 'Closed':
+            elif p.status == 'Closed':
                 tag_special = 'closed'
             else:
                 tag_special = 'open'
             
-            mfg_date = p.get('mfg_date', '')
+            mfg_date = p.mfg_date or ''
 
             self.tree_po.insert("", "end", iid=idx, values=(
-                p['id'], p['source'], p['vendor'], p['item'], mfg_date,
-                p['qty'], p['delivery_date'], p['email_status'], total, status_show
+                p.id, p.source, p.vendor, p.item, mfg_date,
+                p.qty, p.delivery_date, p.email_status, total, status_show
             ), tags=(tag, tag_special))
+        INSTRUMENT.count("rows_rendered.po_list", len(self.data['po_db']))
 
     def export_procurement_data(self):
         """ 匯出 CSV 功能 """
@@ -391,12 +2834,12 @@ class AdvancedERPSystem:
         cb_source.grid(row=1, column=1, sticky='ew', padx=10)
 
         tk.Label(form, text="廠商:", font=FONT_BOLD, bg="white", fg=COLORS["secondary"]).grid(row=2, column=0, sticky='w')
-        cb_vendor = ttk.Combobox(form, values=self.data['memory_vendors'], font=FONT_MAIN)
+        cb_vendor = AutocompleteCombobox(form, self.vendor_names, font=FONT_MAIN)
         if is_edit: cb_vendor.set(edit_val['vendor'])
         cb_vendor.grid(row=2, column=1, sticky='ew', padx=10)
 
         tk.Label(form, text="品項:", font=FONT_BOLD, bg="white", fg=COLORS["secondary"]).grid(row=3, column=0, sticky='w')
-        cb_item = ttk.Combobox(form, values=self.data['memory_items'], font=FONT_MAIN)
+        cb_item = AutocompleteCombobox(form, self.item_names, font=FONT_MAIN)
         if is_edit: cb_item.set(edit_val['item'])
         cb_item.grid(row=3, column=1, sticky='ew', padx=10)
 
@@ -450,6 +2893,12 @@ class AdvancedERPSystem:
                 messagebox.showerror("數值錯誤", "數量必須大於 0！")
                 return
 
+            try:
+                datetime.date.fromisoformat(raw_date)
+            except ValueError:
+                messagebox.showerror("格式錯誤", "交貨日期格式應為 YYYY-MM-DD")
+                return
+
             data = {
                 'id': e_id.get(),
                 'source': cb_source.get(),
@@ -465,15 +2914,13 @@ class AdvancedERPSystem:
             }
             
             # 自動將新輸入的廠商與品項加入記憶清單
-            if data['vendor'] not in self.data['memory_vendors']: self.data['memory_vendors'].append(data['vendor'])
-            if data['item'] not in self.data['memory_items']: self.data['memory_items'].append(data['item'])
+            self.remember('memory_vendors', data['vendor'])
+            self.remember('memory_items', data['item'])
             
-            if is_edit: self.data['po_db'][edit_idx] = data
-            else: self.data['po_db'].append(data)
+            if is_edit: self.replace_po(edit_idx, data)
+            else: self.add_po(data)
             
             self.save_data()
-            self.refresh_po_list()
-            self.refresh_warehouse_list()
             win.destroy()
             
             if not is_edit:
@@ -481,22 +2928,92 @@ class AdvancedERPSystem:
 
         self.create_flat_button(form, "儲存並建立", save, COLORS["success"]).grid(row=8, column=0, columnspan=2, pady=30, sticky='ew')
 
-    def send_email_simulation(self):
-        """ 模擬發送 Email """
+    def send_po_emails(self):
+        """ 將選取的採購單 (未選取則詢問是否寄出全部未傳送的) 排入背景寄信佇列 """
+        sendable = lambda p: p['status'] == 'Open' and p['email_status'] in ('未傳送', '傳送失敗')
         sel = self.tree_po.selection()
-        if not sel: return messagebox.showwarning("提示", "請選擇要傳送的採購單")
-        idx = int(sel[0])
-        po = self.data['po_db'][idx]
-        messagebox.showinfo("傳送成功", f"採購單 {po['id']} 已透過 Email 發送給 {po['vendor']}！")
-        po['email_status'] = '已傳送 (廠商未讀)'
-        self.refresh_po_list()
+        if sel:
+            targets = [p for p in (self.data['po_db'][int(i)] for i in sel) if sendable(p)]
+            if not targets: return messagebox.showwarning("提示", "選取的採購單都已結案、已寄出或正在排程中")
+        else:
+            targets = [p for p in self.data['po_db'] if sendable(p)]
+            if not targets: return messagebox.showwarning("提示", "請選擇要傳送的採購單")
+            if not messagebox.askyesno("確認", f"未選取採購單，是否寄出全部 {len(targets)} 張未傳送的採購單？"): return
+
+        contacts = self.data['vendor_contacts']
+        missing = sorted({p['vendor'] for p in targets if not contacts.get(p['vendor'])})
+        if missing:
+            messagebox.showwarning("缺少 Email", "下列廠商尚未設定 Email，將略過：\n" + "、".join(missing)
+                                   + "\n\n請用「廠商Email」按鈕設定。")
+        queued = []
+        for p in targets:
+            to_addr = contacts.get(p['vendor'])
+            if not to_addr: continue
+            self.mailer.submit(p, to_addr)
+            p['email_status'] = '排程中'
+            queued.append(p['id'])
+        if not queued: return
+        self.bus.publish('po', queued)
         self.save_data()
-        
-        # 模擬廠商讀取 (用對話框詢問)
-        if messagebox.askyesno("確認", "廠商已讀取郵件？"):
-            po['email_status'] = '✅ 廠商已讀'
-            self.refresh_po_list()
+        if not self._email_polling: # 已經在輪詢就不再多開一個
+            self._email_polling = True
+            self.root.after(500, self.poll_email_results)
+
+    def poll_email_results(self):
+        """ 定期取回背景寄信結果，批次更新狀態後只刷新/存檔一次 """
+        more = self.mailer.pending # 先讀 pending 再取結果，讀到 0 時最後一筆結果一定已在佇列中
+        self.apply_email_results()
+        if more:
+            self.root.after(500, self.poll_email_results)
+        else:
+            self._email_polling = False
+
+    def apply_email_results(self):
+        results = self.mailer.poll_results()
+        if results:
+            failed = []
+            for po_id, ok, error in results:
+                p = self.po_by_id.get(po_id)
+                if p is None: continue
+                p['email_status'] = '已傳送 (廠商未讀)' if ok else '傳送失敗'
+                if not ok: failed.append(f"{po_id}: {error}")
+            self.bus.publish('po', [po_id for po_id, _, _ in results])
+            self.save_data()
+            if failed:
+                print("Email 傳送失敗:\n" + "\n".join(failed))
+
+    def open_vendor_contacts(self):
+        """ 設定廠商 Email (雙擊修改) """
+        win = tk.Toplevel(self.root)
+        win.title("廠商 Email 設定")
+        win.geometry("500x400")
+        win.configure(bg="white")
+        tree = ttk.Treeview(win, columns=("廠商", "Email"), show='headings')
+        tree.heading("廠商", text="廠商"); tree.column("廠商", width=150, anchor="center")
+        tree.heading("Email", text="Email"); tree.column("Email", width=280, anchor="center")
+        tree.pack(fill='both', expand=True, padx=10, pady=10)
+        tree.tag_configure('even', background=COLORS["table_row_even"])
+
+        def fill():
+            for row in tree.get_children(): tree.delete(row)
+            for i, v in enumerate(self.data['memory_vendors']):
+                tree.insert("", "end", iid=str(i), values=(v, self.data['vendor_contacts'].get(v, "")),
+                            tags=('even' if i % 2 == 0 else 'odd',))
+
+        def edit(event):
+            sel = tree.selection()
+            if not sel: return
+            vendor = self.data['memory_vendors'][int(sel[0])]
+            addr = simpledialog.askstring("廠商 Email", f"{vendor} 的 Email:", parent=win,
+                                          initialvalue=self.data['vendor_contacts'].get(vendor, ""))
+            if addr is None: return
+            if addr.strip(): self.data['vendor_contacts'][vendor] = addr.strip()
+            else: self.data['vendor_contacts'].pop(vendor, None)
             self.save_data()
+            fill()
+
+        tree.bind("<Double-1>", edit)
+        fill()
 
     def delete_po(self):
         """ 刪除採購單 (有防呆：已進貨不能刪) """
@@ -505,32 +3022,17 @@ class AdvancedERPSystem:
         idx = int(sel[0])
         if self.data['po_db'][idx]['status'] != 'Open' or self.data['po_db'][idx]['received_qty'] > 0:
             return messagebox.showerror("禁止", "已有進貨紀錄或已結案，無法刪除。")
-        del self.data['po_db'][idx]
-        self.refresh_po_list()
+        self.remove_po(idx)
         self.save_data()
 
     def show_calendar_view(self):
-        """ 顯示簡單的採購交期列表視窗 """
-        win = tk.Toplevel(self.root)
-        win.title("採購日程表 (本月)")
-        win.geometry("600x450")
-        win.configure(bg="white")
-        tree = ttk.Treeview(win, columns=("交期", "廠商", "品項", "未交數量"), show='headings')
-        tree.heading("交期", text="預計交期"); tree.column("交期", width=120, anchor="center")
-        tree.heading("廠商", text="廠商"); tree.column("廠商", width=120, anchor="center")
-        tree.heading("品項", text="品項"); tree.column("品項", width=150, anchor="center")
-        tree.heading("未交數量", text="未交數量"); tree.column("未交數量", width=80, anchor="center")
-        tree.pack(fill='both', expand=True, padx=10, pady=10)
-        sorted_po = sorted(self.data['po_db'], key=lambda x: x['delivery_date'])
-        for i, p in enumerate(sorted_po):
-            if p['status'] == 'Open':
-                remain = p['qty'] - p['received_qty']
-                tag = 'even' if i % 2 == 0 else 'odd'
-                tree.insert("", "end", values=(p['delivery_date'], p['vendor'], p['item'], remain), tags=(tag,))
-        tree.tag_configure('even', background=COLORS["table_row_even"])
+        """ 開啟交期行事曆 (月/週檢視) """
+        DeliveryCalendar(self.root, self)
 
     # ================= Tab 2: 倉儲管理 (進銷存) =================
     def setup_warehouse_tab(self):
+        self.setup_scan_bar()
+
         # 使用 PanedWindow 建立左右可調整大小的分欄
         paned = ttk.PanedWindow(self.tab_warehouse, orient=tk.HORIZONTAL)
         paned.pack(fill='both', expand=True, padx=10, pady=10)
@@ -547,12 +3049,25 @@ class AdvancedERPSystem:
             self.tree_in.column(c, anchor='center', width=w)
         self.tree_in.pack(fill='both', expand=True)
         # 綁定雙擊事件 -> 開啟收貨視窗
-        self.tree_in.bind("<Double-1>", self.open_receipt_window)
+        self.tree_in.bind("<Double-1>", INSTRUMENT.wrap_action("action:open_receipt_window", self.open_receipt_window))
         self.tree_in.tag_configure('even', background=COLORS["table_row_even"])
         
         # --- 右側：現有庫存 ---
         frame_r = ttk.LabelFrame(paned, text="📊 庫存與銷貨", padding=10)
         paned.add(frame_r, weight=2)
+
+        # 倉庫篩選 (全部倉庫 = 各倉合計)
+        loc_bar = tk.Frame(frame_r, bg=COLORS["bg_light"])
+        loc_bar.pack(fill='x', pady=(0, 5))
+        tk.Label(loc_bar, text="倉庫:", font=FONT_BOLD, bg=COLORS["bg_light"]).pack(side='left')
+        self.stock_loc_var = tk.StringVar(value="全部倉庫")
+        self.cb_stock_loc = ttk.Combobox(loc_bar, textvariable=self.stock_loc_var, state='readonly', font=FONT_MAIN, width=12,
+                                         values=["全部倉庫"] + self.data['locations'])
+        self.cb_stock_loc.pack(side='left', padx=5)
+        self.cb_stock_loc.bind("<<ComboboxSelected>>", lambda e: self.refresh_stock_list())
+        self.create_flat_button(loc_bar, "新增倉庫", self.add_location_dialog, COLORS["bg_light"], fg_color=COLORS["text"], icon="🏭").pack(side='right')
+        self.create_flat_button(loc_bar, "對帳檢查", lambda: ReconcileWindow(self.root, self), COLORS["bg_light"], fg_color=COLORS["text"], icon="🧾").pack(side='right')
+
         self.tree_stock = ttk.Treeview(frame_r, columns=("品項", "庫存量", "庫存總值"), show='headings')
         self.tree_stock.heading("品項", text="品項"); self.tree_stock.column("品項", width=100, anchor='center')
         self.tree_stock.heading("庫存量", text="庫存量"); self.tree_stock.column("庫存量", width=80, anchor='center')
@@ -562,20 +3077,126 @@ class AdvancedERPSystem:
         self.tree_stock.tag_configure('even', background=COLORS["table_row_even"])
         
         # 銷貨按鈕
-        self.create_flat_button(frame_r, "銷貨/領料出庫 (紀錄營收)", self.open_sales_window, COLORS["danger"], icon="📤").pack(fill='x', pady=10)
+        self.create_flat_button(frame_r, "銷貨/領料出庫 (紀錄營收)", self.open_sales_window, COLORS["danger"], icon="📤").pack(fill='x', pady=(10, 5))
+        self.create_flat_button(frame_r, "庫存調撥", self.open_transfer_window, COLORS["secondary"], icon="🔁").pack(fill='x', pady=(0, 10))
 
         self.refresh_warehouse_list()
 
-    def get_latest_price(self, item_name):
-        """ 取得該品項最近一次的採購單價 (用於計算庫存成本) """
-        related_pos = [p for p in self.data['po_db'] if p['item'] == item_name]
-        if not related_pos:
-            return 0 
-        return related_pos[-1]['price']
+    # --- 掃描模式 (條碼槍 / 鍵盤楔形輸入) ---
+    def setup_scan_bar(self):
+        """ 常駐的掃描列：每次 Enter 處理一筆並暫存在 ScanSession，按「提交」才整批寫入 """
+        self.scan_session = ScanSession(self, 'receive', self.data['locations'][0])
+        bar = ttk.LabelFrame(self.tab_warehouse, text="🔫 掃描模式 (F2 聚焦)", padding=8)
+        bar.pack(fill='x', padx=10, pady=(10, 0))
+
+        top = tk.Frame(bar, bg=COLORS["bg_light"])
+        top.pack(fill='x')
+        self.scan_mode_var = tk.StringVar(value='receive')
+        for text, val in (("收貨", 'receive'), ("出庫", 'issue')):
+            tk.Radiobutton(top, text=text, value=val, variable=self.scan_mode_var, command=self.change_scan_target,
+                           bg=COLORS["bg_light"], font=FONT_BOLD).pack(side='left')
+        tk.Label(top, text="倉庫:", font=FONT_BOLD, bg=COLORS["bg_light"]).pack(side='left', padx=(10, 0))
+        self.cb_scan_loc = ttk.Combobox(top, values=self.data['locations'], state='readonly', font=FONT_MAIN, width=10)
+        self.cb_scan_loc.set(self.scan_session.location)
+        self.cb_scan_loc.pack(side='left', padx=5)
+        self.cb_scan_loc.bind("<<ComboboxSelected>>", lambda e: self.change_scan_target())
+
+        # 條碼槍送完一筆會接 Enter (有些設定是 Tab)；處理函式不做 I/O，連續掃描的按鍵都留在 Tk 事件佇列裡依序處理
+        self.e_scan = tk.Entry(top, font=FONT_MAIN, bg=COLORS["bg_white"], relief="flat")
+        self.e_scan.pack(side='left', fill='x', expand=True, padx=10)
+        for seq in ("<Return>", "<KP_Enter>", "<Tab>"):
+            self.e_scan.bind(seq, self.on_scan)
+        self.root.bind_all("<F2>", lambda e: self.e_scan.focus_set())
+
+        self.create_flat_button(top, "提交", self.commit_scan_session, COLORS["success"], icon="✔").pack(side='left', padx=2)
+        self.create_flat_button(top, "復原", self.undo_scan, COLORS["warning"]).pack(side='left', padx=2)
+        self.create_flat_button(top, "清除", self.clear_scan_session, COLORS["bg_light"], fg_color=COLORS["text"]).pack(side='left', padx=2)
+
+        self.scan_msg_var = tk.StringVar(value="掃描品項條碼；*N 指定下一筆數量，收貨時可先掃採購單號")
+        self.lbl_scan_msg = tk.Label(bar, textvariable=self.scan_msg_var, font=FONT_MAIN, bg=COLORS["bg_light"], anchor='w')
+        self.lbl_scan_msg.pack(fill='x', pady=(5, 0))
+
+        self.tree_scan = ttk.Treeview(bar, columns=("品項", "採購單", "數量"), show='headings', height=3)
+        for c in ("品項", "採購單", "數量"):
+            self.tree_scan.heading(c, text=c); self.tree_scan.column(c, anchor='center')
+        self.tree_scan.pack(fill='x', pady=(5, 0))
 
+    def _scan_row(self, key):
+        """ 只更新掃到的那一列，不重畫整個表 """
+        iid = f"{key[0]}\x1f{key[1] or ''}"
+        qty = self.scan_session.lines.get(key)
+        if qty is None:
+            if self.tree_scan.exists(iid): self.tree_scan.delete(iid)
+        elif self.tree_scan.exists(iid):
+            self.tree_scan.set(iid, "數量", qty)
+        else:
+            self.tree_scan.insert("", 0, iid=iid, values=(key[0], key[1] or "(依交期分配)", qty))
+
+    def _scan_status(self, msg, color=COLORS["text"]):
+        s = self.scan_session
+        self.scan_msg_var.set(f"{msg}   | 共 {len(s.lines)} 行 / {s.units} 件")
+        self.lbl_scan_msg.configure(fg=color)
+
+    def on_scan(self, event=None):
+        code = self.e_scan.get()
+        self.e_scan.delete(0, 'end')
+        status, msg, key = self.scan_session.scan(code)
+        if key is not None: self._scan_row(key)
+        if status == 'error':
+            self.root.bell()
+            self._scan_status(msg, COLORS["danger"])
+        elif msg:
+            self._scan_status(msg)
+        return "break"
+
+    def undo_scan(self):
+        key = self.scan_session.undo()
+        if key is not None:
+            self._scan_row(key)
+            self._scan_status(f"已復原 {key[0]}")
+        self.e_scan.focus_set()
+
+    def clear_scan_session(self):
+        self.scan_session.clear()
+        self.tree_scan.delete(*self.tree_scan.get_children())
+        self._scan_status("已清除")
+        self.e_scan.focus_set()
+
+    def change_scan_target(self):
+        """ 切換收貨/出庫或倉庫；暫存中還有掃描時不允許切換 """
+        s = self.scan_session
+        if s.lines:
+            self.scan_mode_var.set(s.mode)
+            self.cb_scan_loc.set(s.location)
+            return messagebox.showwarning("提示", "請先提交或清除目前的掃描批次")
+        s.mode, s.location, s.po_context = self.scan_mode_var.get(), self.cb_scan_loc.get(), None
+        self.e_scan.focus_set()
+
+    def commit_scan_session(self):
+        """ 整批寫入後只存檔一次；各列表透過 ChangeBus 合併刷新 """
+        s = self.scan_session
+        if not s.lines: return
+        lines, units = len(s.lines), s.units
+        try:
+            created = s.commit()
+        except ValueError as e:
+            return messagebox.showerror("無法提交", str(e))
+        self.save_data()
+        self.tree_scan.delete(*self.tree_scan.get_children())
+        what = "收貨" if s.mode == 'receive' else "出庫"
+        self.scan_msg_var.set(f"已{what} {lines} 行 / {units} 件 (產生 {len(created)} 筆紀錄)")
+        self.lbl_scan_msg.configure(fg=COLORS["success"])
+        self.e_scan.focus_set()
+
+    @instrumented()
     def refresh_warehouse_list(self):
         """ 刷新待進貨與庫存列表 """
-        # 1. 刷新待進貨清單 (只顯示 Status = Open 的)
+        self.refresh_inbound_list()
+        self.refresh_stock_list()
+
+    @instrumented()
+    def refresh_inbound_list(self):
+        """ 刷新待進貨清單 (只顯示 Status = Open 的) """
         for row in self.tree_in.get_children(): self.tree_in.delete(row)
         idx = 0
         for p in self.data['po_db']:
@@ -585,17 +3206,22 @@ class AdvancedERPSystem:
                 tag = 'even' if idx % 2 == 0 else 'odd'
                 self.tree_in.insert("", "end", values=(p['id'], p['item'], p['qty'], p['received_qty'], remain, status_txt), tags=(tag,))
                 idx += 1
+        INSTRUMENT.count("rows_rendered.inbound_list", idx)
 
-        # 2. 刷新庫存清單 (從 stock_db 讀取)
+    @instrumented()
+    def refresh_stock_list(self):
+        """ 刷新庫存清單 (選定倉庫，或全部倉庫合計) """
         for row in self.tree_stock.get_children(): self.tree_stock.delete(row)
+        loc = self.stock_loc_var.get()
         idx = 0
-        for k, qty in self.data['stock_db'].items():
+        for k, qty in self.stock.items_at(None if loc == "全部倉庫" else loc).items():
             tag = 'even' if idx % 2 == 0 else 'odd'
             price = self.get_latest_price(k)
             total_val = qty * price
             
             self.tree_stock.insert("", "end", values=(k, qty, f"${total_val:,.0f}"), tags=(tag,))
             idx += 1
+        INSTRUMENT.count("rows_rendered.stock_list", idx)
 
     def open_receipt_window(self, event):
         """ 進貨驗收視窗 (點擊待進貨單據後觸發) """
@@ -603,13 +3229,12 @@ class AdvancedERPSystem:
         if not sel: return
         po_id = self.tree_in.item(sel, 'values')[0]
         # 找到原始採購單數據
-        target_idx = next((i for i, p in enumerate(self.data['po_db']) if p['id'] == po_id), None)
-        target_po = self.data['po_db'][target_idx]
+        target_po = self.po_by_id[po_id]
         remain = target_po['qty'] - target_po['received_qty']
 
         win = tk.Toplevel(self.root)
         win.title(f"進貨驗收 - {target_po['item']}")
-        win.geometry("350x400")
+        win.geometry("350x480")
         win.configure(bg="white")
         
         tk.Label(win, text=f"尚欠數量: {remain}", fg=COLORS["danger"], font=("Microsoft JhengHei UI", 14, "bold"), bg="white").pack(pady=20)
@@ -626,6 +3251,11 @@ class AdvancedERPSystem:
         e_amt.insert(0, remain * target_po['price']) 
         e_amt.pack(fill='x', pady=5)
 
+        tk.Label(f, text="入庫倉庫:", font=FONT_BOLD, bg="white").pack(anchor='w', pady=(10,0))
+        cb_loc = ttk.Combobox(f, values=self.data['locations'], state='readonly', font=FONT_MAIN)
+        cb_loc.set(self.data['locations'][0])
+        cb_loc.pack(fill='x', pady=5)
+
         # 自動計算金額 (數量 x 單價)
         def auto_calc(event):
             try:
@@ -649,30 +3279,10 @@ class AdvancedERPSystem:
                 if qty_in > remain:
                     if not messagebox.askyesno("警告", "輸入數量大於訂購殘量，確定超收？"): return
 
-                # 1. 更新採購單狀態
-                target_po['received_qty'] += qty_in
-                if target_po['received_qty'] >= target_po['qty']:
-                    target_po['status'] = 'Closed'
-                
-                # 2. 增加庫存
-                item = target_po['item']
-                self.data['stock_db'][item] = self.data['stock_db'].get(item, 0) + qty_in
-                
-                # 3. 產生應付帳款 (AP)
-                self.data['ap_db'].append({
-                    'id': self.get_id("AP"),
-                    'po_ref': target_po['id'],
-                    'date': datetime.datetime.now().strftime("%Y-%m-%d"),
-                    'vendor': target_po['vendor'],
-                    'desc': f"進貨 {item} x{qty_in}",
-                    'amt': amt_in,
-                    'status': 'Unpaid'
-                })
+                # 更新採購單、增加庫存並產生應付帳款 (AP)
+                self.receive_po(target_po, qty_in, amt_in, cb_loc.get())
                 
                 self.save_data()
-                self.refresh_warehouse_list()
-                self.refresh_po_list()
-                self.refresh_finance_list()
                 win.destroy()
                 messagebox.showinfo("成功", "已入庫並產生應付帳款單！")
             except ValueError:
@@ -684,15 +3294,26 @@ class AdvancedERPSystem:
         """ 銷貨/出庫視窗 """
         win = tk.Toplevel(self.root)
         win.title("銷貨/出庫單")
-        win.geometry("350x450")
+        win.geometry("350x530")
         win.configure(bg="white")
         
         f = tk.Frame(win, bg="white", padx=30, pady=20); f.pack(fill='both')
 
-        tk.Label(f, text="選擇品項:", font=FONT_BOLD, bg="white").pack(anchor='w')
-        items = list(self.data['stock_db'].keys())
-        cb_item = ttk.Combobox(f, values=items, font=FONT_MAIN)
+        tk.Label(f, text="出庫倉庫:", font=FONT_BOLD, bg="white").pack(anchor='w')
+        cb_loc = ttk.Combobox(f, values=self.data['locations'], state='readonly', font=FONT_MAIN)
+        cb_loc.set(self.data['locations'][0])
+        cb_loc.pack(fill='x', pady=5)
+
+        tk.Label(f, text="選擇品項:", font=FONT_BOLD, bg="white").pack(anchor='w', pady=(10,0))
+        cb_item = AutocompleteCombobox(f, self.item_names, font=FONT_MAIN)
         cb_item.pack(fill='x', pady=5)
+
+        def load_items(event=None):
+            # 只列出該倉庫有庫存的品項
+            at = self.stock.items_at(cb_loc.get())
+            cb_item.accept = lambda name: at.get(name, 0) > 0
+        cb_loc.bind("<<ComboboxSelected>>", load_items)
+        load_items()
         
         tk.Label(f, text="出庫數量:", font=FONT_BOLD, bg="white").pack(anchor='w', pady=(10,0))
         e_qty = tk.Entry(f, font=FONT_MAIN, bg="#f1f2f6", relief="flat", validate="key", validatecommand=self.vcmd_int); 
@@ -714,26 +3335,19 @@ class AdvancedERPSystem:
 
         def confirm_sales():
             item = cb_item.get()
+            loc = cb_loc.get()
             try:
                 qty = int(e_qty.get())
                 price = float(e_price.get())
-                current_stock = self.data['stock_db'].get(item, 0)
+                current_stock = self.stock.qty(loc, item)
                 
                 # 檢查庫存是否足夠
                 if qty > current_stock:
-                    return messagebox.showerror("錯誤", f"庫存不足！目前只有 {current_stock}")
+                    return messagebox.showerror("錯誤", f"庫存不足！{loc} 目前只有 {current_stock}")
                 
                 # 扣庫存 & 增加銷售紀錄
-                self.data['stock_db'][item] -= qty
-                self.data['sales_db'].append({
-                    'date': e_date.get(),
-                    'item': item,
-                    'qty': qty,
-                    'price': price,
-                    'total': qty * price
-                })
+                self.record_sale(item, qty, price, e_date.get(), loc)
                 self.save_data()
-                self.refresh_warehouse_list()
                 win.destroy()
                 messagebox.showinfo("成功", f"出庫完成，營收增加 ${qty*price}")
             except ValueError:
@@ -741,6 +3355,60 @@ class AdvancedERPSystem:
 
         self.create_flat_button(win, "確認出庫", confirm_sales, COLORS["danger"], icon="📤").pack(side='bottom', fill='x', padx=30, pady=30)
 
+    def open_transfer_window(self):
+        """ 倉庫間調撥 """
+        if len(self.data['locations']) < 2:
+            return messagebox.showwarning("提示", "至少需要兩個倉庫才能調撥，請先新增倉庫")
+        win = tk.Toplevel(self.root)
+        win.title("庫存調撥")
+        win.geometry("350x430")
+        win.configure(bg="white")
+        f = tk.Frame(win, bg="white", padx=30, pady=20); f.pack(fill='both')
+
+        tk.Label(f, text="調出倉庫:", font=FONT_BOLD, bg="white").pack(anchor='w')
+        cb_src = ttk.Combobox(f, values=self.data['locations'], state='readonly', font=FONT_MAIN)
+        cb_src.set(self.data['locations'][0])
+        cb_src.pack(fill='x', pady=5)
+
+        tk.Label(f, text="品項:", font=FONT_BOLD, bg="white").pack(anchor='w', pady=(10,0))
+        cb_item = AutocompleteCombobox(f, self.item_names, font=FONT_MAIN)
+        cb_item.pack(fill='x', pady=5)
+
+        def load_items(event=None):
+            at = self.stock.items_at(cb_src.get())
+            cb_item.accept = lambda name: at.get(name, 0) > 0
+        cb_src.bind("<<ComboboxSelected>>", load_items)
+        load_items()
+
+        tk.Label(f, text="調入倉庫:", font=FONT_BOLD, bg="white").pack(anchor='w', pady=(10,0))
+        cb_dst = ttk.Combobox(f, values=self.data['locations'], state='readonly', font=FONT_MAIN)
+        cb_dst.set(self.data['locations'][1])
+        cb_dst.pack(fill='x', pady=5)
+
+        tk.Label(f, text="數量:", font=FONT_BOLD, bg="white").pack(anchor='w', pady=(10,0))
+        e_qty = tk.Entry(f, font=FONT_MAIN, bg="#f1f2f6", relief="flat", validate="key", validatecommand=self.vcmd_int)
+        e_qty.pack(fill='x', pady=5)
+
+        def confirm_transfer():
+            try:
+                qty = int(e_qty.get())
+                if qty <= 0: return messagebox.showerror("數值錯誤", "數量必須大於 0！", parent=win)
+                self.transfer_stock(cb_item.get(), qty, cb_src.get(), cb_dst.get())
+            except ValueError as e:
+                return messagebox.showerror("錯誤", str(e) if str(e) and not str(e).startswith("invalid literal") else "數量格式錯誤", parent=win)
+            self.save_data()
+            win.destroy()
+            messagebox.showinfo("成功", "調撥完成")
+
+        self.create_flat_button(win, "確認調撥", confirm_transfer, COLORS["secondary"], icon="🔁").pack(side='bottom', fill='x', padx=30, pady=20)
+
+    def add_location_dialog(self):
+        name = simpledialog.askstring("新增倉庫", "倉庫名稱:", parent=self.root)
+        if not name or not name.strip(): return
+        if not self.add_location(name.strip()):
+            return messagebox.showwarning("提示", "倉庫已存在")
+        self.save_data()
+
     # ================= Tab 3: 財務管理 =================
     def setup_finance_tab(self):
         # 內部分頁：待付款 vs 已付款
@@ -757,7 +3425,12 @@ class AdvancedERPSystem:
         self.tree_unpaid.pack(fill='both', expand=True, padx=5, pady=5)
         self.tree_unpaid.tag_configure('even', background=COLORS["table_row_even"])
         
-        self.create_flat_button(self.frame_unpaid, "付款確認", self.process_payment, COLORS["warning"], icon="💰").pack(pady=10)
+        bottom = tk.Frame(self.frame_unpaid, bg=COLORS["bg_light"])
+        bottom.pack(fill='x', pady=10)
+        self.aging_var = tk.StringVar()
+        tk.Label(bottom, textvariable=self.aging_var, font=FONT_MAIN, bg=COLORS["bg_light"]).pack(side='left', padx=10)
+        self.create_flat_button(bottom, "批次付款", self.open_payment_run, COLORS["primary"], icon="📑").pack(side='right', padx=5)
+        self.create_flat_button(bottom, "付款確認", self.process_payment, COLORS["warning"], icon="💰").pack(side='right', padx=5)
         
         self.tree_paid = ttk.Treeview(self.frame_paid, columns=("單號", "付款日期", "廠商", "摘要", "金額"), show='headings')
         for c in ("單號", "付款日期", "廠商", "摘要", "金額"): 
@@ -767,6 +3440,7 @@ class AdvancedERPSystem:
         
         self.refresh_finance_list()
 
+    @instrumented()
     def refresh_finance_list(self):
         """ 根據付款狀態分類顯示 AP """
         for row in self.tree_unpaid.get_children(): self.tree_unpaid.delete(row)
@@ -782,23 +3456,108 @@ class AdvancedERPSystem:
                 tag = 'even' if idx_p % 2 == 0 else 'odd'
                 self.tree_paid.insert("", "end", values=(a['id'], a.get('pay_date', '-'), a['vendor'], a['desc'], a['amt']), tags=(tag,))
                 idx_p += 1
+        INSTRUMENT.count("rows_rendered.finance_list", idx_u + idx_p)
+
+        # 帳齡彙總 (由索引直接取得)
+        aging = self.ap_index.aging(datetime.date.today())
+        self.aging_var.set("帳齡  " + "   ".join(f"{name}: ${amt:,.0f} ({n}筆)" for name, (amt, n) in aging.items()))
 
     def process_payment(self):
-        """ 執行付款動作 """
+        """ 支付選取的帳款 (可多選) """
         sel = self.tree_unpaid.selection()
         if not sel: return messagebox.showwarning("提示", "請選擇一筆帳款")
-        item_vals = self.tree_unpaid.item(sel, 'values')
-        ap_id = item_vals[0]
-        if messagebox.askyesno("付款確認", f"確定支付 {ap_id} 金額 ${item_vals[4]}？"):
-            for a in self.data['ap_db']:
-                if a['id'] == ap_id:
-                    a['status'] = 'Paid'
-                    a['pay_date'] = datetime.datetime.now().strftime("%Y-%m-%d")
-                    break
+        ap_ids = [self.tree_unpaid.item(i, 'values')[0] for i in sel]
+        total = sum(self.ap_index.lines[i]['amt'] for i in ap_ids if i in self.ap_index.lines)
+        label = ap_ids[0] if len(ap_ids) == 1 else f"{len(ap_ids)} 筆帳款"
+        if messagebox.askyesno("付款確認", f"確定支付 {label} 金額 ${total:,.0f}？"):
+            self.pay_ap(ap_ids)
             self.save_data()
-            self.refresh_finance_list()
             messagebox.showinfo("成功", "付款完成")
 
+    def open_payment_run(self):
+        """ 批次付款：依廠商 / 到期日 / 帳齡篩選，預覽合計後一次付款 """
+        win = tk.Toplevel(self.root)
+        win.title("批次付款")
+        win.geometry("720x600")
+        win.configure(bg="white")
+
+        form = tk.Frame(win, bg="white", padx=20, pady=15)
+        form.pack(fill='x')
+
+        tk.Label(form, text="廠商:", font=FONT_BOLD, bg="white").grid(row=0, column=0, sticky='w')
+        vendors = ["(全部)"] + sorted(self.ap_index.by_vendor)
+        cb_vendor = ttk.Combobox(form, values=vendors, state='readonly', font=FONT_MAIN)
+        cb_vendor.set(vendors[0])
+        cb_vendor.grid(row=0, column=1, sticky='ew', padx=10, pady=5)
+
+        tk.Label(form, text="到期日不晚於:", font=FONT_BOLD, bg="white").grid(row=1, column=0, sticky='w')
+        d_frame = tk.Frame(form, bg="white")
+        d_frame.grid(row=1, column=1, sticky='ew', padx=10, pady=5)
+        e_due = tk.Entry(d_frame, font=FONT_MAIN, bg="#f1f2f6", relief="flat")
+        e_due.pack(side='left', fill='x', expand=True)
+        tk.Button(d_frame, text="📅", command=lambda: SimpleCalendar(win, lambda d: (e_due.delete(0, 'end'), e_due.insert(0, d))),
+                  relief="flat", bg=COLORS["secondary"], fg="white").pack(side='right', padx=2)
+        tk.Label(form, text=f"(空白 = 不限；到期日 = 發票日 + {AP_TERMS_DAYS} 天)", font=FONT_MAIN, bg="white",
+                 fg=COLORS["secondary"]).grid(row=2, column=1, sticky='w', padx=10)
+
+        tk.Label(form, text="帳齡:", font=FONT_BOLD, bg="white").grid(row=3, column=0, sticky='w')
+        b_frame = tk.Frame(form, bg="white")
+        b_frame.grid(row=3, column=1, sticky='w', padx=10, pady=5)
+        bucket_vars = {}
+        for name, _, _ in AGING_BUCKETS:
+            bucket_vars[name] = tk.BooleanVar(value=True)
+            tk.Checkbutton(b_frame, text=name, variable=bucket_vars[name], bg="white", font=FONT_MAIN).pack(side='left')
+        form.columnconfigure(1, weight=1)
+
+        tree = ttk.Treeview(win, columns=("廠商", "筆數", "金額"), show='headings', height=10)
+        for c in ("廠商", "筆數", "金額"):
+            tree.heading(c, text=c); tree.column(c, anchor='center')
+        tree.tag_configure('even', background=COLORS["table_row_even"])
+        tree.pack(fill='both', expand=True, padx=20)
+        total_var = tk.StringVar(value="請先按「預覽」")
+        tk.Label(win, textvariable=total_var, font=FONT_BOLD, bg="white", fg=COLORS["primary"]).pack(pady=5)
+
+        def current_selection():
+            vendor = None if cb_vendor.get() == "(全部)" else cb_vendor.get()
+            due_by = None
+            if e_due.get().strip():
+                due_by = datetime.date.fromisoformat(e_due.get().strip())
+            buckets = [name for name, var in bucket_vars.items() if var.get()]
+            return self.ap_index.select(datetime.date.today(), vendor, due_by, buckets)
+
+        def preview():
+            try:
+                lines = current_selection()
+            except ValueError:
+                messagebox.showerror("格式錯誤", "到期日格式應為 YYYY-MM-DD", parent=win)
+                return None
+            per_vendor = {}
+            for a in lines:
+                t = per_vendor.setdefault(a['vendor'], [0, 0.0])
+                t[0] += 1
+                t[1] += a['amt']
+            for row in tree.get_children(): tree.delete(row)
+            for idx, (vendor, (n, amt)) in enumerate(sorted(per_vendor.items())):
+                tree.insert("", "end", values=(vendor, n, f"${amt:,.0f}"), tags=('even' if idx % 2 == 0 else 'odd',))
+            total_var.set(f"共 {len(lines):,} 筆，合計 ${sum(a['amt'] for a in lines):,.0f}")
+            return lines
+
+        def confirm():
+            lines = preview()
+            if lines is None: return
+            if not lines: return messagebox.showwarning("提示", "沒有符合條件的帳款", parent=win)
+            total = sum(a['amt'] for a in lines)
+            if not messagebox.askyesno("付款確認", f"確定支付 {len(lines):,} 筆帳款，合計 ${total:,.0f}？", parent=win): return
+            n, paid = self.pay_ap([a['id'] for a in lines])
+            self.save_data()
+            win.destroy()
+            messagebox.showinfo("成功", f"已付款 {n:,} 筆，合計 ${paid:,.0f}")
+
+        btns = tk.Frame(win, bg="white")
+        btns.pack(fill='x', padx=20, pady=15)
+        self.create_flat_button(btns, "預覽", preview, COLORS["secondary"], icon="🔍").pack(side='left', expand=True, fill='x', padx=5)
+        self.create_flat_button(btns, "確認付款", confirm, COLORS["warning"], icon="💰").pack(side='left', expand=True, fill='x', padx=5)
+
     # ================= Tab 4: 經營分析 (Matplotlib + 列表) =================
     def setup_dashboard_tab(self):
         control_frame = tk.Frame(self.tab_dashboard, pady=15, bg=COLORS["bg_light"])
@@ -828,29 +3587,35 @@ class AdvancedERPSystem:
         self.page_individual = ttk.Frame(self.dash_notebook)
         self.page_cost_rev = ttk.Frame(self.dash_notebook)
         self.page_list = ttk.Frame(self.dash_notebook) 
+        self.page_vendor = ttk.Frame(self.dash_notebook)
         
         self.dash_notebook.add(self.page_overview, text=' 1. 銷售佔比') 
         self.dash_notebook.add(self.page_trends, text=' 2. 進銷趨勢')
         self.dash_notebook.add(self.page_individual, text=' 3. 單品個別分析')
         self.dash_notebook.add(self.page_cost_rev, text=' 4. 成本與收入')
         self.dash_notebook.add(self.page_list, text=' 5. 庫存狀態列表') 
+        self.dash_notebook.add(self.page_vendor, text=' 6. 廠商績效')
 
         self.init_list_page() 
+        self.init_vendor_page()
 
     def clear_canvas(self, parent_frame):
         """ 清除畫布上的舊圖表 """
         for widget in parent_frame.winfo_children():
             widget.destroy()
 
+    @instrumented("chart.draw")
     def embed_chart(self, parent_frame, figure):
         """ 將 Matplotlib Figure 嵌入 Tkinter Frame """
         canvas = FigureCanvasTkAgg(figure, master=parent_frame)
         canvas.draw()
         canvas.get_tk_widget().pack(fill='both', expand=True)
 
+    @instrumented()
     def refresh_dashboard(self):
         """ 統籌刷新所有圖表 """
         target_month = self.dash_month_var.get()
+        if self.recorder is not None: self.recorder.log('dashboard', month=target_month)
         
         self.clear_canvas(self.page_overview)
         self.plot_overview_pie(self.page_overview, target_month)
@@ -864,72 +3629,21 @@ class AdvancedERPSystem:
         self.plot_financial_bar(self.page_cost_rev, target_month)
         
         self.update_list_page()
+        self.update_vendor_page()
 
     # --- Chart 1: 圓餅圖 (每月銷售佔比) ---
+    @instrumented("chart.overview_pie")
     def plot_overview_pie(self, parent, month):
-        # 統計該月份的銷售數據
-        sales_stats = {}
-        for s in self.data['sales_db']:
-            if s['date'].startswith(month):
-                sales_stats[s['item']] = sales_stats.get(s['item'], 0) + s['qty']
-
-        if not sales_stats:
+        fig = self.figure_overview_pie(month)
+        if fig is None:
             tk.Label(parent, text=f"{month} 無銷售紀錄", font=FONT_TITLE, bg="white").pack(pady=50)
             return
-
-        labels = list(sales_stats.keys())
-        sizes = list(sales_stats.values())
-        
-        fig = Figure(figsize=(7, 5), dpi=100)
-        ax = fig.add_subplot(111)
-
-        wedges, texts, autotexts = ax.pie(
-                sizes,
-                autopct='%1.1f%%',
-                startangle=140,
-                pctdistance=0.75,
-                colors=plt.cm.Set3.colors,
-                textprops=dict(color="black")
-        )
-
-        plt.setp(autotexts, size=10, weight="bold")
-        ax.set_title(f"【{month}】各品項銷售佔比", fontsize=14)
-        ax.legend(wedges, labels, title="品項列表", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
         self.embed_chart(parent, fig)
 
     # --- Chart 2: 折線圖 (進銷趨勢) ---
+    @instrumented("chart.trend_line")
     def plot_trend_line(self, parent):
-        month_keys = []
-        curr = datetime.date.today()
-        # 產生過去 6 個月的標籤
-        for i in range(6):
-            dt = curr - datetime.timedelta(days=30*i)
-            month_keys.append(dt.strftime("%Y-%m"))
-        month_keys.reverse()
-
-        in_data = []
-        out_data = []
-
-        for m in month_keys:
-            # 計算每月進貨量與銷貨量
-            in_qty = sum([p['received_qty'] for p in self.data['po_db'] if p['delivery_date'].startswith(m)])
-            in_data.append(in_qty)
-            out_qty = sum([s['qty'] for s in self.data['sales_db'] if s['date'].startswith(m)])
-            out_data.append(out_qty)
-
-        fig = Figure(figsize=(6, 5), dpi=100)
-        ax = fig.add_subplot(111)
-        
-        ax.plot(month_keys, in_data, marker='o', label='進貨總量', color=COLORS['primary'])
-        ax.plot(month_keys, out_data, marker='s', label='銷貨總量', color=COLORS['success'])
-        
-        ax.set_title("近半年進銷貨趨勢", fontsize=14)
-        ax.set_xlabel("月份")
-        ax.set_ylabel("數量")
-        ax.legend()
-        ax.grid(True, linestyle='--', alpha=0.6)
-
-        self.embed_chart(parent, fig)
+        self.embed_chart(parent, self.figure_trend_line())
 
     # --- Chart 3: 單品分析 (互動式) ---
     def setup_individual_analysis(self, parent):
@@ -939,7 +3653,7 @@ class AdvancedERPSystem:
         tk.Label(ctrl, text="選擇商品:", font=FONT_BOLD, bg="white").pack(side='left', padx=10)
         
         items = list(self.data['stock_db'].keys())
-        cb = ttk.Combobox(ctrl, values=items, font=FONT_MAIN)
+        cb = AutocompleteCombobox(ctrl, self.item_names, font=FONT_MAIN)
         cb.pack(side='left')
         
         chart_frame = tk.Frame(parent, bg="white")
@@ -949,68 +3663,26 @@ class AdvancedERPSystem:
             item = cb.get()
             if not item: return
             self.clear_canvas(chart_frame)
-            sales_history = [s for s in self.data['sales_db'] if s['item'] == item]
-            sales_history.sort(key=lambda x: x['date'])
+            sales_history = [s for s in self.data['sales_db'] if s.item == item]
             
             if not sales_history:
                 tk.Label(chart_frame, text="尚無銷售紀錄", font=FONT_TITLE, bg="white").pack(pady=50)
                 return
 
-            dates = [s['date'] for s in sales_history]
-            qtys = [s['qty'] for s in sales_history]
-
             # 根據商品順序分配固定顏色
-            if item in items: idx = items.index(item)
-            else: idx = 0
-            color_palette = plt.cm.Set3.colors 
-            specific_color = color_palette[idx % len(color_palette)]
-
-            fig = Figure(figsize=(6, 4), dpi=100)
-            ax = fig.add_subplot(111)
-            
-            ax.bar(dates, qtys, color=specific_color, alpha=0.9, edgecolor='grey')
-            ax.set_title(f"【{item}】 銷售紀錄", fontsize=14)
-            ax.set_ylabel("銷售數量")
-            fig.autofmt_xdate()
+            fig = self.figure_item_sales(item, sales_history, items.index(item) if item in items else 0)
             self.embed_chart(chart_frame, fig)
 
-        tk.Button(ctrl, text="分析", command=draw_item_chart, bg=COLORS["secondary"], fg="white", font=FONT_BOLD).pack(side='left', padx=10)
+        tk.Button(ctrl, text="分析", command=INSTRUMENT.wrap_action("button:分析", draw_item_chart), bg=COLORS["secondary"], fg="white", font=FONT_BOLD).pack(side='left', padx=10)
 
     # --- Chart 4: 財務長條圖 ---
+    @instrumented("chart.financial_bar")
     def plot_financial_bar(self, parent, month):
-        total_cost = 0
-        for a in self.data['ap_db']:
-            if a['date'].startswith(month): total_cost += a['amt']
-        
-        total_rev = 0
-        for s in self.data['sales_db']:
-            if s['date'].startswith(month):
-                rev = s.get('total', s.get('qty', 0) * s.get('price', 0))
-                total_rev += rev
-        
-        gross_profit = total_rev - total_cost
-
-        fig = Figure(figsize=(6, 5), dpi=100)
-        ax = fig.add_subplot(111)
-        cats = ['總收入', '總成本', '毛利']
-        vals = [total_rev, total_cost, gross_profit]
-        colors = [COLORS['success'], COLORS['danger'], COLORS['warning']]
-        
-        bars = ax.bar(cats, vals, color=colors)
-        ax.set_title(f"{month} 財務概況", fontsize=14)
-        ax.set_ylabel("金額 ($)")
-        
-        for bar in bars:
-            height = bar.get_height()
-            ax.text(bar.get_x() + bar.get_width()/2., height,
-                    f'${height:,.0f}',
-                    ha='center', va='bottom')
-
-        self.embed_chart(parent, fig)
+        self.embed_chart(parent, self.figure_financial_bar(month))
 
     # --- Page 5: 庫存狀態列表 ---
     def init_list_page(self):
-        cols = ("品項", "目前庫存", "狀態評估", "建議行動")
+        cols = ("品項", "目前庫存", "倉庫分佈", "狀態評估", "建議行動")
         self.tree_list = ttk.Treeview(self.page_list, columns=cols, show='headings')
         for c in cols: 
             self.tree_list.heading(c, text=c)
@@ -1022,6 +3694,7 @@ class AdvancedERPSystem:
         self.tree_list.tag_configure('even', background=COLORS["table_row_even"])
         self.tree_list.pack(fill='both', expand=True, padx=10, pady=10)
 
+    @instrumented()
     def update_list_page(self):
         """ 檢查庫存水位並給出建議 """
         for row in self.tree_list.get_children(): self.tree_list.delete(row)
@@ -1035,11 +3708,1036 @@ class AdvancedERPSystem:
             
             tag_row = 'even' if idx % 2 == 0 else 'odd'
             tags = (tag_row, tag_special) if tag_special else (tag_row,)
-            self.tree_list.insert("", "end", values=(item, qty, status, action), tags=tags)
+            spread = " / ".join(f"{loc}:{q}" for loc, q in self.stock.locations_of(item).items() if q)
+            self.tree_list.insert("", "end", values=(item, qty, spread or "-", status, action), tags=tags)
             idx += 1
+        INSTRUMENT.count("rows_rendered.list_page", idx)
 
-# ================= 主程式進入點 =================
-if __name__ == "__main__":
+    # --- Page 6: 廠商績效 ---
+    def init_vendor_page(self):
+        ctrl = tk.Frame(self.page_vendor, bg=COLORS["bg_light"], pady=5)
+        ctrl.pack(fill='x')
+        tk.Label(ctrl, text="點選廠商可查看各品項單價走勢", font=FONT_MAIN, bg=COLORS["bg_light"]).pack(side='left', padx=10)
+        self.create_flat_button(ctrl, "匯出績效表", self.export_vendor_scorecard, "#27ae60", icon="📊").pack(side='right', padx=10)
+
+        cols = ("廠商", "採購單數", "收貨次數", "準時率", "平均延遲(天)", "交貨達成率", "採購金額", "金額佔比")
+        self.tree_vendor = ttk.Treeview(self.page_vendor, columns=cols, show='headings', height=8)
+        for c in cols:
+            self.tree_vendor.heading(c, text=c)
+            self.tree_vendor.column(c, anchor='center', width=110)
+        self.tree_vendor.tag_configure('even', background=COLORS["table_row_even"])
+        self.tree_vendor.tag_configure('low', foreground=COLORS["danger"])
+        self.tree_vendor.pack(fill='both', expand=True, padx=10, pady=5)
+        self.tree_vendor.bind("<<TreeviewSelect>>", lambda e: self.update_vendor_price_list())
+
+        cols = ("品項", "收貨次數", "最初單價", "最近單價", "變動", "平均單價", "最低", "最高")
+        self.tree_vendor_price = ttk.Treeview(self.page_vendor, columns=cols, show='headings', height=6)
+        for c in cols:
+            self.tree_vendor_price.heading(c, text=c)
+            self.tree_vendor_price.column(c, anchor='center', width=100)
+        self.tree_vendor_price.tag_configure('even', background=COLORS["table_row_even"])
+        self.tree_vendor_price.pack(fill='both', expand=True, padx=10, pady=5)
+
+    @staticmethod
+    def _fmt_pct(x):
+        return "-" if x is None else f"{x:.0%}"
+
+    @instrumented()
+    def update_vendor_page(self):
+        """ 廠商績效列表 (直接讀取累計值，不重算歷史) """
+        for row in self.tree_vendor.get_children(): self.tree_vendor.delete(row)
+        for idx, r in enumerate(self.vendor_stats.rows()):
+            tags = ('even' if idx % 2 == 0 else 'odd',)
+            if r['on_time_rate'] is not None and r['on_time_rate'] < 0.8: tags += ('low',)
+            avg_late = "-" if r['avg_late_days'] is None else f"{r['avg_late_days']:.1f}"
+            self.tree_vendor.insert("", "end", iid=r['vendor'], values=(
+                r['vendor'], r['po_count'], r['receipts'], self._fmt_pct(r['on_time_rate']), avg_late,
+                self._fmt_pct(r['fill_rate']), f"${r['spend']:,.0f}", f"{r['spend_share']:.1%}"), tags=tags)
+        self.update_vendor_price_list()
+
+    def update_vendor_price_list(self):
+        for row in self.tree_vendor_price.get_children(): self.tree_vendor_price.delete(row)
+        sel = self.tree_vendor.selection()
+        if not sel: return
+        for idx, r in enumerate(self.vendor_stats.price_rows(sel[0])):
+            tag = 'even' if idx % 2 == 0 else 'odd'
+            self.tree_vendor_price.insert("", "end", values=(
+                r['item'], r['n'], f"{r['first']:,.2f}", f"{r['last']:,.2f}", f"{r['change']:+.1%}",
+                f"{r['avg']:,.2f}", f"{r['min']:,.2f}", f"{r['max']:,.2f}"), tags=(tag,))
+
+    def export_vendor_scorecard(self):
+        """ 匯出廠商績效與單價走勢 (CSV) """
+        rows = self.vendor_stats.rows()
+        if not rows:
+            messagebox.showwarning("無資料", "目前沒有廠商績效資料可以匯出！")
+            return
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("Excel CSV 檔案", "*.csv"), ("所有檔案", "*.*")],
+            title="匯出廠商績效"
+        )
+        if not filename: return
+        try:
+            with open(filename, 'w', newline='', encoding='utf-8-sig') as f:
+                writer = csv.writer(f)
+                writer.writerow(["廠商", "採購單數", "收貨次數", "準時率", "平均延遲(天)", "交貨達成率", "採購金額", "金額佔比"])
+                for r in rows:
+                    writer.writerow([r['vendor'], r['po_count'], r['receipts'],
+                                     "" if r['on_time_rate'] is None else round(r['on_time_rate'], 4),
+                                     "" if r['avg_late_days'] is None else round(r['avg_late_days'], 2),
+                                     "" if r['fill_rate'] is None else round(r['fill_rate'], 4),
+                                     round(r['spend'], 2), round(r['spend_share'], 4)])
+                writer.writerow([])
+                writer.writerow(["廠商", "品項", "收貨次數", "最初單價", "最近單價", "變動", "平均單價", "最低", "最高"])
+                for r in rows:
+                    for pr in self.vendor_stats.price_rows(r['vendor']):
+                        writer.writerow([r['vendor'], pr['item'], pr['n'], round(pr['first'], 2), round(pr['last'], 2),
+                                         round(pr['change'], 4), round(pr['avg'], 2), round(pr['min'], 2), round(pr['max'], 2)])
+            messagebox.showinfo("匯出成功", f"檔案已成功儲存至：\n{filename}")
+        except Exception as e:
+            messagebox.showerror("匯出失敗", f"發生錯誤：{str(e)}")
+
+    # ================= 隱藏分頁：效能診斷 =================
+    def toggle_diagnostics_tab(self, event=None):
+        if self.notebook.tab(self.tab_diag, 'state') == 'hidden':
+            self.notebook.add(self.tab_diag)  # 重新加入已隱藏的分頁即會顯示
+            self.notebook.select(self.tab_diag)
+        else:
+            self.notebook.hide(self.tab_diag)
+
+    def setup_diagnostics_tab(self):
+        ctrl = tk.Frame(self.tab_diag, bg=COLORS["bg_light"], pady=10)
+        ctrl.pack(fill='x')
+
+        self.diag_enabled_var = tk.BooleanVar(value=INSTRUMENT.enabled)
+        def toggle_enabled():
+            INSTRUMENT.enabled = self.diag_enabled_var.get()
+        tk.Checkbutton(ctrl, text="啟用量測", variable=self.diag_enabled_var, command=toggle_enabled,
+                       font=FONT_BOLD, bg=COLORS["bg_light"]).pack(side='left', padx=10)
+
+        self.create_flat_button(ctrl, "重新整理", self.refresh_diagnostics, COLORS["secondary"], icon="🔄").pack(side='left', padx=5)
+        self.create_flat_button(ctrl, "清除", lambda: (INSTRUMENT.reset(), self.refresh_diagnostics()), COLORS["bg_light"], fg_color=COLORS["text"]).pack(side='left', padx=5)
+        self.create_flat_button(ctrl, "匯出", self.export_diagnostics, "#27ae60", icon="💾").pack(side='left', padx=5)
+
+        tk.Label(ctrl, text="cProfile 動作數:", font=FONT_MAIN, bg=COLORS["bg_light"]).pack(side='left', padx=(20, 5))
+        self.diag_profile_n = tk.Spinbox(ctrl, from_=1, to=100, width=4, font=FONT_MAIN)
+        self.diag_profile_n.pack(side='left')
+        def arm_profile():
+            INSTRUMENT.start_profile(int(self.diag_profile_n.get()))
+            messagebox.showinfo("cProfile", f"將擷取接下來 {self.diag_profile_n.get()} 個動作")
+        self.create_flat_button(ctrl, "開始擷取", arm_profile, COLORS["warning"], icon="⏺").pack(side='left', padx=5)
+
+        paned = ttk.PanedWindow(self.tab_diag, orient=tk.VERTICAL)
+        paned.pack(fill='both', expand=True, padx=10, pady=5)
+
+        cols = ("名稱", "次數", "總計(ms)", "平均(ms)", "p50", "p95", "最大(ms)")
+        self.tree_diag = ttk.Treeview(paned, columns=cols, show='headings', height=10)
+        for c in cols:
+            self.tree_diag.heading(c, text=c)
+            self.tree_diag.column(c, anchor='center', width=260 if c == "名稱" else 90)
+        paned.add(self.tree_diag, weight=3)
+
+        self.tree_diag_counter = ttk.Treeview(paned, columns=("計數器", "數值"), show='headings', height=5)
+        for c in ("計數器", "數值"):
+            self.tree_diag_counter.heading(c, text=c)
+            self.tree_diag_counter.column(c, anchor='center')
+        paned.add(self.tree_diag_counter, weight=1)
+
+        self.txt_profile = tk.Text(paned, height=10, font=("Consolas", 10))
+        paned.add(self.txt_profile, weight=2)
+
+    def refresh_diagnostics(self):
+        summary = INSTRUMENT.summary()
+        for row in self.tree_diag.get_children(): self.tree_diag.delete(row)
+        for idx, r in enumerate(summary['spans']):
+            tag = 'even' if idx % 2 == 0 else 'odd'
+            self.tree_diag.insert("", "end", values=(r['name'], r['count'], f"{r['total_ms']:,.1f}", f"{r['avg_ms']:,.2f}",
+                                                     f"≤{r['p50_ms']:,.0f}", f"≤{r['p95_ms']:,.0f}", f"{r['max_ms']:,.1f}"), tags=(tag,))
+        for row in self.tree_diag_counter.get_children(): self.tree_diag_counter.delete(row)
+        for k, v in summary['counters'].items():
+            self.tree_diag_counter.insert("", "end", values=(k, f"{v:,}"))
+
+        self.txt_profile.delete("1.0", "end")
+        if INSTRUMENT.profile_remaining:
+            self.txt_profile.insert("end", f"cProfile 擷取中，還剩 {INSTRUMENT.profile_remaining} 個動作...\n")
+        elif INSTRUMENT.last_profile:
+            self.txt_profile.insert("end", f"檔案: {INSTRUMENT.last_profile_file}\n\n{INSTRUMENT.last_profile}")
+
+    def export_diagnostics(self):
+        filename = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON", "*.json")], title="匯出效能量測")
+        if not filename: return
+        INSTRUMENT.dump(filename)
+        messagebox.showinfo("匯出成功", f"檔案已成功儲存至：\n{filename}")
+
+# ================= 效能測試：合成資料產生器 =================
+SYNTH_VENDOR_HEADS = ['光華', '原價', '大同', '宏碁', '華碩', '聯強', '順發', '燦坤', '全國', '建漢', '新竹', '台中']
+SYNTH_VENDOR_TAILS = ['科技', '電腦', '屋', '商行', '經銷商', '實業', '電子', '資訊']
+SYNTH_ITEM_NAMES = ['無線滑鼠', '機械式鍵盤', '固態硬碟', '記憶體', '顯示卡', '螢幕', '主機板', '電源供應器',
+                    '散熱風扇', '網路卡', 'Office軟體', '印表機', '碳粉匣', '網路線', '行動電源']
+
+
+def generate_synthetic_data(n_po, n_sales=None, n_items=None, n_vendors=None, seed=0, days=730):
+    """
+    產生結構與 erp_v20_data.json 相同、彼此帳目一致的合成資料 (中文廠商/品項名稱)：
+    進貨會同時反映在 received_qty、AP 與庫存，銷貨不會超過當時庫存。
+    """
+    rng = random.Random(seed)
+    n_sales = n_po if n_sales is None else n_sales
+    n_items = n_items or max(10, min(20000, n_po // 50))
+    n_vendors = n_vendors or max(5, min(500, n_po // 500))
+
+    vendors = list(dict.fromkeys(f"{rng.choice(SYNTH_VENDOR_HEADS)}{rng.choice(SYNTH_VENDOR_TAILS)}{'' if i < 40 else i}"
+                                 for i in range(n_vendors * 2)))[:n_vendors]
+    items = [f"{SYNTH_ITEM_NAMES[i % len(SYNTH_ITEM_NAMES)]}-{i:05d}" for i in range(n_items)]
+    base_price = {it: rng.choice([30, 99, 150, 300, 450, 1690, 2999, 6580]) for it in items}
+    sources = ['直接輸入', '採購計畫', '訂貨單', '詢價單']
+    start = datetime.date.today() - datetime.timedelta(days=days)
+
+    locations = [DEFAULT_LOCATION, '新竹倉', '台中倉']
+    po_db, ap_db, stock = [], [], {loc: {} for loc in locations}
+    for i in range(n_po):
+        item = rng.choice(items)
+        qty = rng.randint(1, 50) * 10
+        price = round(base_price[item] * rng.uniform(0.8, 1.2), 1)
+        delivery = start + datetime.timedelta(days=rng.randint(0, days + 60))
+        received = 0
+        if delivery <= datetime.date.today():
+            received = qty if rng.random() < 0.8 else rng.randint(0, qty)
+        po = {
+            'id': f"PO-{i:08d}", 'source': rng.choice(sources), 'vendor': rng.choice(vendors), 'item': item,
+            'qty': qty, 'price': price, 'delivery_date': delivery.strftime('%Y-%m-%d'), 'received_qty': received,
+            'status': 'Closed' if received >= qty else 'Open', 'email_status': rng.choice(['未傳送', '已傳送 (廠商未讀)', '✅ 廠商已讀']),
+            'mfg_date': ''
+        }
+        po_db.append(po)
+        if received:
+            loc = rng.choice(locations)
+            stock[loc][item] = stock[loc].get(item, 0) + received
+            receipt = min(delivery + datetime.timedelta(days=rng.randint(-5, 10)), datetime.date.today())
+            ap = {'id': f"AP-{i:08d}", 'po_ref': po['id'], 'date': receipt.strftime('%Y-%m-%d'), 'vendor': po['vendor'],
+                  'desc': f"進貨 {item} x{received}", 'item': item, 'qty': received, 'location': loc,
+                  'amt': round(received * price, 2), 'status': 'Unpaid'}
+            if rng.random() < 0.7:
+                ap['status'] = 'Paid'
+                ap['pay_date'] = (receipt + datetime.timedelta(days=rng.randint(0, 60))).strftime('%Y-%m-%d')
+            ap_db.append(ap)
+
+    sales_db = []
+    stocked = [(loc, it) for loc in locations for it in stock[loc] if stock[loc][it]]
+    for _ in range(n_sales if stocked else 0):
+        loc, item = rng.choice(stocked)
+        qty = min(stock[loc][item], rng.randint(1, 20))
+        if qty <= 0: continue
+        stock[loc][item] -= qty
+        price = round(base_price[item] * rng.uniform(1.1, 1.6), 1)
+        day = start + datetime.timedelta(days=rng.randint(0, days))
+        sales_db.append({'date': day.strftime('%Y-%m-%d'), 'item': item, 'qty': qty, 'price': price, 'total': qty * price,
+                         'location': loc})
+
+    totals = {}
+    for loc_items in stock.values():
+        for it, q in loc_items.items(): totals[it] = totals.get(it, 0) + q
+    return {
+        "po_db": po_db, "stock_db": totals, "sales_db": sales_db, "ap_db": ap_db,
+        "stock_loc_db": stock, "locations": locations, "transfer_db": [], "opening_stock": {}, "vendor_contacts": {},
+        "memory_items": items, "memory_vendors": vendors, "source_types": sources, "cost_db": {},
+        "schema_version": SCHEMA_VERSION
+    }
+
+# ================= 效能測試：各項操作計時 =================
+def _time_op(fn, repeat):
+    """ 執行 repeat 次，回傳每次耗時 (秒) """
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t0)
+    return runs
+
+
+def run_benchmarks(sizes, repeat=3, use_tk=True, seed=0, log=print):
+    """
+    針對每個資料量產生合成資料並計時核心操作，回傳可直接存成 JSON 的結果。
+    Tk 相關項目 (refresh_*) 需要顯示環境，可在 Linux 上以 xvfb-run 執行；沒有顯示時會略過。
+    """
+    root = None
+    if use_tk:
+        try:
+            root = tk.Tk()
+            root.withdraw()
+        except tk.TclError as e:
+            log(f"略過 Tk 項目 (無顯示環境): {e}")
+            root = None
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            t0 = time.perf_counter()
+            data = generate_synthetic_data(n, seed=seed)
+            log(f"[{n:,}] 產生資料 {time.perf_counter() - t0:.2f}s "
+                f"(PO {len(data['po_db']):,} / 銷貨 {len(data['sales_db']):,} / AP {len(data['ap_db']):,})")
+            json_file = os.path.join(tmp, f"bench_{n}.json")
+            snap_file = os.path.join(tmp, f"bench_{n}.erpb")
+            cores = {fmt: ERPCore(json_file, snap_file, fmt, autoload=False) for fmt in ("json", "binary")}
+            records_from_data(data)
+            for core in cores.values():
+                core.data = data
+                core.rebuild_indexes()
+            tables = dict(data)  # 原始的各資料表，load_data 之後用來還原
+
+            rng = random.Random(seed)
+            sample_items = [rng.choice(data['memory_items']) for _ in range(20)]
+            ops = [
+                ("save_data[json]", cores["json"].save_data),
+                ("load_data[json]", cores["json"].load_data),
+                ("save_data[binary]", cores["binary"].save_data),
+                ("load_data[binary]", cores["binary"].load_data),
+                ("get_latest_price x20", lambda: [cores["json"].get_latest_price(it) for it in sample_items]),
+                ("plot_trend_line", lambda: FigureCanvasAgg(cores["json"].figure_trend_line()).draw()),
+            ]
+            if root is not None:
+                app = AdvancedERPSystem(tk.Toplevel(root), data_file=json_file, snapshot_file=snap_file)
+                app.data = data
+                app.rebuild_indexes()
+                ops += [
+                    ("refresh_po_list", app.refresh_po_list),
+                    ("refresh_warehouse_list", app.refresh_warehouse_list),
+                    ("refresh_finance_list", app.refresh_finance_list),
+                ]
+
+            for name, fn in ops:
+                runs = _time_op(fn, repeat)
+                # load_data 以 data.update() 就地換掉資料表，且只重建自己的索引：還原資料表並重建所有索引，
+                # 之後的項目才會用同一份資料、索引也與資料一致
+                if any(data[k] is not v for k, v in tables.items()):
+                    data.update(tables)
+                    for core in list(cores.values()) + ([app] if root is not None else []): core.rebuild_indexes()
+                results.append({"size": n, "op": name, "best": min(runs), "median": statistics.median(runs), "runs": runs})
+                log(f"[{n:,}] {name:<24} best {min(runs) * 1000:10.1f} ms   median {statistics.median(runs) * 1000:10.1f} ms")
+            if root is not None: app.root.destroy()
+
+    if root is not None: root.destroy()
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec='seconds'),
+            "python": sys.version.split()[0], "platform": sys.platform,
+            "repeat": repeat, "seed": seed, "sizes": list(sizes)
+        },
+        "results": results
+    }
+
+
+def compare_benchmarks(baseline, current, threshold=0.2, log=print):
+    """ 比較兩次結果的 best 時間，回傳變慢超過 threshold (比例) 的項目 """
+    base = {(r["size"], r["op"]): r["best"] for r in baseline["results"]}
+    regressions = []
+    for r in current["results"]:
+        old = base.get((r["size"], r["op"]))
+        if not old: continue
+        ratio = r["best"] / old
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- 變慢"
+            regressions.append({"size": r["size"], "op": r["op"], "baseline": old, "current": r["best"], "ratio": ratio})
+        log(f"[{r['size']:,}] {r['op']:<24} {old * 1000:10.1f} -> {r['best'] * 1000:10.1f} ms  x{ratio:.2f}{flag}")
+    return regressions
+
+def compare_record_layouts(n, seed=0, repeat=3, log=print):
+    """
+    比較「每列一個 dict」與 Record (__slots__) 的記憶體與熱點迴圈速度。
+    兩種寫法共用同一批欄位值，所以量到的是每列容器本身的大小。
+    """
+    data = generate_synthetic_data(n, n_sales=n, seed=seed)
+    tables = {t: data[t] for t in RECORD_TABLES}
+    log(f"資料: " + " / ".join(f"{t} {len(rows):,} 筆" for t, rows in tables.items()))
+
+    result = {'n': n, 'memory': {}, 'timing': {}}
+    built = {}
+    for table, cls in RECORD_TABLES.items():
+        rows = tables[table]
+        sizes = {}
+        for layout, make in (("dict", dict), ("record", cls.from_dict)):
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            out = [make(r) for r in rows]
+            elapsed = time.perf_counter() - t0
+            sizes[layout] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            built[(table, layout)] = out
+            result['timing'][f"{table} 建立 [{layout}]"] = elapsed
+        result['memory'][table] = sizes
+        log(f"{table:<9} dict {sizes['dict'] / len(rows):7.1f} B/列   record {sizes['record'] / len(rows):7.1f} B/列   "
+            f"節省 {1 - sizes['record'] / sizes['dict']:.0%}")
+
+    def best(fn):
+        return min(_time_op(fn, repeat))
+
+    po_d, po_r = built[('po_db', 'dict')], built[('po_db', 'record')]
+    sa_d, sa_r = built[('sales_db', 'dict')], built[('sales_db', 'record')]
+    ap_d, ap_r = built[('ap_db', 'dict')], built[('ap_db', 'record')]
+    month = max(s['date'] for s in sa_d)[:7]
+
+    def month_dict(rows):
+        stats = {}
+        for s in rows:
+            if s['date'].startswith(month): stats[s['item']] = stats.get(s['item'], 0) + s['qty']
+        return stats
+
+    def month_record(rows):
+        stats = {}
+        for s in rows:
+            if s.date.startswith(month): stats[s.item] = stats.get(s.item, 0) + s.qty
+        return stats
+
+    loops = [
+        ("未交數量合計 (po_db)",
+         lambda: sum(p['qty'] - p['received_qty'] for p in po_d if p['status'] == 'Open'),
+         lambda: sum(p.qty - p.received_qty for p in po_r if p.status == 'Open')),
+        ("當月各品項銷量 (sales_db)", lambda: month_dict(sa_d), lambda: month_record(sa_r)),
+        ("未付款金額合計 (ap_db)",
+         lambda: sum(a['amt'] for a in ap_d if a['status'] == 'Unpaid'),
+         lambda: sum(a.amt for a in ap_r if a.status == 'Unpaid')),
+        ("轉回 JSON 結構 (po_db)",
+         lambda: [dict(p) for p in po_d],
+         lambda: [p.to_dict() for p in po_r]),
+    ]
+    for name, with_dict, with_record in loops:
+        td, tr = best(with_dict), best(with_record)
+        result['timing'][f"{name} [dict]"] = td
+        result['timing'][f"{name} [record]"] = tr
+        log(f"{name:<22} dict {td * 1000:9.1f} ms   record {tr * 1000:9.1f} ms   x{td / tr:.2f}")
+    return result
+
+# ================= 負載測試：重播 / 合成操作流 =================
+# 設定環境變數 ERP_RECORD_OPS=檔名 後啟動視窗版，會把每個異動與圖表刷新附加到該 JSON Lines 檔；
+# 以開始記錄時的資料檔副本為起點 (loadtest --data) 即可原樣重播。
+RECORD_OPS_FILE = os.environ.get("ERP_RECORD_OPS", "")
+LOADTEST_MIX = {'po_create': 10, 'po_edit': 5, 'receive': 20, 'sale': 40, 'transfer': 5, 'pay': 10, 'dashboard': 10}
+
+
+class WorkloadRecorder:
+    """
+    操作逐行附加到 JSON Lines 檔：{"t": 開始後秒數, "op": 名稱, "args": {...}}。
+    重播時收貨會產生新的 AP 單號，所以付款記錄的是「第幾筆收貨」(receipts)；記錄開始前就有的帳款才記 ap_ids。
+    """
+    def __init__(self, path):
+        self.t0 = time.perf_counter()
+        self.f = open(path, "a", encoding="utf-8")
+        self.receipt_no = {}   # 記錄期間產生的 AP 單號 -> 第幾筆收貨 (從 0 起算)
+
+    def log_receive(self, ap, **args):
+        self.receipt_no[ap.id] = len(self.receipt_no)
+        self.log('receive', **args)
+
+    def log_pay(self, ap_ids):
+        self.log('pay', ap_ids=[i for i in ap_ids if i not in self.receipt_no],
+                 receipts=[self.receipt_no[i] for i in ap_ids if i in self.receipt_no])
+
+    def log(self, op, **args):
+        rec = {'t': round(time.perf_counter() - self.t0, 3), 'op': op, 'args': args}
+        self.f.write(json.dumps(rec, ensure_ascii=False, default=_json_default) + "\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def read_workload(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_workload(ops, path):
+    with open(path, "w", encoding="utf-8") as f:
+        for op in ops: f.write(json.dumps(op, ensure_ascii=False, default=_json_default) + "\n")
+
+
+def synthetic_workload(data, n_ops, mix=None, seed=0):
+    """
+    依 mix 的比例產生 n_ops 個操作。產生時以簡化的帳面 (未交量、各倉庫存) 模擬，
+    依序執行時每個操作都成立；多個工作執行緒交錯時，少數操作可能因順序改變而被拒絕 (會分開統計)。
+    """
+    rng = random.Random(seed)
+    names, weights = zip(*[(k, w) for k, w in (mix or LOADTEST_MIX).items() if w > 0])
+    today = datetime.date.today()
+    months, first = [], today.replace(day=1)
+    for _ in range(12):
+        months.append(first.strftime("%Y-%m"))
+        first = (first - datetime.timedelta(days=1)).replace(day=1)
+    vendors = list(data['memory_vendors']) or ['合成廠商']
+    items = list(data['memory_items']) or list(data['stock_db']) or ['合成品項']
+    locations = list(data['locations'])
+    price = {}
+    open_pos = {}   # 採購單號 -> 目前內容 (dict)
+    for p in data['po_db']:
+        price[p['item']] = p['price']
+        if p['status'] == 'Open' and p['received_qty'] < p['qty']: open_pos[p['id']] = dict(p)
+    open_ids = list(open_pos)
+    stock = {(loc, it): q for loc, its in data['stock_loc_db'].items() for it, q in its.items() if q > 0}
+    stocked = list(stock)
+
+    def pick(pool, alive):
+        """ 隨機挑一個仍有效的 (已失效的順便移除)；找不到回傳 None """
+        while pool:
+            i = rng.randrange(len(pool))
+            if alive(pool[i]): return pool[i]
+            pool[i] = pool[-1]
+            pool.pop()
+        return None
+
+    ops = []
+    for i in range(n_ops):
+        op = rng.choices(names, weights)[0]
+        if op in ('po_edit', 'receive'):
+            po_id = pick(open_ids, lambda k: k in open_pos)
+            if po_id is None: op = 'po_create'
+        if op in ('sale', 'transfer'):
+            key = pick(stocked, lambda k: stock[k] > 0)
+            if key is None or (op == 'transfer' and len(locations) < 2): op = 'dashboard'
+
+        if op == 'po_create':
+            item = rng.choice(items)
+            po = {'id': f"LT-{seed}-{i:07d}", 'source': '直接輸入', 'vendor': rng.choice(vendors), 'item': item,
+                  'mfg_date': '', 'qty': rng.randint(1, 50) * 10,
+                  'price': round(price.get(item) or rng.choice([30, 99, 150, 300, 1690]) * rng.uniform(0.9, 1.1), 1),
+                  'delivery_date': (today + datetime.timedelta(days=rng.randint(3, 60))).isoformat(),
+                  'received_qty': 0, 'status': 'Open', 'email_status': '未傳送'}
+            price[item] = po['price']
+            open_pos[po['id']] = po
+            open_ids.append(po['id'])
+            args = {'po': dict(po)}  # open_pos 之後還會被修改，操作內容要另存一份
+        elif op == 'po_edit':
+            po = dict(open_pos[po_id])
+            po['qty'] = max(po['received_qty'] + 10, po['qty'] + rng.choice([-10, 10, 20]))
+            po['delivery_date'] = (today + datetime.timedelta(days=rng.randint(3, 60))).isoformat()
+            open_pos[po_id] = po
+            args = {'id': po_id, 'po': dict(po)}
+        elif op == 'receive':
+            po = open_pos[po_id]
+            qty = rng.randint(1, po['qty'] - po['received_qty'])
+            loc = rng.choice(locations)
+            po['received_qty'] += qty
+            if po['received_qty'] >= po['qty']: del open_pos[po_id]
+            if (loc, po['item']) not in stock: stocked.append((loc, po['item']))
+            stock[(loc, po['item'])] = stock.get((loc, po['item']), 0) + qty
+            args = {'po_id': po_id, 'qty': qty, 'amt': round(qty * po['price'], 2), 'location': loc}
+        elif op == 'sale':
+            qty = rng.randint(1, min(stock[key], 20))
+            stock[key] -= qty
+            args = {'item': key[1], 'qty': qty, 'price': round(price.get(key[1], 100) * rng.uniform(1.1, 1.6), 1),
+                    'date': today.isoformat(), 'location': key[0]}
+        elif op == 'transfer':
+            dst = rng.choice([l for l in locations if l != key[0]])
+            qty = rng.randint(1, min(stock[key], 10))
+            stock[key] -= qty
+            if (dst, key[1]) not in stock: stocked.append((dst, key[1]))
+            stock[(dst, key[1])] = stock.get((dst, key[1]), 0) + qty
+            args = {'item': key[1], 'qty': qty, 'src': key[0], 'dst': dst}
+        elif op == 'pay':
+            args = {'vendor': rng.choice(vendors)}
+        else:
+            args = {'month': months[0] if rng.random() < 0.7 else rng.choice(months)}
+        ops.append({'op': op, 'args': args})
+    return ops
+
+
+def _apply_workload_op(core, op, ctx):
+    """
+    依操作名稱呼叫 ERPCore (與視窗版的處理相同)，回傳 (是否修改資料, 待繪製的圖表)。
+    操作在目前的資料上不成立時丟出 ValueError。ctx['po_pos'] 為 採購單號 -> po_db 位置 (視窗版由表格列號取得)，
+    ctx['receipts'] 為 收貨序號 (op['seq']) -> 重播時產生的 AP 單號。
+    """
+    op, args, op_seq, po_pos = op['op'], op.get('args', {}), op.get('seq'), ctx['po_pos']
+    if op == 'po_create':
+        po = PO.coerce(dict(args['po']))
+        if po.id in core.po_by_id: raise ValueError(f"單號重複: {po.id}")
+        core.remember('memory_vendors', po.vendor)
+        core.remember('memory_items', po.item)
+        core.add_po(po)
+        po_pos[po.id] = len(core.data['po_db']) - 1
+    elif op == 'po_edit':
+        old = core.po_by_id.get(args['id'])
+        if old is None: raise ValueError(f"找不到採購單: {args['id']}")
+        po = dict(args['po'], received_qty=old.received_qty, email_status=old.email_status, status='Open')
+        if po['qty'] < old.received_qty: raise ValueError("數量小於已收量")
+        idx = po_pos.pop(old.id)
+        core.replace_po(idx, po)
+        po_pos[po['id']] = idx
+    elif op == 'po_delete':
+        if args['id'] not in core.po_by_id: raise ValueError(f"找不到採購單: {args['id']}")
+        core.remove_po(po_pos[args['id']])
+        po_pos.clear()
+        po_pos.update((p.id, i) for i, p in enumerate(core.data['po_db']))
+    elif op == 'receive':
+        po = core.po_by_id.get(args['po_id'])
+        if po is None or po.status != 'Open': raise ValueError(f"採購單不存在或已結案: {args['po_id']}")
+        if args['qty'] > po.qty - po.received_qty: raise ValueError("超過未交數量")
+        ctx['receipts'][op_seq] = core.receive_po(po, args['qty'], args['amt'], args['location']).id
+    elif op == 'sale':
+        if args['qty'] > core.stock.qty(args['location'], args['item']): raise ValueError("庫存不足")
+        core.record_sale(args['item'], args['qty'], args['price'], args['date'], args['location'])
+    elif op == 'transfer':
+        core.transfer_stock(args['item'], args['qty'], args['src'], args['dst'])
+    elif op == 'pay':
+        if 'vendor' in args:
+            today = datetime.date.today()
+            return core.pay_ap([a.id for a in core.ap_index.select(today, args['vendor'], due_by=today)])[0] > 0, []
+        missing = [k for k in args.get('receipts', ()) if k not in ctx['receipts']]
+        if missing: raise ValueError(f"對應的收貨尚未執行: {missing}")
+        ids = list(args.get('ap_ids', ())) + [ctx['receipts'][k] for k in args.get('receipts', ())]
+        if not core.pay_ap(ids)[0]: raise ValueError("指定的帳款都不存在或已付款")
+    elif op == 'dashboard':
+        # 與 refresh_dashboard 相同的四張主要圖表；圖表資料在鎖內取得，繪製在鎖外
+        month = args['month']
+        figs = [core.figure_overview_pie(month), core.figure_trend_line(), core.figure_financial_bar(month)]
+        return False, [f for f in figs if f is not None]
+    else:
+        raise ValueError(f"未知的操作: {op}")
+    return True, []
+
+
+def _percentile(sorted_vals, q):
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+
+def run_workload(core, ops, workers=1, save_every=1, think_ms=0.0, backup=None, backup_every=0, seed=0, log=print):
+    """
+    以 workers 個工作執行緒 (模擬多個工作站) 從同一個佇列取操作執行。ERPCore 不是執行緒安全的，
+    所有操作以一把鎖序列化 (等同視窗版單一事件迴圈)，因此延遲 = 等鎖 + 持鎖 (+ 鎖外繪圖)。
+    save_every：每幾個異動操作存檔一次 (1 = 視窗版的行為；0 = 只在最後存一次)。
+    回傳可直接存成 JSON 的結果：吞吐量、各操作 p50/p99、存檔次數與資料檔成長。
+    """
+    path = core.snapshot_file if core.storage_format == "binary" else core.data_file
+    core.save_data()
+    start_size = os.path.getsize(path)
+    lock = threading.Lock()
+    jobs = queue.SimpleQueue()
+    n_receipts = 0
+    for op in ops:
+        if op['op'] == 'receive':
+            # 收貨依操作流中的先後編號 (與 WorkloadRecorder 相同)，付款以此找到重播時產生的 AP
+            op = dict(op, seq=n_receipts)
+            n_receipts += 1
+        jobs.put(op)
+    ctx = {'po_pos': {p.id: i for i, p in enumerate(core.data['po_db'])}, 'receipts': {}}
+    shared = {'dirty': 0, 'mutations': 0, 'saves': [], 'bytes_written': 0}
+
+    def save():
+        t = time.perf_counter()
+        core.save_data()
+        shared['saves'].append(time.perf_counter() - t)
+        shared['bytes_written'] += os.path.getsize(path)
+        shared['dirty'] = 0
+
+    def worker(wid, out):
+        rng = random.Random(seed * 1000 + wid)
+        while True:
+            try: op = jobs.get_nowait()
+            except queue.Empty: return
+            if think_ms: time.sleep(rng.expovariate(1000.0 / think_ms))
+            name = op['op']
+            t0 = time.perf_counter()
+            with lock:
+                t1 = time.perf_counter()
+                try:
+                    mutated, figs = _apply_workload_op(core, op, ctx)
+                except ValueError:
+                    out['rejected'][name] += 1
+                    continue
+                if mutated:
+                    shared['dirty'] += 1
+                    shared['mutations'] += 1
+                    if save_every and shared['dirty'] >= save_every: save()
+                    if backup is not None and backup_every and shared['mutations'] % backup_every == 0: backup.backup()
+                t2 = time.perf_counter()
+            for fig in figs: FigureCanvasAgg(fig).draw()
+            t3 = time.perf_counter()
+            out['samples'].setdefault(name, []).append((t3 - t0, t2 - t1))
+
+    outs = [{'samples': {}, 'rejected': collections.Counter()} for _ in range(max(1, workers))]
+    t_start = time.perf_counter()
+    if len(outs) == 1:
+        worker(0, outs[0])
+    else:
+        threads = [threading.Thread(target=worker, args=(i, o), name=f"LoadWorker-{i}") for i, o in enumerate(outs)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+    if shared['dirty']: save()
+    if backup is not None: backup.wait()
+    elapsed = time.perf_counter() - t_start
+
+    per_op, done = {}, 0
+    rejected = sum((o['rejected'] for o in outs), collections.Counter())
+    for name in sorted(set().union(*(o['samples'] for o in outs)) | set(rejected)):
+        runs = [x for o in outs for x in o['samples'].get(name, [])]
+        lat, hold = sorted(r[0] for r in runs), sorted(r[1] for r in runs)
+        done += len(runs)
+        per_op[name] = {"count": len(runs), "rejected": rejected[name]}
+        if runs:
+            per_op[name].update({"p50_ms": _percentile(lat, 0.5) * 1000, "p99_ms": _percentile(lat, 0.99) * 1000,
+                                 "max_ms": lat[-1] * 1000, "mean_ms": statistics.fmean(lat) * 1000,
+                                 "hold_p50_ms": _percentile(hold, 0.5) * 1000, "hold_p99_ms": _percentile(hold, 0.99) * 1000})
+    saves = sorted(shared['saves'])
+    end_size = os.path.getsize(path)
+    result = {
+        "meta": {"timestamp": datetime.datetime.now().isoformat(timespec='seconds'), "python": sys.version.split()[0],
+                 "workers": workers, "ops": len(ops), "save_every": save_every, "think_ms": think_ms,
+                 "storage": core.storage_format, "seed": seed},
+        "elapsed_s": elapsed, "completed": done, "rejected": sum(rejected.values()),
+        "throughput_ops_s": done / elapsed if elapsed else 0.0,
+        "ops": per_op,
+        "save": {"count": len(saves), "p50_ms": _percentile(saves, 0.5) * 1000 if saves else 0.0,
+                 "p99_ms": _percentile(saves, 0.99) * 1000 if saves else 0.0, "bytes_written": shared['bytes_written']},
+        "file": {"start_bytes": start_size, "end_bytes": end_size, "growth_bytes": end_size - start_size,
+                 "growth_per_1k_mutations": (end_size - start_size) * 1000 / shared['mutations'] if shared['mutations'] else 0.0},
+    }
+    log(f"{workers} 個工作站，完成 {done:,} 個操作 (拒絕 {result['rejected']:,})，{elapsed:.2f} 秒，"
+        f"{result['throughput_ops_s']:,.1f} ops/s")
+    log(f"{'操作':<12}{'次數':>8}{'拒絕':>6}{'p50 ms':>10}{'p99 ms':>10}{'最大 ms':>10}{'持鎖p50':>10}{'持鎖p99':>10}")
+    for name, r in per_op.items():
+        if not r['count']:
+            log(f"{name:<12}{0:>8}{r['rejected']:>6}")
+            continue
+        log(f"{name:<12}{r['count']:>8,}{r['rejected']:>6}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['max_ms']:>10.2f}"
+            f"{r['hold_p50_ms']:>10.2f}{r['hold_p99_ms']:>10.2f}")
+    log(f"存檔 {len(saves):,} 次 (p50 {result['save']['p50_ms']:.1f} ms / p99 {result['save']['p99_ms']:.1f} ms)，"
+        f"共寫入 {shared['bytes_written']:,} bytes")
+    log(f"資料檔 {start_size:,} -> {end_size:,} bytes (+{end_size - start_size:,}，"
+        f"每千個異動 +{result['file']['growth_per_1k_mutations']:,.0f})")
+    return result
+
+# ================= 月結報表 (Agg 後端，多行程平行產生) =================
+_REPORT_CTX = None
+
+def _report_worker_init(data_file, snapshot_file, storage_format):
+    """ 每個工作行程只載入一次資料，並依月份 / 品項預先分組，之後每張圖只取用自己那一組 """
+    global _REPORT_CTX
+    core = ERPCore(data_file=data_file, snapshot_file=snapshot_file, storage_format=storage_format)
+    sales_by_month, sales_by_month_item, ap_by_month = {}, {}, {}
+    for sale in core.data['sales_db']:
+        m = sale.date[:7]
+        sales_by_month.setdefault(m, []).append(sale)
+        sales_by_month_item.setdefault((m, sale.item), []).append(sale)
+    for a in core.data['ap_db']:
+        ap_by_month.setdefault(a.date[:7], []).append(a)
+    items = list(core.data['stock_db'])
+    for sale in core.data['sales_db']:
+        if sale['item'] not in core.data['stock_db'] and sale['item'] not in items: items.append(sale['item'])
+    _REPORT_CTX = {'core': core, 'sales': sales_by_month, 'sales_item': sales_by_month_item, 'ap': ap_by_month,
+                   'color': {item: i for i, item in enumerate(items)}}
+
+def _report_file_name(name):
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', name)
+
+def _save_figure(fig, path, fmt):
+    FigureCanvasAgg(fig)
+    fig.savefig(path, format=fmt)
+
+def _render_report_task(task):
+    """ 工作行程執行：('month', 月份) 產生當月總覽圖；('items', 月份, [品項...]) 產生單品圖。回傳 (寫出張數, 略過張數) """
+    ctx = _REPORT_CTX
+    core, out_dir, fmt = ctx['core'], task[-2], task[-1]
+    month = task[1]
+    month_dir = os.path.join(out_dir, month)
+    written = skipped = 0
+    if task[0] == 'month':
+        os.makedirs(month_dir, exist_ok=True)
+        sales, ap = ctx['sales'].get(month, []), ctx['ap'].get(month, [])
+        fig = core.figure_overview_pie(month, sales)
+        if fig is None: skipped += 1
+        else:
+            _save_figure(fig, os.path.join(month_dir, f"overview_pie.{fmt}"), fmt); written += 1
+        _save_figure(core.figure_financial_bar(month, ap, sales), os.path.join(month_dir, f"financial_bar.{fmt}"), fmt)
+        _save_figure(core.figure_trend_line(month), os.path.join(month_dir, f"trend_line.{fmt}"), fmt)
+        written += 2
+    else:
+        item_dir = os.path.join(month_dir, "items")
+        os.makedirs(item_dir, exist_ok=True)
+        for item in task[2]:
+            history = ctx['sales_item'].get((month, item))
+            if not history:
+                skipped += 1
+                continue
+            fig = core.figure_item_sales(item, history, ctx['color'].get(item, 0), title=f"【{item}】 {month} 銷售紀錄")
+            _save_figure(fig, os.path.join(item_dir, f"{_report_file_name(item)}.{fmt}"), fmt)
+            written += 1
+    return written, skipped
+
+def month_range(spec):
+    """ 解析月份參數："2025-01:2025-12" 或 "2025-01,2025-03"；空白 = 最近 12 個月 """
+    if not spec:
+        d, months = datetime.date.today().replace(day=1), []
+        for _ in range(12):
+            months.append(d.strftime("%Y-%m"))
+            d = (d - datetime.timedelta(days=1)).replace(day=1)
+        return months[::-1]
+    if ":" in spec:
+        start, end = spec.split(":")
+        y, m = map(int, start.split("-"))
+        months = []
+        while f"{y:04d}-{m:02d}" <= end:
+            months.append(f"{y:04d}-{m:02d}")
+            y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+        return months
+    return [x.strip() for x in spec.split(",") if x.strip()]
+
+def generate_reports(months, out_dir, items=None, fmt="png", workers=None, chunk=25,
+                     data_file=None, snapshot_file=None, storage_format=None, log=print):
+    """
+    以 Agg 後端產生月結圖表包：每月 3 張總覽 + 每個品項一張當月銷售圖。
+    工作依 (月份, 品項批次) 切開，交給 ProcessPoolExecutor；workers=1 則在本行程直接執行。
+    """
+    init_args = (data_file, snapshot_file, storage_format)
+    # 先在主行程載入一次：取得品項清單，且需要遷移時只由這裡寫回，工作行程讀到的都是最新版
+    _report_worker_init(*init_args)
+    if items is None: items = list(_REPORT_CTX['color'])
+    tasks = []
+    for month in months:
+        tasks.append(('month', month, out_dir, fmt))
+        for i in range(0, len(items), chunk):
+            tasks.append(('items', month, items[i:i + chunk], out_dir, fmt))
+
+    t0 = time.perf_counter()
+    written = skipped = 0
+    if workers == 1:
+        results = map(_render_report_task, tasks)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_report_worker_init, initargs=init_args)
+        futures = [pool.submit(_render_report_task, t) for t in tasks]
+        results = (f.result() for f in as_completed(futures))
+    try:
+        for done, (w, sk) in enumerate(results, 1):
+            written += w
+            skipped += sk
+            if done % 50 == 0 or done == len(tasks):
+                log(f"  {done}/{len(tasks)} 批次完成，已輸出 {written} 張")
+    finally:
+        if workers != 1: pool.shutdown(cancel_futures=True)
+    elapsed = time.perf_counter() - t0
+    log(f"完成：{len(months)} 個月 × {len(items)} 品項，輸出 {written} 張、略過 {skipped} 張 (無資料)，耗時 {elapsed:.1f} 秒 -> {out_dir}")
+    return {'written': written, 'skipped': skipped, 'seconds': elapsed}
+
+# ================= 命令列工具 =================
+def cmd_snapshot(args):
+    """ JSON -> 二進位快照 (遷移在此時一次完成) """
+    with open(args.src, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    apply_migrations(data)
+    write_snapshot(data, args.dst)
+    print(f"已寫入快照: {args.dst} ({os.path.getsize(args.dst):,} bytes)")
+
+def cmd_export_json(args):
+    """ 二進位快照 -> JSON 交換檔 """
+    if os.path.exists(args.dst) and not args.force:
+        print(f"{args.dst} 已存在，未匯出 (加上 --force 才會覆寫)")
+        return
+    data = read_snapshot(args.src)
+    write_json_file(data, args.dst)
+    print(f"已匯出 JSON: {args.dst}")
+
+def cmd_migrate(args):
+    """ 將資料檔升級到目前的結構版本 (讀一次、逐筆處理一次、寫一次) """
+    with open(args.src, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    migrated = apply_migrations(data)
+    if not migrated:
+        print(f"{args.src} 已是第 {data.get('schema_version', 0)} 版，不需遷移")
+        return
+    write_json_file(data, args.dst or args.src)
+    for m in MIGRATIONS:
+        if m['version'] in migrated: print(f"  v{m['version']}: {m['description']}")
+    print(f"已升級至第 {data['schema_version']} 版: {args.dst or args.src}")
+
+def cmd_bench(args):
+    """ 執行效能測試，輸出 JSON，並可與先前結果比較 """
+    sizes = [int(x.replace("_", "")) for x in args.sizes.split(",")]
+    result = run_benchmarks(sizes, repeat=args.repeat, use_tk=not args.no_tk, seed=args.seed)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"結果已寫入: {args.out}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_benchmarks(baseline, result, args.threshold)
+        if regressions:
+            print(f"發現 {len(regressions)} 項效能退步 (門檻 {args.threshold:.0%})")
+            sys.exit(1)
+
+def cmd_report(args):
+    """ 不需顯示器，產生月結圖表 (PNG / PDF) """
+    items = [x.strip() for x in args.items.split(",") if x.strip()] if args.items else None
+    generate_reports(month_range(args.months), args.out, items=items, fmt=args.format, workers=args.workers,
+                     chunk=args.chunk, data_file=args.data, storage_format=args.storage)
+
+def cmd_check(args):
+    """ 對帳檢查：列出差異，有差異時結束代碼為 1 (可放進排程) """
+    t0 = time.perf_counter()
+    core = ERPCore(data_file=args.data, storage_format=args.storage)
+    t1 = time.perf_counter()
+    core.recon.rebuild(core.data, core.po_by_id, core.stock)
+    t2 = time.perf_counter()
+    counts = core.recon.summary()
+    print(f"載入 {t1 - t0:.2f} 秒，對帳 {t2 - t1:.2f} 秒")
+    if not counts:
+        print("帳目一致，沒有差異")
+        return
+    for kind, n in counts.items(): print(f"  {kind}: {n}")
+    for r in core.recon.rows()[:args.limit]:
+        print(f"  [{r['kind']}] {r['target']}  預期 {r['expected']}  實際 {r['actual']}  ({r['note']})")
+    sys.exit(1)
+
+def cmd_bench_records(args):
+    """ dict 與 Record 的記憶體 / 速度比較 """
+    result = compare_record_layouts(int(args.n.replace("_", "")), seed=args.seed, repeat=args.repeat)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"結果已寫入: {args.out}")
+
+def cmd_backup(args):
+    """ 備份一次：與上一個備份點比較出差異 (--full 或尚無完整備份時做完整備份) """
+    core = ERPCore(data_file=args.data, storage_format=args.storage)
+    manager = BackupManager(core, args.dir)
+    t0 = time.perf_counter()
+    if not args.full and any(p[1] == 'full' for p in backup_points(args.dir)):
+        previous, _, _ = restore_backup(args.dir)
+        manager.mark_all_dirty(previous)
+    name = manager.backup(full=args.full)
+    manager.close()
+    if name is None:
+        print(f"備份失敗: {manager.last_error}" if manager.last_error else "自上次備份後沒有異動")
+        if manager.last_error: sys.exit(1)
+        return
+    print(f"已寫入 {os.path.join(args.dir, name)} ({os.path.getsize(os.path.join(args.dir, name)):,} bytes, {time.perf_counter() - t0:.2f} 秒)")
+
+def cmd_restore(args):
+    """ 列出備份點，或還原到指定時間點並寫出資料檔 (不會覆寫目前的資料檔，除非 --out 指定) """
+    if args.list:
+        for stamp, kind, fmt, path in backup_points(args.dir):
+            print(f"  {stamp:%Y-%m-%d %H:%M:%S}  {'完整' if kind == 'full' else '差異'}  {os.path.getsize(path):>12,} bytes  {os.path.basename(path)}")
+        return
+    at = datetime.datetime.fromisoformat(args.at) if args.at else None
+    t0 = time.perf_counter()
+    data, stamp, n_deltas = restore_backup(args.dir, at)
+    out = args.out or f"{os.path.splitext(DATA_FILE)[0]}.restored-{stamp:%Y%m%d-%H%M%S}.json"
+    if out.endswith(".erpb"): write_snapshot(data, out)
+    else: write_json_file(data, out)
+    print(f"已還原到 {stamp:%Y-%m-%d %H:%M:%S} (完整備份 + {n_deltas} 份差異)：{out}，{time.perf_counter() - t0:.2f} 秒")
+
+def cmd_loadtest(args):
+    """ 在資料檔的暫存副本上執行操作流 (不會動到原檔) """
+    with tempfile.TemporaryDirectory() as tmp:
+        json_file, snap_file = os.path.join(tmp, "loadtest.json"), os.path.join(tmp, "loadtest.erpb")
+        if args.data:
+            shutil.copyfile(args.data, json_file)
+        else:
+            write_json_file(generate_synthetic_data(int(args.synthetic.replace("_", "")), seed=args.seed), json_file)
+        core = ERPCore(data_file=json_file, snapshot_file=snap_file, storage_format=args.storage)
+        if args.workload:
+            ops = [op for op in read_workload(args.workload) if op['op'] in LOADTEST_MIX or op['op'] == 'po_delete']
+        else:
+            mix = {k: int(v) for k, v in (x.split("=") for x in args.mix.split(","))} if args.mix else None
+            ops = synthetic_workload(core.data, int(args.ops.replace("_", "")), mix, args.seed)
+        if args.record:
+            write_workload(ops, args.record)
+            print(f"操作流已寫入: {args.record}")
+        backup = BackupManager(core, os.path.join(tmp, "backups")) if args.backup_every else None
+        result = run_workload(core, ops, workers=args.workers, save_every=args.save_every, think_ms=args.think_ms,
+                              backup=backup, backup_every=args.backup_every, seed=args.seed)
+        if backup is not None: backup.close()
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"結果已寫入: {args.out}")
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="倉庫庫存管理系統 (不帶參數則開啟視窗介面)")
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("snapshot", help="將 JSON 資料轉成二進位快照")
+    p.add_argument("src", nargs="?", default=DATA_FILE)
+    p.add_argument("dst", nargs="?", default=SNAPSHOT_FILE)
+    p.set_defaults(func=cmd_snapshot)
+
+    p = sub.add_parser("export-json", help="將二進位快照匯出成 JSON 交換檔")
+    p.add_argument("src", nargs="?", default=SNAPSHOT_FILE)
+    p.add_argument("dst", nargs="?", default=EXPORT_FILE)
+    p.add_argument("--force", action="store_true", help="目的檔已存在時仍覆寫")
+    p.set_defaults(func=cmd_export_json)
+
+    p = sub.add_parser("migrate", help="將資料檔升級到目前的結構版本")
+    p.add_argument("src", nargs="?", default=DATA_FILE)
+    p.add_argument("dst", nargs="?", help="輸出檔 (預設覆寫原檔)")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("bench", help="以合成資料測量核心操作的效能")
+    p.add_argument("--sizes", default="1000,10000,100000", help="採購單筆數，以逗號分隔 (可到 1000000)")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--no-tk", action="store_true", help="只測邏輯層，不建立 Tk 視窗")
+    p.add_argument("--out", help="結果 JSON 輸出路徑")
+    p.add_argument("--compare", help="與先前的結果 JSON 比較")
+    p.add_argument("--threshold", type=float, default=0.2, help="判定退步的比例 (預設 0.2 = 慢 20%%)")
+    p.set_defaults(func=cmd_bench)
+
+    p = sub.add_parser("bench-records", help="比較 dict 與 __slots__ 資料列的記憶體與迴圈速度")
+    p.add_argument("--n", default="500000", help="採購單與銷貨筆數")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out", help="結果 JSON 輸出路徑")
+    p.set_defaults(func=cmd_bench_records)
+
+    p = sub.add_parser("report", help="以 Agg 後端平行產生月結圖表包")
+    p.add_argument("--months", help="月份範圍 2025-01:2025-12 或逗號清單 (預設最近 12 個月)")
+    p.add_argument("--items", help="品項，以逗號分隔 (預設全部)")
+    p.add_argument("--out", default="reports", help="輸出資料夾")
+    p.add_argument("--format", choices=["png", "pdf"], default="png")
+    p.add_argument("--workers", type=int, help="工作行程數 (預設 CPU 核心數；1 = 不開子行程)")
+    p.add_argument("--chunk", type=int, default=25, help="每個工作批次的品項數")
+    p.add_argument("--data", help="資料檔 (預設 %s)" % DATA_FILE)
+    p.add_argument("--storage", choices=["json", "binary"], help="讀取格式 (預設 %s)" % STORAGE_FORMAT)
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser("check", help="對帳檢查 (庫存、收貨量、AP 金額)")
+    p.add_argument("--data", help="資料檔 (預設 %s)" % DATA_FILE)
+    p.add_argument("--storage", choices=["json", "binary"], help="讀取格式 (預設 %s)" % STORAGE_FORMAT)
+    p.add_argument("--limit", type=int, default=50, help="最多列出幾筆差異")
+    p.set_defaults(func=cmd_check)
+
+    p = sub.add_parser("backup", help="差異備份 (gzip) 到備份資料夾")
+    p.add_argument("--full", action="store_true", help="強制做完整備份")
+    p.add_argument("--dir", default=BACKUP_DIR, help="備份資料夾 (預設 %s)" % BACKUP_DIR)
+    p.add_argument("--data", help="資料檔 (預設 %s)" % DATA_FILE)
+    p.add_argument("--storage", choices=["json", "binary"], help="讀取格式 (預設 %s)" % STORAGE_FORMAT)
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("restore", help="還原到某個時間點的資料")
+    p.add_argument("--at", help="時間點，例如 \"2025-03-01 14:30\" (預設最新)")
+    p.add_argument("--list", action="store_true", help="只列出備份點")
+    p.add_argument("--dir", default=BACKUP_DIR, help="備份資料夾 (預設 %s)" % BACKUP_DIR)
+    p.add_argument("--out", help="輸出檔 (.json 或 .erpb；預設另存新檔，不覆寫目前的資料檔)")
+    p.set_defaults(func=cmd_restore)
+
+    p = sub.add_parser("loadtest", help="重播或合成操作流 (可多個工作站同時)，測量吞吐量與各操作延遲")
+    p.add_argument("--data", help="起始資料檔 (會複製一份使用；預設以 --synthetic 產生)")
+    p.add_argument("--synthetic", default="10000", help="沒有 --data 時，合成資料的採購單筆數")
+    p.add_argument("--workload", help="要重播的操作流 (JSON Lines，ERP_RECORD_OPS 記錄或 --record 產生)")
+    p.add_argument("--ops", default="2000", help="合成操作流的操作數")
+    p.add_argument("--mix", help="操作比例，例如 sale=40,receive=20,dashboard=10 (預設 %s)" %
+                   ",".join(f"{k}={v}" for k, v in LOADTEST_MIX.items()))
+    p.add_argument("--record", help="將這次的操作流存成 JSON Lines，之後可用 --workload 重播")
+    p.add_argument("--workers", type=int, default=1, help="同時操作的工作站 (執行緒) 數")
+    p.add_argument("--save-every", type=int, default=1, help="每幾個異動存檔一次 (1 = 視窗版行為，0 = 只在最後存檔)")
+    p.add_argument("--think-ms", type=float, default=0.0, help="每個工作站兩次操作間的平均間隔 (毫秒)")
+    p.add_argument("--backup-every", type=int, default=0, help="每幾個異動做一次差異備份 (0 = 不備份)")
+    p.add_argument("--storage", choices=["json", "binary"], help="存檔格式 (預設 %s)" % STORAGE_FORMAT)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out", help="結果 JSON 輸出路徑")
+    p.set_defaults(func=cmd_loadtest)
+    return parser
+
+def run_gui():
     root = tk.Tk()
     # 嘗試開啟 DPI 感知，讓高解析度螢幕顯示更清晰
     try:
@@ -1049,3 +4747,9 @@ if __name__ == "__main__":
         pass
     app = AdvancedERPSystem(root)
     root.mainloop()
+
+# ================= 主程式進入點 =================
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    if args.command: args.func(args)
+    else: run_gui()
@@ -0,0 +1,38 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _load_erp():
+    """ 01.py 檔名以數字開頭，不能直接 import，改用 importlib 載入 """
+    if "erp" in sys.modules: return sys.modules["erp"]
+    spec = importlib.util.spec_from_file_location("erp", os.path.join(ROOT, "01.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["erp"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def erp():
+    return _load_erp()
+
+
+@pytest.fixture
+def core(erp, tmp_path):
+    """ 空白的核心物件，資料檔放在暫存目錄 (不會碰到專案裡的資料檔) """
+    return erp.ERPCore(data_file=str(tmp_path / "data.json"), snapshot_file=str(tmp_path / "data.erpb"), autoload=False)
+
+
+@pytest.fixture
+def make_po():
+    def make(po_id, item="螺絲", qty=10, vendor="甲廠", price=2.0, delivery_date="2026-01-10", **extra):
+        po = {'id': po_id, 'item': item, 'qty': qty, 'vendor': vendor, 'price': price, 'date': "2026-01-01",
+              'delivery_date': delivery_date, 'status': 'Open', 'received_qty': 0, 'email_status': '未傳送'}
+        po.update(extra)
+        return po
+    return make
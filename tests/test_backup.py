@@ -0,0 +1,83 @@
+import datetime
+import json
+import time
+
+
+def _plain(erp, data):
+    return json.loads(json.dumps(data, default=erp._json_default))
+
+
+def _record_points(erp, core, backups, steps):
+    """ 每一步做完就備份，記下 (時間, 當下資料)；時間取在備份之後，還原到該時間應得到同樣的資料 """
+    points = []
+    for step in steps:
+        step()
+        assert backups.backup() is not None
+        time.sleep(0.002)
+        points.append((datetime.datetime.now(), _plain(erp, core.data)))
+        time.sleep(0.002)
+    backups.wait()
+    return points
+
+
+def test_restore_to_each_point(erp, core, make_po, tmp_path):
+    core.save_data()
+    folder = str(tmp_path / "backups")
+    backups = erp.BackupManager(core, folder, full_every=3)
+
+    def receive(po_id, qty):
+        return lambda: core.receive_po(core.po_by_id[po_id], qty, qty * 2.0)
+    steps = [
+        lambda: core.add_po(make_po("PO1")),
+        lambda: core.add_po(make_po("PO2", item="CPU-i9")),
+        receive("PO1", 4),
+        lambda: core.record_sale("螺絲", 1, 9.0, "2026-01-20"),
+        lambda: core.add_location("B倉"),                  # 沒有庫存的新倉庫
+        lambda: core.transfer_stock("螺絲", 2, erp.DEFAULT_LOCATION, "B倉"),
+        lambda: core.remove_po(1),
+        lambda: core.pay_ap([core.data['ap_db'][0].id]),
+    ]
+    points = _record_points(erp, core, backups, steps)
+    kinds = [p[1] for p in erp.backup_points(folder)]
+    assert kinds[0] == 'full' and 'delta' in kinds
+
+    for at, expected in points:
+        data, _, _ = erp.restore_backup(folder, at)
+        assert _plain(erp, data) == expected
+
+
+def test_delta_keeps_empty_location(erp, core, tmp_path):
+    core.save_data()
+    folder = str(tmp_path / "backups")
+    backups = erp.BackupManager(core, folder)
+    backups.backup()
+    core.add_location("C倉")
+    name = backups.backup()
+    backups.wait()
+    assert ".delta." in name
+    data, _, applied = erp.restore_backup(folder)
+    assert applied == 1
+    assert data['stock_loc_db']["C倉"] == {} and "C倉" in data['locations']
+
+
+def test_backup_refuses_after_failed_load(erp, tmp_path):
+    path = tmp_path / "data.json"
+    path.write_text('{"po_db": [', encoding="utf-8")
+    core = erp.ERPCore(data_file=str(path))
+    assert core.load_error is not None
+    assert core.save_data() is False
+    assert erp.BackupManager(core, str(tmp_path / "backups")).backup() is None
+    assert path.read_text(encoding="utf-8") == '{"po_db": ['
+
+
+def test_startup_base_reuses_data_file(erp, core, make_po, tmp_path):
+    core.add_po(make_po("PO1"))
+    core.save_data()
+    loaded = erp.ERPCore(data_file=core.data_file, snapshot_file=core.snapshot_file)
+    before = (tmp_path / "data.json").stat().st_mtime_ns
+    backups = erp.BackupManager(loaded, str(tmp_path / "backups"))
+    assert ".full." in backups.backup()
+    backups.wait()
+    assert (tmp_path / "data.json").stat().st_mtime_ns == before
+    data, _, _ = erp.restore_backup(str(tmp_path / "backups"))
+    assert _plain(erp, data) == _plain(erp, loaded.data)
@@ -0,0 +1,59 @@
+import json
+
+
+def _legacy_data():
+    """ v19 時期的資料檔：沒有 schema_version、缺欄位、AP 只有文字摘要、單一倉庫 """
+    return {
+        'po_db': [{'id': "PO1", 'item': "螺絲", 'qty': 10, 'vendor': "甲廠", 'price': 2, 'date': "2026-01-01",
+                   'status': 'Open'}],
+        'stock_db': {"螺絲": 7, "CPU-i9": 5},
+        'ap_db': [{'id': "AP1", 'po_ref': "PO1", 'date': "2026-01-05", 'vendor': "甲廠", 'desc': "進貨 螺絲 x4", 'amt': 8},
+                  {'id': "AP2", 'po_ref': "", 'date': "2026-01-06", 'vendor': "乙廠", 'desc': "運費", 'amt': 100}],
+        'sales_db': [{'item': "螺絲", 'qty': 1, 'date': "2026-01-07"}],
+    }
+
+
+def test_migrates_v0_to_current(erp):
+    data = _legacy_data()
+    assert erp.apply_migrations(data) == [1, 2, 3, 4, 5]
+    assert data['schema_version'] == erp.SCHEMA_VERSION == 5
+
+    po = data['po_db'][0]
+    assert po['received_qty'] == 0 and po['email_status'] == '未傳送' and po['source'] == '直接輸入'
+    assert data['vendor_contacts'] == {}
+    assert data['ap_db'][0]['status'] == 'Unpaid'
+    assert (data['ap_db'][0]['item'], data['ap_db'][0]['qty'], data['ap_db'][0]['location']) == ("螺絲", 4, erp.DEFAULT_LOCATION)
+    assert 'item' not in data['ap_db'][1] and 'location' not in data['ap_db'][1]
+    assert data['sales_db'][0]['location'] == erp.DEFAULT_LOCATION
+    assert data['locations'] == [erp.DEFAULT_LOCATION]
+    assert data['stock_loc_db'] == {erp.DEFAULT_LOCATION: {"螺絲": 7, "CPU-i9": 5}}
+    # 期初 = 現有 7 - (進貨 4 - 銷貨 1)
+    assert data['opening_stock'] == {erp.DEFAULT_LOCATION: {"螺絲": 4, "CPU-i9": 5}}
+
+
+def test_migrations_run_once(erp):
+    data = _legacy_data()
+    erp.apply_migrations(data)
+    before = json.dumps(data, sort_keys=True)
+    assert erp.apply_migrations(data) == []
+    assert json.dumps(data, sort_keys=True) == before
+
+
+def test_migrates_from_v1(erp):
+    data = _legacy_data()
+    data['schema_version'] = 1
+    data['vendor_contacts'] = {"甲廠": "a@example.com"}
+    assert erp.apply_migrations(data) == [2, 3, 4, 5]
+    assert data['vendor_contacts'] == {"甲廠": "a@example.com"}
+    assert 'received_qty' not in data['po_db'][0]        # v1 的逐筆補欄位不會重跑
+    assert data['ap_db'][0]['qty'] == 4
+    assert data['opening_stock'][erp.DEFAULT_LOCATION]["螺絲"] == 4
+
+
+def test_load_migrates_and_writes_back(erp, tmp_path):
+    path = tmp_path / "data.json"
+    path.write_text(json.dumps(_legacy_data(), ensure_ascii=False), encoding="utf-8")
+    core = erp.ERPCore(data_file=str(path))
+    assert core.load_error is None
+    assert json.loads(path.read_text(encoding="utf-8"))['schema_version'] == erp.SCHEMA_VERSION
+    assert core.stock.qty(erp.DEFAULT_LOCATION, "螺絲") == 7
@@ -0,0 +1,50 @@
+import pytest
+
+
+def test_pinned_po_closed_by_another_receipt(erp, core, make_po):
+    core.add_po(make_po("PO1", qty=5))
+    s = erp.ScanSession(core)
+    assert s.scan("PO1")[0] == 'info'
+    assert s.scan("螺絲")[0] == 'ok'
+
+    core.receive_po(core.po_by_id["PO1"], 5, 10.0)   # 同時在別處收完，採購單結案
+    assert "螺絲" not in core.open_pos
+    status, msg, _ = s.scan("螺絲")
+    assert status == 'error' and "PO1 已結案" in msg
+    assert s.po_context is None
+    with pytest.raises(ValueError, match="PO1 已結案"):
+        s.commit()
+    assert core.po_by_id["PO1"].received_qty == 5
+
+
+def test_pinned_po_deleted(erp, core, make_po):
+    core.add_po(make_po("PO1"))
+    core.add_po(make_po("PO2"))
+    s = erp.ScanSession(core)
+    s.scan("PO2")
+    core.remove_po(1)
+    status, msg, _ = s.scan("螺絲")
+    assert status == 'error' and "PO2 已結案" in msg
+    # 取消指定單號後，改依交期分配到仍未結案的 PO1
+    assert s.scan("螺絲")[0] == 'ok'
+    (ap,) = s.commit()
+    assert ap.po_ref == "PO1"
+
+
+def test_scanning_closed_po_is_rejected(erp, core, make_po):
+    core.add_po(make_po("PO1", qty=2))
+    core.receive_po(core.po_by_id["PO1"], 2, 4.0)
+    s = erp.ScanSession(core)
+    assert s.scan("PO1") == ('error', "PO1 已結案", None)
+    assert s.scan("螺絲")[0] == 'error'
+
+
+def test_receive_splits_by_delivery_date(erp, core, make_po):
+    core.add_po(make_po("PO-late", qty=5, delivery_date="2026-03-01"))
+    core.add_po(make_po("PO-early", qty=3, delivery_date="2026-02-01"))
+    s = erp.ScanSession(core)
+    assert s.scan("螺絲*6")[0] == 'ok'
+    assert s.scan("螺絲*3")[0] == 'error'                 # 超過未交總量 8
+    created = s.commit()
+    assert [(a.po_ref, a.qty) for a in created] == [("PO-early", 3), ("PO-late", 3)]
+    assert core.po_by_id["PO-early"].status == 'Closed'
@@ -0,0 +1,35 @@
+import copy
+
+
+def _state(stats):
+    return copy.deepcopy(stats.vendors), copy.deepcopy(stats.prices), stats.total_spend
+
+
+def test_rebuild_matches_incremental(core, make_po):
+    core.add_po(make_po("PO1", qty=10))
+    core.add_po(make_po("PO2", item="螺帽", qty=5, vendor="乙廠", delivery_date="2999-12-31"))
+    core.add_po(make_po("PO3", qty=4, delivery_date="不是日期"))
+    core.receive_po(core.po_by_id["PO1"], 0, 0)       # 數量 0 的收貨 (只有金額)
+    core.receive_po(core.po_by_id["PO1"], 4, 8.0)
+    core.receive_po(core.po_by_id["PO1"], 6, 13.0)
+    core.receive_po(core.po_by_id["PO2"], 5, 15.0)
+    core.receive_po(core.po_by_id["PO3"], 2, 4.0)
+    edited = dict(core.po_by_id["PO3"], qty=8)
+    core.replace_po(core.data['po_db'].index(core.po_by_id["PO3"]), edited)
+
+    live = _state(core.vendor_stats)
+    core.rebuild_indexes()
+    assert _state(core.vendor_stats) == live
+
+
+def test_zero_qty_receipt_counts_without_unit_price(core, make_po):
+    core.add_po(make_po("PO1"))
+    core.receive_po(core.po_by_id["PO1"], 0, 5.0)
+    v = core.vendor_stats.vendors["甲廠"]
+    assert v['receipts'] == 1 and v['spend'] == 5.0
+    assert core.vendor_stats.prices == {}
+
+    core.rebuild_indexes()
+    v = core.vendor_stats.vendors["甲廠"]
+    assert v['receipts'] == 1 and v['spend'] == 5.0
+    assert core.vendor_stats.prices == {}
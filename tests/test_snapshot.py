@@ -0,0 +1,45 @@
+import argparse
+import json
+
+import pytest
+
+
+def _plain(erp, data):
+    return json.loads(json.dumps(data, default=erp._json_default))
+
+
+@pytest.fixture
+def busy_core(core, make_po):
+    core.add_po(make_po("PO1", qty=10))
+    core.add_po(make_po("PO2", item="主機板", vendor="乙廠", price=1234.5, mfg_date=""))
+    core.receive_po(core.po_by_id["PO1"], 4, 8.0)
+    core.record_sale("螺絲", 2, 9.5, "2026-01-20")
+    core.add_location("B倉")
+    core.transfer_stock("螺絲", 1, core.data['locations'][0], "B倉")
+    core.data['vendor_contacts']["甲廠"] = "a@example.com"
+    core.data['po_db'][1]['note'] = None                    # 只有部分列才有的欄位
+    return core
+
+
+def test_snapshot_round_trip(erp, busy_core, tmp_path):
+    path = str(tmp_path / "data.erpb")
+    erp.write_snapshot(busy_core.data, path)
+    assert _plain(erp, erp.read_snapshot(path)) == _plain(erp, busy_core.data)
+
+
+def test_binary_storage_loads_same_data(erp, busy_core, tmp_path):
+    busy_core.storage_format = "binary"
+    assert busy_core.save_data()
+    loaded = erp.ERPCore(data_file=busy_core.data_file, snapshot_file=busy_core.snapshot_file, storage_format="binary")
+    assert loaded.load_error is None
+    assert _plain(erp, loaded.data) == _plain(erp, busy_core.data)
+
+
+def test_export_json_does_not_overwrite_without_force(erp, busy_core, tmp_path):
+    snap, dst = str(tmp_path / "data.erpb"), tmp_path / "out.json"
+    erp.write_snapshot(busy_core.data, snap)
+    dst.write_text("keep", encoding="utf-8")
+    erp.cmd_export_json(argparse.Namespace(src=snap, dst=str(dst), force=False))
+    assert dst.read_text(encoding="utf-8") == "keep"
+    erp.cmd_export_json(argparse.Namespace(src=snap, dst=str(dst), force=True))
+    assert json.loads(dst.read_text(encoding="utf-8")) == _plain(erp, busy_core.data)